@@ -0,0 +1,358 @@
+"""
+Cache PCM đã decode, dùng chung cho mọi zone phát nhạc
+Hot tracks stay in RAM under an LRU budget; evicted ones spill to raw
+float32 .pcm files that are memory-mapped back, so a repeat play never
+decodes the file again
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import partial
+
+import numpy as np
+import soundfile as sf
+
+from audio_stream import StreamingAudioSource, clip_range
+from resample import convert_pcm
+
+CACHE_DIR = 'audio_cache'
+CACHE_MAX_BYTES = 128 * 1024 * 1024        # PCM giữ trong RAM
+CACHE_MAX_DISK_BYTES = 2 * 1024 ** 3       # File .pcm trên đĩa
+CACHE_MAX_TRACK_SECONDS = 15 * 60          # Bài dài hơn chỉ stream, không cache
+JINGLE_MAX_SECONDS = 120                   # Thông báo / chuông dài hơn không giữ trong RAM
+
+
+class CachedAudioSource:
+    """Source over an already decoded (frames, channels) float32 array.
+
+    ``pcm`` may be an np.memmap; read_into slices it without a copy
+    other than the one into the output block.
+    """
+
+    def __init__(self, path, pcm, samplerate):
+        self.path = path
+        self.pcm = pcm
+        self.samplerate = samplerate
+        self.channels = pcm.shape[1]
+        self.frames = len(pcm)
+        self.position = 0
+        self.error = None
+        self.gain = 1.0
+
+    def wait_ready(self, frames=None, timeout=2.0):
+        return True
+
+    def read_into(self, out):
+        """Fill out[:n] with the next frames, return n"""
+        n = min(len(out), self.frames - self.position)
+        out[:n] = self.pcm[self.position:self.position + n]
+        self.position += n
+        return n
+
+    @property
+    def finished(self):
+        return self.position >= self.frames
+
+    @property
+    def remaining(self):
+        return self.frames - self.position
+
+    def close(self):
+        pass
+
+
+class _Capture:
+    """Collects the blocks a StreamingAudioSource decodes for the cache.
+
+    Tracks that fit one RAM entry are gathered in a preallocated array,
+    bigger ones are written straight to a .pcm file so capturing never
+    holds more than max_entry_bytes.
+    """
+
+    def __init__(self, cache, key, samplerate, channels, frames):
+        self.cache = cache
+        self.key = key
+        self.samplerate = samplerate
+        self.channels = channels
+        self.written = 0
+        self.pcm = None
+        self.file = None
+        if frames * channels * 4 <= cache.max_entry_bytes:
+            self.pcm = np.empty((frames, channels), dtype='float32')
+        else:
+            self.tmp_path = cache.spill_path(key, samplerate, channels) + '.part'
+            self.file = open(self.tmp_path, 'wb')
+
+    def write(self, chunk):
+        n = len(chunk)
+        if self.pcm is not None:
+            if self.written + n > len(self.pcm):
+                # Header frame count was short (some MP3s), not worth a resize
+                raise ValueError("more frames than the header announced")
+            self.pcm[self.written:self.written + n] = chunk
+        else:
+            self.file.write(np.ascontiguousarray(chunk).tobytes())
+        self.written += n
+
+    def finish(self):
+        if self.pcm is not None:
+            self.cache.put(self.key, self.pcm[:self.written], self.samplerate)
+        else:
+            self.file.close()
+            self.cache.add_spilled(self.key, self.tmp_path, self.samplerate,
+                                   self.channels, self.written)
+
+    def abort(self):
+        self.pcm = None
+        if self.file is not None:
+            self.file.close()
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+
+
+class DecodedAudioCache:
+    """Decoded PCM keyed by (path, mtime), shared by every zone's player.
+
+    Two LRU tiers: arrays in RAM up to ``max_bytes``, and raw float32
+    files in ``cache_dir`` up to ``max_disk_bytes``. An entry evicted from
+    RAM is spilled to disk and served from then on through np.memmap, so
+    its pages come from the OS cache instead of the decoder. Spilled files
+    are named after the key and survive restarts.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=CACHE_MAX_BYTES,
+                 max_disk_bytes=CACHE_MAX_DISK_BYTES, max_track_seconds=CACHE_MAX_TRACK_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 4
+        self.max_disk_bytes = max_disk_bytes
+        self.max_track_seconds = max_track_seconds
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (pcm, samplerate)
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> (file path, samplerate, channels, frames)
+        self._disk_bytes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_spilled()
+
+    @staticmethod
+    def key(path):
+        """Cache key, a changed file gets a new key"""
+        digest = hashlib.sha1(f"{path}\0{os.path.getmtime(path)!r}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def spill_path(self, key, samplerate, channels):
+        return os.path.join(self.cache_dir, f"{key}_{samplerate}_{channels}.pcm")
+
+    def _load_spilled(self):
+        """Index the .pcm files left by earlier runs, oldest first"""
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            name = entry.name
+            try:
+                if name.endswith('.part'):
+                    os.remove(entry.path)  # Interrupted capture
+                    continue
+                if not name.endswith('.pcm'):
+                    continue
+                key, samplerate, channels = name[:-4].rsplit('_', 2)
+                st = entry.stat()
+                files.append((st.st_mtime, key, entry.path, int(samplerate), int(channels), st.st_size))
+            except (ValueError, OSError):
+                continue
+        for _, key, path, samplerate, channels, size in sorted(files):
+            self._disk[key] = (path, samplerate, channels, size // (4 * channels))
+            self._disk_bytes += size
+
+    @property
+    def hit_rate(self):
+        """Share of opens served without decoding"""
+        total = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / total if total else 0.0
+
+    def open(self, path, offset=0.0, duration=None):
+        """Return a source for path, from RAM or disk when possible
+
+        offset and duration (seconds) play only that part: a cached track
+        is sliced without a copy, otherwise only the part is decoded and,
+        being partial, not captured.
+        """
+        key = self.key(path)
+        with self._lock:
+            entry = self._memory.get(key)
+            spilled = self._disk.get(key) if entry is None else None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+            elif spilled is not None:
+                self._disk.move_to_end(key)
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+
+        if entry is not None:
+            return self._slice(path, *entry, offset, duration)
+        if spilled is not None:
+            file_path, samplerate, channels, frames = spilled
+            try:
+                os.utime(file_path)  # Keeps the LRU order across restarts
+                pcm = np.memmap(file_path, dtype='float32', mode='r', shape=(frames, channels))
+                return self._slice(path, pcm, samplerate, offset, duration)
+            except (OSError, ValueError) as e:
+                print(f"Lỗi đọc cache {file_path}: {e}")
+                self._drop_spilled(key)
+
+        if offset or duration is not None:
+            return StreamingAudioSource(path, offset=offset, duration=duration)
+        # Captured while it streams, then played from the cache next time
+        return StreamingAudioSource(path, capture=partial(self._capture, key))
+
+    @staticmethod
+    def _slice(path, pcm, samplerate, offset, duration):
+        start, count = clip_range(len(pcm), samplerate, offset, duration)
+        return CachedAudioSource(path, pcm[start:start + count], samplerate)
+
+    def _capture(self, key, samplerate, channels, frames):
+        """Capture factory for StreamingAudioSource, None = do not cache"""
+        if frames <= 0 or frames > self.max_track_seconds * samplerate:
+            return None
+        if frames * channels * 4 > self.max_entry_bytes and not self.cache_dir:
+            return None
+        return _Capture(self, key, samplerate, channels, frames)
+
+    def put(self, key, pcm, samplerate):
+        """Store a decoded track in RAM, spilling least recently used ones"""
+        evicted = []
+        with self._lock:
+            if key in self._memory or key in self._disk:
+                return
+            self._memory[key] = (pcm, samplerate)
+            self._memory_bytes += pcm.nbytes
+            while self._memory_bytes > self.max_bytes:
+                old_key, (old, old_rate) = self._memory.popitem(last=False)
+                self._memory_bytes -= old.nbytes
+                evicted.append((old_key, old, old_rate))
+
+        # Disk writes happen outside the lock, opens keep being served
+        for old_key, old, old_rate in evicted:
+            self.spill(old_key, old, old_rate)
+
+    def spill(self, key, pcm, samplerate):
+        """Write an evicted entry to its .pcm file"""
+        if not self.cache_dir or len(pcm) == 0:
+            return
+        tmp_path = self.spill_path(key, samplerate, pcm.shape[1]) + '.part'
+        try:
+            pcm.tofile(tmp_path)
+            self.add_spilled(key, tmp_path, samplerate, pcm.shape[1], len(pcm))
+        except OSError as e:
+            print(f"Lỗi ghi cache {tmp_path}: {e}")
+
+    def add_spilled(self, key, tmp_path, samplerate, channels, frames):
+        """Publish a finished .part file as a disk entry"""
+        path = tmp_path[:-len('.part')]
+        stale = []
+        with self._lock:
+            if key in self._disk or frames == 0:
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, path)
+            self._disk[key] = (path, samplerate, channels, frames)
+            self._disk_bytes += frames * channels * 4
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                old_path, _, old_channels, old_frames = self._disk.popitem(last=False)[1]
+                self._disk_bytes -= old_frames * old_channels * 4
+                stale.append(old_path)
+        for old_path in stale:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass  # Still mapped by a playing source (Windows)
+
+    def _drop_spilled(self, key):
+        with self._lock:
+            entry = self._disk.pop(key, None)
+            if entry:
+                self._disk_bytes -= entry[3] * entry[2] * 4
+        if entry:
+            try:
+                os.remove(entry[0])
+            except OSError:
+                pass
+
+    def clear(self):
+        """Forget the RAM tier; spilled files stay for the next run"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+
+class JingleBank:
+    """Short clips (chimes, announcements) decoded once and kept in RAM.
+
+    Clips are stored per output format, so a converted copy is made once
+    per device format and every play is a plain array read.
+    """
+
+    def __init__(self, max_seconds=JINGLE_MAX_SECONDS):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self._decoded = {}  # path -> (pcm, samplerate)
+        self._converted = {}  # (path, samplerate, channels) -> pcm
+
+    def load(self, path):
+        """Decode path into the bank if needed, return its (pcm, samplerate)"""
+        path = str(path)
+        with self._lock:
+            clip = self._decoded.get(path)
+        if clip is None:
+            info = sf.info(path)
+            if info.duration > self.max_seconds:
+                raise ValueError(f"{os.path.basename(path)} dài hơn {self.max_seconds}s")
+            pcm, samplerate = sf.read(path, dtype='float32', always_2d=True)
+            clip = (pcm, samplerate)
+            with self._lock:
+                self._decoded[path] = clip
+        return clip
+
+    def preload(self, paths):
+        """Decode every clip in paths now, skipping the ones that fail"""
+        for path in paths:
+            try:
+                self.load(path)
+            except Exception as e:
+                print(f"Không tải được jingle {path}: {e}")
+
+    def format(self, path):
+        """(samplerate, channels) of the clip as decoded"""
+        pcm, samplerate = self.load(path)
+        return samplerate, pcm.shape[1]
+
+    def open(self, path, samplerate=None, channels=None):
+        """Source over the clip, converted to (samplerate, channels) if given"""
+        pcm, src_rate = self.load(path)
+        samplerate = samplerate or src_rate
+        channels = channels or pcm.shape[1]
+        if (samplerate, channels) != (src_rate, pcm.shape[1]):
+            key = (str(path), samplerate, channels)
+            with self._lock:
+                converted = self._converted.get(key)
+            if converted is None:
+                converted = convert_pcm(pcm, src_rate, samplerate, channels)
+                with self._lock:
+                    self._converted[key] = converted
+            pcm = converted
+        return CachedAudioSource(path, pcm, samplerate)
+
+    def clear(self):
+        with self._lock:
+            self._decoded.clear()
+            self._converted.clear()
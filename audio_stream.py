@@ -0,0 +1,645 @@
+"""
+Streaming audio source cho Music Scheduler
+Đọc file nhạc theo từng block vào ring buffer thay vì sf.read toàn bộ file
+"""
+
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import soundfile as sf
+
+from metrics import METRICS
+
+_file_open_time = METRICS.histogram(
+    'audio_file_open_seconds', "Time to open an audio file for streaming")
+_decode_time = METRICS.histogram(
+    'audio_decode_seconds', "Decoder time for a whole track, waits excluded")
+
+
+class RingBuffer:
+    """Single-producer / single-consumer ring buffer of audio frames.
+
+    The consumer side (the PortAudio callback) never takes a lock: positions
+    are plain ints that only one side writes, which is safe under the GIL.
+    """
+
+    def __init__(self, capacity, channels, dtype='float32'):
+        self.capacity = capacity
+        self.channels = channels
+        self.data = np.zeros((capacity, channels), dtype=dtype)
+        self.read_pos = 0   # Total frames consumed
+        self.write_pos = 0  # Total frames produced
+
+    def available(self):
+        """Frames ready to be read"""
+        return self.write_pos - self.read_pos
+
+    def space(self):
+        """Frames that can be written without overwriting unread data"""
+        return self.capacity - self.available()
+
+    def write(self, block):
+        """Copy a (frames, channels) block in; caller checks space() first"""
+        frames = len(block)
+        start = self.write_pos % self.capacity
+        first = min(frames, self.capacity - start)
+        self.data[start:start + first] = block[:first]
+        if frames > first:
+            self.data[:frames - first] = block[first:]
+        self.write_pos += frames
+
+    def read_into(self, out):
+        """Copy up to len(out) frames into out, return the number copied"""
+        frames = min(len(out), self.available())
+        start = self.read_pos % self.capacity
+        first = min(frames, self.capacity - start)
+        out[:first] = self.data[start:start + first]
+        if frames > first:
+            out[first:frames] = self.data[:frames - first]
+        self.read_pos += frames
+        return frames
+
+
+def clip_range(frames, samplerate, offset=0.0, duration=None):
+    """(first frame, frame count) of the part of a track of frames that
+    starts offset seconds in and lasts at most duration seconds"""
+    start = min(max(int(round(offset * samplerate)), 0), frames)
+    count = frames - start
+    if duration is not None:
+        count = min(count, max(int(round(duration * samplerate)), 0))
+    return start, count
+
+
+class StreamingAudioSource:
+    """Decode an audio file on a background thread into a bounded ring buffer.
+
+    Memory use is fixed by ``buffer_seconds`` regardless of track length and
+    playback can start as soon as the first block is decoded.
+
+    ``offset`` and ``duration`` (seconds) select a part of the file: the
+    decoder seeks to offset and stops after duration, nothing else is
+    decoded.
+
+    ``capture(samplerate, channels, frames)`` may return an object whose
+    write(block) sees every decoded block, then finish() at EOF or abort()
+    if decoding stops early; the decoded-audio cache uses it.
+    """
+
+    def __init__(self, path, buffer_seconds=4.0, block_frames=4096, capture=None,
+                 offset=0.0, duration=None):
+        self.path = path
+        opened = time.perf_counter()
+        self._file = sf.SoundFile(str(path))
+        _file_open_time.observe(time.perf_counter() - opened)
+        self.samplerate = self._file.samplerate
+        self.channels = self._file.channels
+        start, self.frames = clip_range(self._file.frames, self.samplerate, offset, duration)
+        if start:
+            self._file.seek(start)
+        self._limit = self.frames if duration is not None else None
+        self.block_frames = block_frames
+        self.position = 0
+        self.error = None
+        self.gain = 1.0  # Per-track gain, e.g. loudness normalization
+        self._capture = capture(self.samplerate, self.channels, self.frames) if capture else None
+
+        capacity = max(int(self.samplerate * buffer_seconds), block_frames * 2)
+        self._ring = RingBuffer(capacity, self.channels)
+        self._eof = False
+        self._stop = threading.Event()
+        self._reader = threading.Thread(target=self._fill, daemon=True)
+        self._reader.start()
+
+    def _fill(self):
+        """Reader thread: push decoded blocks into the ring buffer"""
+        block = np.empty((self.block_frames, self.channels), dtype='float32')
+        # Sleep roughly a quarter block while the ring buffer is full
+        idle = self.block_frames / self.samplerate / 4
+        decoding = 0.0
+        try:
+            mark = time.perf_counter()
+            for chunk in self._blocks(block):
+                decoding += time.perf_counter() - mark
+                while self._ring.space() < len(chunk):
+                    if self._stop.is_set():
+                        return
+                    time.sleep(idle)
+                if self._stop.is_set():
+                    return
+                self._ring.write(chunk)
+                self._capture_write(chunk)
+                mark = time.perf_counter()
+            _decode_time.observe(decoding)
+            if self._capture is not None:
+                self._capture.finish()
+                self._capture = None
+        except Exception as e:
+            self.error = e
+            print(f"Lỗi đọc file {self.path}: {e}")
+        finally:
+            self._eof = True
+            self._file.close()
+            if self._capture is not None:
+                self._capture.abort()
+
+    def _blocks(self, block):
+        """Decoded blocks of the selected part. blocks() stops at the header's
+        frame count, so whole files are read until read() returns nothing:
+        some MP3 headers are short"""
+        if self._limit is not None:
+            yield from self._file.blocks(frames=self._limit, dtype='float32', always_2d=True, out=block)
+            return
+        while True:
+            chunk = self._file.read(out=block)
+            if not len(chunk):
+                return
+            yield chunk
+
+    def _capture_write(self, chunk):
+        """Hand a block to the capture, dropping the capture if it fails"""
+        if self._capture is None:
+            return
+        try:
+            self._capture.write(chunk)
+        except Exception as e:
+            print(f"Bỏ cache {self.path}: {e}")
+            self._capture.abort()
+            self._capture = None
+
+    def wait_ready(self, frames=None, timeout=2.0):
+        """Block until ``frames`` are buffered (default one block) or EOF"""
+        frames = frames or self.block_frames
+        deadline = time.monotonic() + timeout
+        while self._ring.available() < frames and not self._eof:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def read_into(self, out):
+        """Fill out[:n] with the next frames, return n (never blocks)"""
+        frames = self._ring.read_into(out)
+        self.position += frames
+        return frames
+
+    @property
+    def finished(self):
+        """True once the whole file has been decoded and played"""
+        return self._eof and self._ring.available() == 0
+
+    @property
+    def remaining(self):
+        """Frames left to play according to the file header"""
+        return max(self.frames - self.position, 0)
+
+    def close(self):
+        """Stop the reader thread"""
+        self._stop.set()
+
+
+class FadeOutSource:
+    """Source adapter that fades the last ``fade_out`` seconds of another
+    source down to silence, e.g. a track cut short by its slot"""
+
+    def __init__(self, inner, fade_out):
+        self.inner = inner
+        self.path = getattr(inner, 'path', None)
+        self.samplerate = inner.samplerate
+        self.channels = inner.channels
+        self.frames = inner.frames
+        fade_frames = max(min(int(fade_out * inner.samplerate), inner.frames), 1)
+        # Gain of each of the last fade_frames frames, down to 1/fade_frames
+        self._ramp = (np.arange(fade_frames, 0, -1, dtype='float32') / fade_frames)[:, None]
+
+    @property
+    def gain(self):
+        return self.inner.gain
+
+    @gain.setter
+    def gain(self, value):
+        self.inner.gain = value
+
+    @property
+    def error(self):
+        return self.inner.error
+
+    @property
+    def position(self):
+        return self.inner.position
+
+    def wait_ready(self, frames=None, timeout=2.0):
+        return self.inner.wait_ready(frames, timeout)
+
+    def read_into(self, out):
+        """Fill out[:n] from the inner source, faded near its end"""
+        fade_start = self.frames - len(self._ramp)
+        first = self.inner.position
+        n = self.inner.read_into(out)
+        if first + n > fade_start:
+            skip = max(fade_start - first, 0)
+            p = first + skip - fade_start
+            k = max(min(n - skip, len(self._ramp) - p), 0)
+            out[skip:skip + k] *= self._ramp[p:p + k]
+            out[skip + k:n].fill(0)  # Past the header's frame count
+        return n
+
+    @property
+    def finished(self):
+        return self.inner.finished
+
+    @property
+    def remaining(self):
+        return self.inner.remaining
+
+    def close(self):
+        self.inner.close()
+
+
+class AudioRenderer:
+    """Allocation-free render path used by the PortAudio callback.
+
+    Frames are copied straight from the source into ``outdata`` and the gain
+    is applied in place. Gain changes are ramped linearly over
+    ``ramp_frames`` so moving the volume slider does not click.
+    """
+
+    def __init__(self, source, gain=1.0, ramp_frames=256):
+        self.source = source
+        self.gain = float(gain)
+        self.ramp_frames = ramp_frames
+        # Preallocated ramp shape (1/R .. 1) and scratch for the ramped gain
+        self._unit_ramp = (np.arange(1, ramp_frames + 1, dtype='float32') / ramp_frames)[:, None]
+        self._ramp = np.empty((ramp_frames, 1), dtype='float32')
+
+    def render(self, outdata, target_gain):
+        """Fill outdata, return the number of source frames written"""
+        n = self.source.read_into(outdata)
+        if n < len(outdata):
+            outdata[n:].fill(0)
+
+        gain = self.gain
+        if target_gain != gain:
+            # Move towards the target with a fixed slope, may span several blocks
+            r = min(n, self.ramp_frames)
+            delta = target_gain - gain
+            ramp = self._ramp[:r]
+            np.multiply(self._unit_ramp[:r], delta, out=ramp)
+            ramp += gain
+            outdata[:r] *= ramp
+            gain = target_gain if r == self.ramp_frames else gain + delta * r / self.ramp_frames
+            self.gain = gain
+            if n > r:
+                outdata[r:n] *= gain
+        elif gain != 1.0:
+            outdata[:n] *= gain
+        return n
+
+
+class TrackMixer:
+    """Plays tracks back to back on one stream, gapless or with a crossfade.
+
+    It has the same read_into() interface as a source, so an AudioRenderer
+    applies the master volume on top. Other threads only post operations
+    (play, enqueue, clear); the audio callback applies them at the start of
+    read_into, so the track state is only ever touched by that thread.
+
+    notify(event, source, frame_offset) is called from the callback with
+    'started' or 'ended' when a track begins or stops rendering.
+
+    Each source's ``gain`` attribute is applied as it is read, before the
+    crossfade and the master volume.
+
+    play(source, start_at) starts the track at a wall-clock time instead of
+    the next block: the callback sets ``block_time`` (when the block reaches
+    the DAC) and the start lands on the matching sample inside a block.
+    """
+
+    def __init__(self, channels, crossfade_frames=0, max_frames=8192, notify=None, samplerate=44100):
+        self.channels = channels
+        self.crossfade_frames = crossfade_frames
+        self.notify = notify
+        self.samplerate = samplerate
+        self.block_time = 0.0  # Wall-clock DAC time of the block being rendered
+        self.current = None
+        self.incoming = None  # Track fading in during a crossfade
+        self.queue = deque()
+        self._start = None  # (source, start_at) waiting for its sample
+        self._ops = deque()
+        self._xfade_pos = 0
+        self._scratch = np.zeros((max_frames, channels), dtype='float32')
+        ramp = (np.arange(crossfade_frames, dtype='float32') + 0.5) / max(crossfade_frames, 1)
+        self._fade_in = ramp[:, None]
+        self._fade_out = (1 - ramp)[:, None]
+
+    def play(self, source, start_at=None):
+        """Replace everything with source, at the next block or at start_at"""
+        if start_at is None:
+            self._ops.append(('play', source))
+        else:
+            self._ops.append(('play_at', (source, start_at)))
+
+    def enqueue(self, source):
+        """Play source after the current and already queued tracks"""
+        self._ops.append(('queue', source))
+
+    def clear(self):
+        """End all tracks at the next block"""
+        self._ops.append(('clear', None))
+
+    @property
+    def idle(self):
+        return (self.current is None and self.incoming is None
+                and not self.queue and not self._ops and self._start is None)
+
+    def _emit(self, event, source, offset):
+        if self.notify:
+            self.notify(event, source, offset)
+
+    def _end_all(self, offset=0):
+        waiting = self._start[0] if self._start else None
+        for source in (self.current, self.incoming, *self.queue, waiting):
+            if source is not None:
+                self._emit('ended', source, offset)
+        self.current = self.incoming = self._start = None
+        self.queue.clear()
+
+    @staticmethod
+    def _read(source, out):
+        """read_into with the track's own gain applied in place"""
+        n = source.read_into(out)
+        if source.gain != 1.0:
+            out[:n] *= source.gain
+        return n
+
+    def _apply_ops(self):
+        while self._ops:
+            op, source = self._ops.popleft()
+            if op == 'play':
+                self._end_all()
+                self.current = source
+                self._emit('started', source, 0)
+            elif op == 'play_at':
+                # Whatever plays now keeps playing until the start sample
+                if self._start:
+                    self._emit('ended', self._start[0], 0)
+                self._start = source
+            elif op == 'queue':
+                self.queue.append(source)
+            else:
+                self._end_all()
+
+    def _start_in_block(self, out):
+        """Start a timed track if its sample falls in this block, return True if it did"""
+        source, start_at = self._start
+        frames = len(out)
+        offset = round((start_at - self.block_time) * self.samplerate)
+        if offset >= frames:
+            return False
+        # Late hand-offs start right away
+        offset = max(offset, 0)
+        cur = self.current
+        n = self._read(cur, out[:offset]) if cur is not None else 0
+        out[n:offset].fill(0)
+        self._start = None
+        self._end_all(offset)
+        self.current = source
+        self._emit('started', source, offset)
+        m = self._read(source, out[offset:])
+        out[offset + m:].fill(0)
+        return True
+
+    def read_into(self, out):
+        """Render one block of the track sequence, always fills out"""
+        self._apply_ops()
+        if self._start and self._start_in_block(out):
+            return len(out)
+        frames = len(out)
+        cur = self.current
+        remaining = cur.remaining if cur is not None else 0
+        n = self._read(cur, out) if cur is not None else 0
+        if n < frames:
+            out[n:].fill(0)
+
+        # Start the crossfade so that it ends exactly with the current track
+        start = 0  # Frames of this block before the fade begins
+        xfade = self.crossfade_frames
+        if (self.incoming is None and self.queue and xfade and n > 0
+                and remaining - xfade < frames):
+            self.incoming = self.queue.popleft()
+            start = max(remaining - xfade, 0)
+            self._xfade_pos = max(xfade - remaining, 0)
+            self._emit('started', self.incoming, start)
+
+        inc = self.incoming
+        if inc is not None:
+            if frames > len(self._scratch):
+                self._scratch = np.zeros((frames, self.channels), dtype='float32')
+            scratch = self._scratch[start:frames]
+            m = self._read(inc, scratch)
+            if m < len(scratch):
+                scratch[m:].fill(0)
+            p = self._xfade_pos
+            k = min(frames - start, xfade - p)
+            out[start:start + k] *= self._fade_out[p:p + k]
+            scratch[:k] *= self._fade_in[p:p + k]
+            out[start + k:].fill(0)  # The outgoing track is cut at the end of the window
+            out[start:] += scratch
+            self._xfade_pos += k
+            if self._xfade_pos >= xfade or cur.finished:
+                self._emit('ended', cur, start + k)
+                self.current, self.incoming = inc, None
+        elif n < frames and (cur is None or cur.finished):
+            # Gapless: the next track continues in the same block
+            if cur is not None:
+                self._emit('ended', cur, n)
+                self.current = None
+            while self.queue and n < frames:
+                nxt = self.current = self.queue.popleft()
+                self._emit('started', nxt, n)
+                n += self._read(nxt, out[n:])
+                if not nxt.finished:
+                    break
+                self._emit('ended', nxt, n)
+                self.current = None
+        return frames
+
+
+class DeviceHandoff:
+    """Moves a TrackMixer from one output stream to another without a gap.
+
+    The old stream renders until it sees the handoff, then sets ``released``
+    and only plays back what the new stream rendered, fading out; the new
+    stream outputs silence until ``released`` and fades its first
+    ``fade_frames`` in. Both devices play the same frames during the fade,
+    so the tracks continue on the exact frame they were at.
+    """
+
+    def __init__(self, channels, fade_frames, max_frames=8192, released=False):
+        self.released = released  # The old stream no longer reads the mixer
+        self.fade_frames = fade_frames
+        self._ring = RingBuffer(fade_frames + max_frames, channels)
+        self._in_pos = 0
+        self._out_pos = 0
+        ramp = (np.arange(fade_frames, dtype='float32') + 0.5) / max(fade_frames, 1)
+        self._fade_in = ramp[:, None]
+        self._fade_out = (1 - ramp)[:, None]
+
+    def fade_in(self, outdata):
+        """New stream: copy the block for the old device, then fade it in"""
+        p = self._in_pos
+        k = min(len(outdata), self.fade_frames - p)
+        if k <= 0:
+            return
+        if self._ring.space() >= k:
+            self._ring.write(outdata[:k])
+        outdata[:k] *= self._fade_in[p:p + k]
+        self._in_pos += k
+
+    def fade_out(self, outdata):
+        """Old stream: play the copied frames fading out, then silence"""
+        n = self._ring.read_into(outdata)
+        outdata[n:].fill(0)
+        p = self._out_pos
+        outdata[:n] *= self._fade_out[p:p + n]
+        self._out_pos += n
+
+
+class GainEnvelope:
+    """Gain that moves linearly towards a target, attack_frames for a full
+    drop and release_frames for a full rise, applied in place per block"""
+
+    def __init__(self, attack_frames, release_frames, max_frames=8192):
+        self.gain = 1.0
+        self.down_step = 1.0 / max(attack_frames, 1)
+        self.up_step = 1.0 / max(release_frames, 1)
+        self._steps = np.arange(1, max_frames + 1, dtype='float32')
+        self._ramp = np.empty(max_frames, dtype='float32')
+
+    def apply(self, block, target):
+        """Multiply block by the envelope moving towards target"""
+        gain = self.gain
+        frames = len(block)
+        if gain == target:
+            if gain != 1.0:
+                block *= gain
+            return
+        if frames > len(self._steps):
+            self._steps = np.arange(1, frames + 1, dtype='float32')
+            self._ramp = np.empty(frames, dtype='float32')
+        ramp = self._ramp[:frames]
+        if target < gain:
+            np.multiply(self._steps[:frames], -self.down_step, out=ramp)
+            ramp += gain
+            np.maximum(ramp, target, out=ramp)
+        else:
+            np.multiply(self._steps[:frames], self.up_step, out=ramp)
+            ramp += gain
+            np.minimum(ramp, target, out=ramp)
+        block *= ramp[:, None]
+        self.gain = float(ramp[-1])
+
+
+class OverlayMixer:
+    """Mixes overlay clips (announcements, chimes) over a TrackMixer.
+
+    The TrackMixer is the bed at priority 0. While an overlay plays, every
+    source of a lower priority is ducked to ``duck_gain`` by its own
+    GainEnvelope and comes back once the overlay ends. Overlays are posted
+    from other threads and only touched by the audio callback, like the
+    TrackMixer's operations.
+
+    The cost per block is bounded: at most ``max_overlays`` clips play at
+    once (an extra one of no higher priority than all playing ones is
+    dropped, otherwise it replaces the lowest), and each costs one read,
+    one envelope and one add. ``timers`` are optional (bed, overlay)
+    histograms that get the time spent on each source per block.
+
+    notify gets 'started' and 'ended' for overlays, like the TrackMixer.
+    """
+
+    def __init__(self, bed, channels, samplerate, duck_gain=0.25, attack=0.05, release=0.4,
+                 max_overlays=4, max_frames=8192, notify=None, timers=None):
+        self.bed = bed
+        self.channels = channels
+        self.duck_gain = duck_gain
+        self.max_overlays = max_overlays
+        self.notify = notify
+        self._attack = int(attack * samplerate)
+        self._release = int(release * samplerate)
+        self._max_frames = max_frames
+        self._bed_envelope = GainEnvelope(self._attack, self._release, max_frames)
+        self._overlays = []  # [source, priority, GainEnvelope], highest priority first
+        self._ops = deque()
+        self._scratch = np.zeros((max_frames, channels), dtype='float32')
+        self._timers = timers
+
+    def add(self, source, priority=1):
+        """Play source over the bed from the next block"""
+        self._ops.append(('add', source, max(int(priority), 1)))
+
+    def clear(self):
+        """End every overlay at the next block"""
+        self._ops.append(('clear', None, 0))
+
+    @property
+    def idle(self):
+        return not self._overlays and not self._ops
+
+    def _emit(self, event, source, offset):
+        if self.notify:
+            self.notify(event, source, offset)
+
+    def _apply_ops(self):
+        overlays = self._overlays
+        while self._ops:
+            op, source, priority = self._ops.popleft()
+            if op == 'clear':
+                for overlay in overlays:
+                    self._emit('ended', overlay[0], 0)
+                overlays.clear()
+                continue
+            if len(overlays) >= self.max_overlays:
+                if priority <= overlays[-1][1]:
+                    self._emit('ended', source, 0)  # Dropped, nothing lower to replace
+                    continue
+                self._emit('ended', overlays.pop()[0], 0)
+            envelope = GainEnvelope(self._attack, self._release, self._max_frames)
+            overlays.append([source, priority, envelope])
+            overlays.sort(key=lambda overlay: -overlay[1])
+            self._emit('started', source, 0)
+
+    def read_into(self, out):
+        """Render the bed, duck it under the overlays and mix them in"""
+        self._apply_ops()
+        timers = self._timers
+        perf_counter = time.perf_counter
+        started = perf_counter()
+        frames = self.bed.read_into(out)
+        overlays = self._overlays
+        top = overlays[0][1] if overlays else 0
+        self._bed_envelope.apply(out, self.duck_gain if top else 1.0)
+        if timers:
+            timers[0].observe(perf_counter() - started)
+        if not overlays:
+            return frames
+
+        if frames > len(self._scratch):
+            self._scratch = np.zeros((frames, self.channels), dtype='float32')
+        scratch = self._scratch[:frames]
+        i = 0
+        while i < len(overlays):
+            started = perf_counter()
+            source, priority, envelope = overlays[i]
+            n = TrackMixer._read(source, scratch)
+            envelope.apply(scratch[:n], self.duck_gain if priority < top else 1.0)
+            out[:n] += scratch[:n]
+            if source.finished:
+                del overlays[i]
+                self._emit('ended', source, n)
+            else:
+                i += 1
+            if timers:
+                timers[1].observe(perf_counter() - started)
+        return frames
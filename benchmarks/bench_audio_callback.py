@@ -0,0 +1,85 @@
+"""
+Microbenchmark cho audio callback - chạy không cần thiết bị âm thanh
+Drives AudioRenderer.render() exactly like the PortAudio callback does and
+reports ns per frame for steady gain and for continuous volume ramps.
+
+    python benchmarks/bench_audio_callback.py [--blocksize 512] [--seconds 20]
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from audio_stream import AudioRenderer, RingBuffer  # noqa: E402
+
+
+class LoopingSource:
+    """In-memory source with the StreamingAudioSource interface, never ends"""
+
+    def __init__(self, samplerate=44100, channels=2, seconds=5):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.position = 0
+        frames = samplerate * seconds
+        self._ring = RingBuffer(frames, channels)
+        noise = np.random.default_rng(0).uniform(-0.5, 0.5, (frames, channels))
+        self._ring.write(noise.astype('float32'))
+        self.finished = False
+
+    def read_into(self, out):
+        if self._ring.available() < len(out):
+            # Rewind instead of refilling so the benchmark measures only render()
+            self._ring.read_pos = self._ring.write_pos - self._ring.capacity
+        n = self._ring.read_into(out)
+        self.position += n
+        return n
+
+
+def run(blocksize, seconds, channels, ramp):
+    source = LoopingSource(channels=channels)
+    renderer = AudioRenderer(source, gain=0.7)
+    outdata = np.zeros((blocksize, channels), dtype='float32')
+    blocks = int(source.samplerate * seconds / blocksize)
+    gains = (0.3, 0.9)
+
+    # Warm up, then measure
+    for i in range(100):
+        renderer.render(outdata, gains[i & 1] if ramp else 0.7)
+
+    start = time.perf_counter_ns()
+    for i in range(blocks):
+        renderer.render(outdata, gains[i & 1] if ramp else 0.7)
+    elapsed = time.perf_counter_ns() - start
+
+    tracemalloc.start()
+    for i in range(1000):
+        renderer.render(outdata, gains[i & 1] if ramp else 0.7)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed / (blocks * blocksize), elapsed / blocks, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--blocksize', type=int, default=512)
+    parser.add_argument('--seconds', type=float, default=20.0, help="audio seconds to render")
+    parser.add_argument('--channels', type=int, default=2)
+    args = parser.parse_args()
+
+    budget_ns = args.blocksize / 44100 * 1e9
+    for label, ramp in (("steady gain", False), ("gain ramp", True)):
+        ns_frame, ns_block, peak = run(args.blocksize, args.seconds, args.channels, ramp)
+        print(f"{label:12s}: {ns_frame:7.1f} ns/frame  {ns_block / 1000:7.1f} us/block "
+              f"({ns_block / budget_ns * 100:.2f}% of {budget_ns / 1e6:.1f} ms budget)  "
+              f"traced peak {peak} B")
+
+
+if __name__ == "__main__":
+    main()
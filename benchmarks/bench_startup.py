@@ -0,0 +1,64 @@
+"""
+Đo thời gian khởi động và RSS của chế độ GUI và headless
+Launches music_scheduler_gui.py with --startup-report --exit-after-startup
+several times per mode and prints the median cold-start time and peak RSS.
+
+    python benchmarks/bench_startup.py [--runs 5] [--modes headless gui]
+"""
+
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+REPORT = re.compile(r"startup mode=(\w+) ready=([\d.]+)s rss=([\d.]+|n/a)")
+
+
+def run_once(mode, config_path, cwd):
+    cmd = [sys.executable, str(ROOT / 'music_scheduler_gui.py'), '--config', str(config_path),
+           '--startup-report', '--exit-after-startup']
+    if mode == 'headless':
+        cmd.append('--headless')
+    proc = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=120)
+    match = REPORT.search(proc.stdout)
+    if not match:
+        raise RuntimeError((proc.stderr or proc.stdout).strip().splitlines()[-1:])
+    rss = None if match.group(3) == 'n/a' else float(match.group(3))
+    return float(match.group(2)), rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--modes', nargs='+', default=['headless', 'gui'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        music = Path(tmp) / 'music'
+        music.mkdir()
+        config_path = Path(tmp) / 'music_scheduler_config.json'
+        config_path.write_text(json.dumps({
+            'music_folder': str(music),
+            'scheduled_times': [{'time': '12:00', 'volume': 70}],
+        }), encoding='utf-8')
+
+        for mode in args.modes:
+            try:
+                results = [run_once(mode, config_path, tmp) for _ in range(args.runs)]
+            except Exception as e:
+                print(f"{mode:9s}: failed {e}")
+                continue
+            times = [t for t, _ in results]
+            rss = [r for _, r in results if r is not None]
+            rss_text = f"{statistics.median(rss):.1f} MB" if rss else "n/a"
+            print(f"{mode:9s}: cold start {statistics.median(times) * 1000:7.1f} ms "
+                  f"(min {min(times) * 1000:.1f})  peak RSS {rss_text}")
+
+
+if __name__ == "__main__":
+    main()
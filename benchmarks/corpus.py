@@ -0,0 +1,51 @@
+"""
+Tạo bộ file nhạc thử cho benchmark (WAV, FLAC, OGG)
+Tones with a little noise so the lossless codecs have real work to do.
+Files are spread over sub-folders the way a real music folder is.
+"""
+
+import os
+
+import numpy as np
+import soundfile as sf
+
+FORMATS = {
+    'wav': ('WAV', 'PCM_16'),
+    'flac': ('FLAC', 'PCM_16'),
+    'ogg': ('OGG', 'VORBIS'),
+}
+
+
+def make_signal(seconds, samplerate=44100, channels=2, seed=0):
+    """Stereo tone plus noise, float32 in [-0.5, 0.5]"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * samplerate)) / samplerate
+    tone = 0.3 * np.sin(2 * np.pi * (220 + 20 * seed % 400) * t)
+    noise = rng.normal(0, 0.05, (len(t), channels))
+    return (tone[:, None] + noise).astype('float32')
+
+
+def write_track(path, fmt, seconds, samplerate=44100, channels=2, seed=0):
+    file_format, subtype = FORMATS[fmt]
+    sf.write(path, make_signal(seconds, samplerate, channels, seed), samplerate,
+             format=file_format, subtype=subtype)
+    return path
+
+
+def make_corpus(root, count, seconds=1.0, formats=('wav',), per_folder=200):
+    """Write count files to root (cycling formats), return their paths"""
+    paths = []
+    # Encode one template per format and copy it, large corpora stay fast to build
+    templates = {}
+    for i in range(count):
+        fmt = formats[i % len(formats)]
+        folder = os.path.join(root, f"album{i // per_folder:03d}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"track{i:05d}.{fmt}")
+        if fmt not in templates:
+            templates[fmt] = write_track(path, fmt, seconds, seed=i)
+        else:
+            with open(templates[fmt], 'rb') as src, open(path, 'wb') as dst:
+                dst.write(src.read())
+        paths.append(path)
+    return paths
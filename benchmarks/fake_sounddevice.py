@@ -0,0 +1,151 @@
+"""
+sounddevice giả cho benchmark - không cần loa hay PortAudio
+OutputStream calls the callback from a local thread, paced like a real
+device (speed=1.0) or faster. install() makes `import sounddevice` return
+this module, so the app code runs unchanged.
+"""
+
+import sys
+import threading
+import time
+
+import numpy as np
+
+SPEED = 1.0  # 1.0 = real time, 10.0 = ten blocks in the time of one
+LATENCY = 0.01  # Seconds between a block being rendered and reaching the "DAC"
+
+
+class CallbackStop(Exception):
+    pass
+
+
+class CallbackAbort(Exception):
+    pass
+
+
+class PortAudioError(Exception):
+    pass
+
+
+class CallbackFlags:
+    """Subset of sounddevice.CallbackFlags that the player reads"""
+
+    def __init__(self, output_underflow=False):
+        self.output_underflow = output_underflow
+        self.output_overflow = False
+
+    def __bool__(self):
+        return self.output_underflow or self.output_overflow
+
+
+class _TimeInfo:
+    def __init__(self, now):
+        self.currentTime = now
+        self.outputBufferDacTime = now + LATENCY
+
+
+class _Default:
+    device = [0, 0]
+    samplerate = None
+
+
+default = _Default()
+
+
+def query_devices(device=None, kind=None):
+    devices = [{'name': 'Fake Output', 'index': 0, 'hostapi': 0,
+                'max_input_channels': 0, 'max_output_channels': 2,
+                'default_samplerate': 48000.0, 'default_low_output_latency': LATENCY}]
+    if device is not None or kind is not None:
+        return devices[0]
+    return devices
+
+
+def sleep(msec):
+    time.sleep(msec / 1000)
+
+
+def _terminate():
+    pass
+
+
+def _initialize():
+    pass
+
+
+class OutputStream:
+    """Calls callback(outdata, frames, time_info, status) once per block.
+
+    A block that took longer than its real-time budget (scaled by SPEED)
+    is reported as an output underflow on the next call, like PortAudio.
+    """
+
+    def __init__(self, samplerate=44100, channels=2, dtype='float32', callback=None,
+                 finished_callback=None, device=None, blocksize=None, latency=None, **kwargs):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.blocksize = blocksize or 512
+        self.device = device
+        self.latency = LATENCY
+        self.callback = callback
+        self.finished_callback = finished_callback
+        self.active = False
+        self.closed = False
+        self.blocks = 0
+        self.underflows = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def time(self):
+        return time.monotonic()
+
+    def start(self):
+        self._stop.clear()
+        self.active = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        out = np.zeros((self.blocksize, self.channels), dtype='float32')
+        period = self.blocksize / self.samplerate / SPEED
+        deadline = time.monotonic()
+        late = False
+        try:
+            while not self._stop.is_set():
+                status = CallbackFlags(output_underflow=late)
+                started = time.monotonic()
+                self.callback(out, self.blocksize, _TimeInfo(started), status)
+                self.blocks += 1
+                late = time.monotonic() - started > period
+                self.underflows += late
+                deadline += period
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    deadline = time.monotonic()
+        except (CallbackStop, CallbackAbort):
+            pass
+        finally:
+            self.active = False
+            if self.finished_callback:
+                self.finished_callback()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    abort = stop
+
+    def close(self):
+        self.stop()
+        self.closed = True
+
+
+def install(speed=1.0):
+    """Replace the sounddevice module for everything imported afterwards"""
+    global SPEED
+    SPEED = speed
+    sys.modules['sounddevice'] = sys.modules[__name__]
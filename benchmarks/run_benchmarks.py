@@ -0,0 +1,379 @@
+"""
+Bộ benchmark offline - không cần loa, dùng sounddevice giả
+Runs the app's real code paths against fake_sounddevice and a generated
+corpus and prints one JSON document for regression tracking:
+
+- random_song: get_random_song latency vs folder size (cold index, warm pick)
+- first_sample: play_song_job call to first sample at the DAC, per format,
+  decoding vs cache hit
+- load_rss: peak RSS of sf.read of a whole track vs streaming decode
+- clip: decode time of a slot cut from the middle of a long track
+  (start_offset/max_duration) vs decoding the whole track
+- callback: audio callback CPU time per block
+- scheduler: update_scheduler_jobs cost vs number of schedules
+- fleet: coordinator and agents on localhost with skewed clocks, offset
+  estimation error and first-sample spread of synchronized starts
+
+    python benchmarks/run_benchmarks.py [--only callback scheduler] [--output bench.json]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+import fake_sounddevice
+
+fake_sounddevice.install()
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from audio_cache import DecodedAudioCache  # noqa: E402
+from audio_stream import StreamingAudioSource  # noqa: E402
+from corpus import make_corpus, write_track  # noqa: E402
+from fleet import FleetAgent, FleetCoordinator  # noqa: E402
+from metrics import METRICS  # noqa: E402
+from scheduler_engine import MusicSchedulerEngine  # noqa: E402
+
+
+def make_engine(tmp, music_folder):
+    """Engine with its config and databases in tmp, no background analysis"""
+    config_path = os.path.join(tmp, 'config.json')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': 2, 'music_folder': music_folder, 'scheduled_times': []}, f)
+    engine = MusicSchedulerEngine(config_path)
+    engine.library.on_refreshed = None
+    engine.load_config()
+    engine.audio_cache = DecodedAudioCache()  # RAM only, nothing left behind
+    return engine
+
+
+def warm_cache(engine, path):
+    """Decode path once through the cache so the next open is a hit"""
+    source = engine.audio_cache.open(path)
+    block = np.empty((4096, source.channels), dtype='float32')
+    while not source.finished:
+        if not source.read_into(block):
+            source.wait_ready()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def summary_ms(values):
+    return {'median_ms': statistics.median(values) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'runs': len(values)}
+
+
+def bench_random_song(sizes, picks=2000):
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            music = os.path.join(tmp, 'music')
+            make_corpus(music, size, seconds=0.05)
+            engine = make_engine(tmp, music)
+            # load_config already started a background index, wait for it to settle
+            engine.library.refresh(music)
+            engine.library._paths.clear()
+
+            started = time.perf_counter()
+            engine.get_random_song()
+            cold = time.perf_counter() - started
+
+            times = []
+            for _ in range(picks):
+                started = time.perf_counter()
+                engine.get_random_song()
+                times.append(time.perf_counter() - started)
+            engine.shutdown()
+        results[str(size)] = {'cold_ms': cold * 1000,
+                              'warm_median_us': statistics.median(times) * 1e6,
+                              'warm_p99_us': percentile(times, 0.99) * 1e6}
+    return results
+
+
+def next_second_slot():
+    """Sleep to the next whole second and return it as an HH:MM:SS slot"""
+    time.sleep(1.001 - time.time() % 1)
+    return datetime.now().strftime('%H:%M:%S')
+
+
+def bench_first_sample(formats, runs, seconds=30):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in formats:
+            # Own folder per format: separate history, every slot is fresh
+            data = os.path.join(tmp, fmt)
+            music = os.path.join(data, 'music')
+            os.makedirs(music)
+            write_track(os.path.join(music, f'track.{fmt}'), fmt, seconds)
+            engine = make_engine(data, music)
+            zone = engine.main_zone
+            engine.preopen_stream = False
+            started_at = {}
+            first_samples = []
+
+            def on_started(job, first_sample_at, original=zone.on_playback_started):
+                first_samples.append(first_sample_at - started_at[job['time']])
+                original(job, first_sample_at)
+
+            zone.player.on_started = on_started
+            for mode in ('decode', 'cached'):
+                del first_samples[:]
+                for i in range(runs):
+                    if mode == 'decode':
+                        engine.audio_cache.clear()
+                    slot = next_second_slot()  # A fresh, real slot per run: start skews stay meaningful
+                    started_at[slot] = time.time()
+                    zone.play_song_job(slot, 70)
+                    deadline = time.monotonic() + 5
+                    while len(first_samples) <= i and time.monotonic() < deadline:
+                        time.sleep(0.001)
+                    zone.stop_song()
+                    time.sleep(0.05)
+                if mode == 'decode':
+                    warm_cache(engine, next(Path(music).iterdir()))
+                results[f'{fmt}_{mode}'] = summary_ms(first_samples)
+            engine.shutdown()
+    return results
+
+
+RSS_PROBE = r"""
+import sys
+sys.path[:0] = [{root!r}, {bench!r}]
+import fake_sounddevice
+fake_sounddevice.install()
+import numpy as np, soundfile as sf
+from audio_stream import StreamingAudioSource
+from scheduler_engine import peak_rss_mb
+
+def peak_mb():
+    # ru_maxrss survives exec on Linux and would report the parent's peak
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(l.split()[1]) / 1024 for l in f if l.startswith('VmHWM'))
+    except OSError:
+        return peak_rss_mb()
+
+base = peak_mb()
+if {mode!r} == 'sf_read':
+    data, sr = sf.read({path!r}, dtype='float32')
+else:
+    source = StreamingAudioSource({path!r})
+    out = np.empty((4096, source.channels), dtype='float32')
+    while not source.finished:
+        if not source.read_into(out):
+            source.wait_ready()
+print(base, peak_mb())
+"""
+
+
+def bench_load_rss(seconds):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_track(os.path.join(tmp, 'long.flac'), 'flac', seconds)
+        for mode in ('sf_read', 'stream'):
+            code = RSS_PROBE.format(root=str(ROOT), bench=str(Path(__file__).parent), mode=mode, path=path)
+            out = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                                 text=True, timeout=300)
+            base, peak = map(float, out.stdout.split()[-2:])
+            results[mode] = {'track_seconds': seconds, 'peak_rss_mb': peak,
+                             'delta_mb': peak - base}
+    return results
+
+
+def bench_clip(seconds, slot_seconds, runs):
+    def drain(source):
+        out = np.empty((4096, source.channels), dtype='float32')
+        frames = 0
+        while not source.finished:
+            n = source.read_into(out)
+            if not n:
+                source.wait_ready()
+            frames += n
+        return frames
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_track(os.path.join(tmp, 'mix.flac'), 'flac', seconds)
+        slot = min(slot_seconds, seconds / 2)
+        for mode, kwargs in (('whole', {}), ('slot', {'offset': seconds / 2, 'duration': slot})):
+            times = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                frames = drain(StreamingAudioSource(path, **kwargs))
+                times.append(time.perf_counter() - started)
+            results[mode] = dict(summary_ms(times), decoded_seconds=frames / 44100)
+    return results
+
+
+def bench_callback(seconds, speed=20.0):
+    fake_sounddevice.SPEED = speed
+    with tempfile.TemporaryDirectory() as tmp:
+        music = os.path.join(tmp, 'music')
+        os.makedirs(music)
+        write_track(os.path.join(music, 'track.wav'), 'wav', seconds)
+        engine = make_engine(tmp, music)
+        zone = engine.main_zone
+        warm_cache(engine, next(Path(music).iterdir()))
+        histogram = METRICS.histogram('audio_callback_seconds', labels={'zone': zone.name})
+        before = histogram.count, histogram.sum
+        zone.play_song_job('00:00', 70)
+        deadline = time.monotonic() + seconds / speed + 10
+        while not zone.player.active and time.monotonic() < deadline:
+            time.sleep(0.01)
+        while zone.player.active and time.monotonic() < deadline:
+            time.sleep(0.01)
+        blocks = histogram.count - before[0]
+        total = histogram.sum - before[1]
+        stream_underflows = zone.player.stream.underflows if zone.player.stream else None
+        engine.shutdown()
+    fake_sounddevice.SPEED = 1.0
+    return {'blocks': blocks, 'mean_us_per_block': total / max(blocks, 1) * 1e6,
+            'speed': speed, 'underflows': stream_underflows}
+
+
+def bench_scheduler(counts):
+    results = {}
+    for count in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = make_engine(tmp, tmp)
+            zone = engine.main_zone
+            zone.scheduled_times = [{'time': f"{i // 60 % 24:02d}:{i % 60:02d}", 'volume': 70}
+                                    for i in range(count)]
+            engine.scheduler.start(paused=True)
+
+            started = time.perf_counter()
+            engine.update_scheduler_jobs()
+            build = time.perf_counter() - started
+
+            started = time.perf_counter()
+            engine.update_scheduler_jobs()
+            unchanged = time.perf_counter() - started
+
+            zone.scheduled_times[0]['volume'] = 50
+            started = time.perf_counter()
+            engine.update_scheduler_jobs()
+            one_change = time.perf_counter() - started
+            engine.shutdown()
+        results[str(count)] = {'build_ms': build * 1000, 'unchanged_ms': unchanged * 1000,
+                               'one_change_ms': one_change * 1000}
+    return results
+
+
+def bench_fleet(agents, starts, max_skew=0.5):
+    """Agents with clocks off by up to max_skew seconds play the same song;
+    their true first-sample times should agree within a few milliseconds"""
+    async def run(tmp):
+        music = os.path.join(tmp, 'coordinator', 'music')
+        make_corpus(music, 2, seconds=3)
+        coordinator = FleetCoordinator(make_engine(os.path.join(tmp, 'coordinator'), music),
+                                       host='127.0.0.1', port=0)
+        coordinator.engine.library.refresh(music)
+        await coordinator.start()
+
+        skews = {f'agent{i}': max_skew * (2 * i / max(agents - 1, 1) - 1) for i in range(agents)}
+        nodes = []
+        for name, skew in skews.items():
+            data = os.path.join(tmp, name)
+            os.makedirs(data)
+            node = FleetAgent(make_engine(data, ''), '127.0.0.1', coordinator.port, name, skew)
+            nodes.append(node)
+        tasks = [asyncio.create_task(node.run()) for node in nodes]
+
+        # Connected, clocks estimated and the library pushed
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and not (
+                len(coordinator.agents) == agents
+                and all(link.manifest and link.clock.offset is not None
+                        for link in coordinator.agents.values())
+                and all(node.engine.library.tracks(node.music_root) for node in nodes)):
+            await asyncio.sleep(0.05)
+        offset_errors = [abs(link.clock.offset - skews[name]) for name, link in coordinator.agents.items()]
+
+        song = sorted(coordinator.agents['agent0'].manifest)[0]
+        spreads = []
+        for i in range(starts):
+            play_id = await coordinator.start_all(song, 70, time.time() + 0.5, f"23:59:{i:02d}")
+            errors = {name: link.clock.offset - skews[name] for name, link in coordinator.agents.items()}
+            await asyncio.sleep(1.0)
+            await coordinator.stop_all()
+            # Reported times are corrected by the estimated offset, add its error back
+            first = [at + errors[name] for name, at in coordinator.starts[play_id].items()]
+            if len(first) == agents:
+                spreads.append(max(first) - min(first))
+            await asyncio.sleep(0.2)
+
+        for task in tasks:
+            task.cancel()
+        await coordinator.close()
+        for node in nodes:
+            node.engine.shutdown()
+        coordinator.engine.shutdown()
+        return {'agents': agents, 'offset_error_max_ms': max(offset_errors) * 1000,
+                'starts': len(spreads), 'spread_median_ms': statistics.median(spreads) * 1000,
+                'spread_max_ms': max(spreads) * 1000}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        return asyncio.run(run(tmp))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--only', nargs='+',
+                        choices=['random_song', 'first_sample', 'load_rss', 'clip', 'callback', 'scheduler',
+                                 'fleet'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 5000])
+    parser.add_argument('--formats', nargs='+', default=['wav', 'flac', 'ogg'])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--track-seconds', type=int, default=180)
+    parser.add_argument('--slot-seconds', type=int, default=60)
+    parser.add_argument('--schedules', nargs='+', type=int, default=[10, 100, 1000])
+    parser.add_argument('--agents', type=int, default=4)
+    parser.add_argument('--output', help="ghi JSON ra file thay vì stdout")
+    args = parser.parse_args()
+
+    suites = {
+        'random_song': lambda: bench_random_song(args.sizes),
+        'first_sample': lambda: bench_first_sample(args.formats, args.runs),
+        'load_rss': lambda: bench_load_rss(args.track_seconds),
+        'clip': lambda: bench_clip(args.track_seconds, args.slot_seconds, min(args.runs, 3)),
+        'callback': lambda: bench_callback(args.track_seconds),
+        'scheduler': lambda: bench_scheduler(args.schedules),
+        'fleet': lambda: bench_fleet(args.agents, args.runs),
+    }
+    report = {'meta': {'timestamp': time.time(), 'python': platform.python_version(),
+                       'platform': platform.platform()},
+              'results': {}}
+    for name, suite in suites.items():
+        if args.only and name not in args.only:
+            continue
+        print(f"running {name}...", file=sys.stderr)
+        # The app logs to stdout, keep it free for the JSON report
+        with contextlib.redirect_stdout(sys.stderr):
+            report['results'][name] = suite()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + '\n', encoding='utf-8')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,25 @@
 """
 Script tạo phiên bản portable của Music Scheduler
 Chạy script này sẽ tạo file ZIP có thể giải nén và chạy trên bất kỳ máy Windows nào
+
+    python build_portable.py [--profile onefile|fast] [--no-startup-check]
+
+Profile "onefile" là một file .exe duy nhất nhưng mỗi lần mở phải giải nén
+vào thư mục tạm; "fast" (onedir, không UPX) mở nhanh hơn nhiều trên máy kiosk.
+After building, the script runs the binary once with --startup-report and
+profiles the imports of the source tree; both land in startup_report.json
+inside the ZIP so startup regressions show up build to build.
 """
 
+import argparse
+import json
 import os
+import re
+import subprocess
 import sys
 import shutil
+import tempfile
+import time
 import zipfile
 from pathlib import Path
 import PyInstaller.__main__
@@ -15,34 +29,110 @@ if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8')
     sys.stderr.reconfigure(encoding='utf-8')
 
+# Module không dùng tới nhưng PyInstaller hay kéo theo
+EXCLUDED_MODULES = [
+    'pygame', 'scipy', 'matplotlib', 'pandas', 'IPython', 'jedi',
+    'PyQt5', 'PyQt6', 'PySide2', 'PySide6', 'wx',
+    'pytest', 'setuptools', 'pip', 'lib2to3', 'pydoc_data',
+    'numpy.f2py', 'numpy.distutils', 'tkinter.test',
+]
+
+PROFILES = {
+    'onefile': ['--onefile'],
+    'fast': ['--onedir', '--noupx'],
+}
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def startup_config(folder):
+    """Config with one schedule and an empty music folder, for measuring"""
+    music = Path(folder) / 'music'
+    music.mkdir(exist_ok=True)
+    config_path = Path(folder) / 'music_scheduler_config.json'
+    config_path.write_text(json.dumps({
+        'music_folder': str(music),
+        'scheduled_times': [{'time': '12:00', 'volume': 70}],
+        'metrics_port': 0,
+    }), encoding='utf-8')
+    return config_path
+
+
+def measure_binary(exe):
+    """Launch the built app once, return its startup report with launch-relative times"""
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = startup_config(tmp)
+        report_path = Path(tmp) / 'startup.json'
+        launched = time.time()
+        subprocess.run([str(exe), '--config', str(config_path),
+                        '--startup-report', str(report_path), '--exit-after-startup'],
+                       cwd=tmp, timeout=300)
+        report = json.loads(report_path.read_text(encoding='utf-8'))
+    # Wall clock includes unpacking and interpreter start, which the app cannot see
+    report['from_launch'] = {name: at - launched for name, at in report.pop('wall').items()}
+    return report
+
+
+def import_profile(top=15):
+    """Slowest top-level imports of the source app (python -X importtime)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = startup_config(tmp)
+        proc = subprocess.run([sys.executable, '-X', 'importtime', str(Path('music_scheduler_gui.py').resolve()),
+                               '--config', str(config_path), '--exit-after-startup'],
+                              cwd=tmp, capture_output=True, text=True, timeout=300)
+    modules = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match and len(match.group(3)) == 1:  # One space: imported by the app itself
+            modules.append((match.group(4), int(match.group(2)) / 1000))
+    modules.sort(key=lambda item: item[1], reverse=True)
+    return [{'module': name, 'cumulative_ms': ms} for name, ms in modules[:top]]
+
+
+parser = argparse.ArgumentParser(description="Build bản portable của Music Scheduler")
+parser.add_argument('--profile', choices=list(PROFILES), default='onefile',
+                    help="onefile: một file .exe; fast: thư mục, khởi động nhanh")
+parser.add_argument('--no-startup-check', action='store_true',
+                    help="không chạy thử bản build để đo thời gian khởi động")
+args = parser.parse_args()
+
 print("="*60)
-print("🔨 BẮT ĐẦU BUILD MUSIC SCHEDULER - PORTABLE VERSION")
+print(f"🔨 BẮT ĐẦU BUILD MUSIC SCHEDULER - PORTABLE VERSION ({args.profile})")
 print("="*60)
 
 # Bước 1: Build file .exe
-print("\n[1/4] 📦 Đang build file .exe...")
+print("\n[1/5] 📦 Đang build file .exe...")
 PyInstaller.__main__.run([
     'music_scheduler_gui.py',
     '--name=MusicScheduler',
-    '--onefile',
+    *PROFILES[args.profile],
     '--windowed',
     '--clean',
+    *[f'--exclude-module={name}' for name in EXCLUDED_MODULES],
 ])
 
 # Bước 2: Tạo folder portable
-print("\n[2/4] 📁 Đang tạo folder portable...")
+print("\n[2/5] 📁 Đang tạo folder portable...")
 portable_folder = Path("MusicScheduler_Portable")
 if portable_folder.exists():
     shutil.rmtree(portable_folder)
 portable_folder.mkdir()
 
 # Bước 3: Copy file .exe và tạo file hướng dẫn
-print("\n[3/4] 📋 Đang copy files...")
+print("\n[3/5] 📋 Đang copy files...")
 
-# Copy .exe
-exe_source = Path("dist/MusicScheduler.exe")
+exe_name = "MusicScheduler.exe" if sys.platform == 'win32' else "MusicScheduler"
+if args.profile == 'onefile':
+    exe_source = Path("dist") / exe_name
+    exe_path = portable_folder / exe_name
+    copy = shutil.copy
+else:
+    # onedir: the exe plus its _internal folder, nothing to unpack at launch
+    exe_source = Path("dist/MusicScheduler")
+    exe_path = portable_folder / "MusicScheduler" / exe_name
+    copy = shutil.copytree
 if exe_source.exists():
-    shutil.copy(exe_source, portable_folder / "MusicScheduler.exe")
+    copy(exe_source, portable_folder / exe_source.name)
 else:
     print("❌ Lỗi: Không tìm thấy file .exe")
     exit(1)
@@ -56,6 +146,7 @@ readme_content = """╔═══════════════════
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 1. Double-click file "MusicScheduler.exe" để chạy
+   (bản "fast": mở thư mục MusicScheduler rồi chạy MusicScheduler.exe)
 
 2. Chọn folder chứa nhạc của bạn (MP3, WAV, OGG, FLAC)
 
@@ -108,8 +199,29 @@ Version: 1.0
 with open(portable_folder / "📖 HƯỚNG DẪN.txt", "w", encoding="utf-8") as f:
     f.write(readme_content)
 
-# Bước 4: Nén thành file ZIP
-print("\n[4/4] 🗜️  Đang nén thành file ZIP...")
+# Bước 4: Đo thời gian khởi động
+print("\n[4/5] ⏱️  Đang đo thời gian khởi động...")
+startup = {'profile': args.profile, 'excluded_modules': EXCLUDED_MODULES}
+try:
+    startup['imports'] = import_profile()
+    for entry in startup['imports']:
+        print(f"   import {entry['module']:30s} {entry['cumulative_ms']:8.1f} ms")
+except Exception as e:
+    print(f"⚠️  Không đo được thời gian import: {e}")
+if not args.no_startup_check:
+    try:
+        startup['binary'] = measure_binary(exe_path)
+        from_launch = startup['binary']['from_launch']
+        print(f"   Cửa sổ hiện sau {from_launch['window']:.2f}s, "
+              f"scheduler sẵn sàng sau {from_launch['scheduler']:.2f}s "
+              f"(RSS {startup['binary']['rss_mb'] or 0:.0f} MB)")
+    except Exception as e:
+        print(f"⚠️  Không chạy thử được bản build: {e}")
+with open(portable_folder / "startup_report.json", "w", encoding="utf-8") as f:
+    json.dump(startup, f, indent=2, ensure_ascii=False)
+
+# Bước 5: Nén thành file ZIP
+print("\n[5/5] 🗜️  Đang nén thành file ZIP...")
 zip_filename = "MusicScheduler_Portable.zip"
 
 if os.path.exists(zip_filename):
@@ -0,0 +1,122 @@
+"""
+Lưu cấu hình an toàn - ghi gộp, ghi nguyên tử, có version schema
+Edits made in quick succession become one write on a background thread;
+the file is replaced atomically so a crash never leaves half a config
+"""
+
+import copy
+import json
+import os
+import threading
+import time
+
+CONFIG_VERSION = 2
+SAVE_DELAY_SECONDS = 0.5
+
+
+def migrate(config):
+    """Bring a loaded config up to CONFIG_VERSION, return True if it changed"""
+    version = config.get('version', 1)
+    if version >= CONFIG_VERSION:
+        return False
+
+    if version < 2:
+        # v1 allowed bare "HH:MM" strings in scheduled_times
+        for owner in [config, *config.get('zones', [])]:
+            owner['scheduled_times'] = [
+                entry if isinstance(entry, dict) else {'time': entry, 'volume': 70}
+                for entry in owner.get('scheduled_times', [])]
+
+    config['version'] = CONFIG_VERSION
+    return True
+
+
+class ConfigStore:
+    """JSON config file with debounced, atomic writes.
+
+    save() only records a snapshot; a writer thread waits ``delay`` seconds
+    for more edits, then writes a temp file next to the config and
+    os.replace()s it over the old one. flush() writes anything pending now.
+    Writes are serialized, so the temp file never has two writers and an
+    older snapshot never replaces a newer one.
+    """
+
+    def __init__(self, path, delay=SAVE_DELAY_SECONDS):
+        self.path = path
+        self.delay = delay
+        self._pending = None
+        self._due = 0.0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def load(self):
+        """Read and migrate the config, {} if missing or unreadable"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Lỗi đọc cấu hình {self.path}: {e}")
+            # Keep the unreadable file instead of overwriting it on the next save
+            try:
+                os.replace(self.path, f"{self.path}.corrupt")
+            except OSError:
+                pass
+            return {}
+
+        if migrate(config):
+            print(f"Đã nâng cấu hình lên version {CONFIG_VERSION}")
+            self.save(config)
+        return config
+
+    def save(self, config):
+        """Schedule config to be written, replacing any unwritten snapshot"""
+        snapshot = copy.deepcopy(config)
+        snapshot['version'] = CONFIG_VERSION
+        with self._cond:
+            self._pending = snapshot
+            self._due = time.monotonic() + self.delay
+            self._cond.notify()
+
+    def flush(self):
+        """Write the pending snapshot now"""
+        with self._write_lock:
+            # Taken under the write lock: a snapshot is written before any later one
+            with self._cond:
+                config, self._pending = self._pending, None
+            if config is not None:
+                self._write(config)
+
+    def _write(self, config):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(config, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Lỗi lưu cấu hình {self.path}: {e}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (
+                        self._pending is None or time.monotonic() < self._due):
+                    timeout = None if self._pending is None else self._due - time.monotonic()
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+            self.flush()
+
+    def close(self):
+        """Write what is pending and stop the writer thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=2)
+        self.flush()
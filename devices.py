@@ -0,0 +1,170 @@
+"""
+Danh sách thiết bị output - tra theo tên, tự cập nhật khi cắm/rút loa
+PortAudio only sees devices added after it started once it is restarted,
+and a restart closes every open stream, so a rescan first asks the players
+to release their idle streams and waits while anything is playing. Rescans
+back off while nothing changes; request_rescan() asks for one right away.
+
+A zone that plays continuously, or keeps a stream open for a prefetched
+song, therefore never lets a rescan happen: new devices show up once every
+zone has been idle for a while.
+"""
+
+import threading
+
+import sounddevice as sd
+
+DEFAULT_DEVICE = 'Default Audio Output'
+DEVICE_POLL_SECONDS = 10  # Hot-plug rescan interval while idle, after a change or a request
+DEVICE_POLL_MAX_SECONDS = 600  # Doubles up to this while the device list stays the same
+
+
+def detect_audio_devices():
+    """Phát hiện các thiết bị âm thanh, trả về (names, device_info)"""
+    try:
+        devices = sd.query_devices()
+        device_info = []
+        audio_devices = []
+        seen_names = set()  # Track unique device names
+
+        # Get output devices only
+        for idx, device in enumerate(devices):
+            if device['max_output_channels'] > 0:  # Output device
+                device_name = device['name'].strip()
+
+                # Skip duplicates (same name already added)
+                if device_name in seen_names:
+                    continue
+
+                seen_names.add(device_name)
+                audio_devices.append(device_name)
+                device_info.append({
+                    'index': idx,
+                    'name': device_name,
+                    'channels': device['max_output_channels']
+                })
+
+        # If no devices found, add default
+        if audio_devices:
+            return audio_devices, device_info
+    except Exception as e:
+        print(f"Error detecting audio devices: {e}")
+    return [DEFAULT_DEVICE], [{'index': None, 'name': DEFAULT_DEVICE, 'channels': 2}]
+
+
+class DeviceRegistry:
+    """Cached output device list with name -> index lookups.
+
+    ``lock`` is held while PortAudio restarts; players hold it while they
+    open a stream so that a rescan never closes a stream being opened.
+    ``generation`` grows with every refresh, device indices of an older
+    generation may point at another device. on_changed(names) is called
+    from the watch thread when a rescan finds a different device list.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.info = []
+        self.generation = 0
+        self.lock = threading.RLock()
+        self.on_changed = None
+        self._index = {}
+        self._watch_thread = None
+        self._watch_stop = threading.Event()
+        self._wake = threading.Event()
+        self.refresh()
+
+    def refresh(self, rescan=False):
+        """Re-read the device list, return True if it changed.
+
+        With rescan PortAudio is restarted first so hot-plugged devices show
+        up; the caller makes sure no stream is open. The restart uses
+        sounddevice's private _terminate()/_initialize(), there is no public
+        API for it; without them the list is only re-queried, which misses
+        newly plugged devices.
+        """
+        with self.lock:
+            if rescan and hasattr(sd, '_terminate') and hasattr(sd, '_initialize'):
+                sd._terminate()
+                sd._initialize()
+            names, info = detect_audio_devices()
+            changed = names != self.names
+            self.names, self.info = names, info
+            self._index = {device['name']: device['index'] for device in info}
+            self.generation += 1
+        return changed
+
+    def index(self, name):
+        """Index of the device called name (None = system default)"""
+        return self._index.get(name)
+
+    def name(self, index):
+        """Name of device index, for status messages"""
+        for device in self.info:
+            if device['index'] == index:
+                return device['name']
+        return DEFAULT_DEVICE
+
+    def fallback(self, exclude=None):
+        """Device to continue on when exclude fails: the system default
+        output, else the first other device, None if there is none"""
+        candidates = [device['index'] for device in self.info if device['index'] is not None]
+        try:
+            default = sd.default.device[1]
+        except Exception:
+            default = -1
+        if default in candidates:
+            candidates.insert(0, default)
+        for index in candidates:
+            if index != exclude:
+                return index
+        return None
+
+    def watch(self, release, idle, interval=DEVICE_POLL_SECONDS, max_interval=DEVICE_POLL_MAX_SECONDS):
+        """Rescan once no stream is open, every interval seconds at first.
+
+        Each rescan that finds the same devices doubles the wait up to
+        max_interval; a change or request_rescan() goes back to interval.
+        release() may close idle streams and returns True if none is left
+        open; idle() is the same check without waiting on the players.
+        """
+        if self._watch_thread and self._watch_thread.is_alive():
+            return
+
+        def loop():
+            wait = interval
+            while True:
+                requested = self._wake.wait(wait)
+                self._wake.clear()
+                if self._watch_stop.is_set():
+                    return
+                if requested:
+                    wait = interval
+                try:
+                    if not release():
+                        continue
+                    with self.lock:
+                        # A play may have opened a stream since release()
+                        if not idle():
+                            continue
+                        changed = self.refresh(rescan=True)
+                    wait = interval if changed else min(wait * 2, max_interval)
+                    if changed and self.on_changed:
+                        self.on_changed(list(self.names))
+                except Exception as e:
+                    print(f"Lỗi cập nhật thiết bị âm thanh: {e}")
+
+        self._watch_stop.clear()
+        self._wake.clear()
+        self._watch_thread = threading.Thread(target=loop, daemon=True)
+        self._watch_thread.start()
+
+    def request_rescan(self):
+        """Rescan soon (once idle), e.g. when a device failed or the user
+        opens the device list"""
+        self._wake.set()
+
+    def close(self):
+        """Stop watching"""
+        self._watch_stop.set()
+        self._wake.set()
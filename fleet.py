@@ -0,0 +1,595 @@
+"""
+Fleet mode - một máy điều phối nhiều máy phát nhạc trong mạng LAN
+The coordinator runs the schedules of its own config and, shortly before
+each slot, tells every agent to start the same song on the same instant.
+It also pushes its schedules and music folder to the agents, which play
+them on their own whenever the coordinator is unreachable.
+
+Protocol: one JSON object per line over TCP, {"type": ..., ...}; long
+lists (library manifest and diff, schedules) are split over several
+messages with a "last" flag. Clock offsets are estimated NTP style from
+pings, start times are sent in each agent's own clock and the agent starts
+on the exact sample (precision start of the playback worker).
+
+The coordinator only listens on localhost unless given a bind address,
+which then needs a shared token that agents send in their hello.
+
+    python music_scheduler_gui.py --headless --fleet-coordinator --fleet-host 0.0.0.0 --fleet-token SECRET
+    python music_scheduler_gui.py --headless --fleet-agent 192.168.1.10:8765 --fleet-token SECRET [--fleet-name quay-1]
+
+The token may also come from the MUSIC_SCHEDULER_FLEET_TOKEN environment
+variable, which keeps it out of the process list.
+"""
+
+import asyncio
+import base64
+import hmac
+import itertools
+import json
+import os
+import socket
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+from schedule_rules import ScheduleRule, TriggerIndex, valid_entries
+from scheduler_engine import FLEET_HOST, FLEET_PORT, MusicSchedulerEngine, peak_rss_mb
+
+START_LEAD_SECONDS = 1.5  # Start commands go out this long before the start time
+PING_BURST = 8  # Pings right after an agent connects, for a first estimate
+PING_INTERVAL_SECONDS = 5.0
+OFFSET_SAMPLES = 16  # Clock estimate uses the fastest of this many recent pings
+TELEMETRY_INTERVAL_SECONDS = 5.0
+RECONNECT_SECONDS = 3.0
+CHUNK_BYTES = 192 * 1024  # File data per message, base64 makes it a third larger
+MAX_LINE_BYTES = 1 << 20
+STARTS_TTL_SECONDS = 600  # Start reports are kept this long for checking the spread
+LIST_CHUNK_ITEMS = 1000  # Paths or schedule entries per message, keeps lines far below MAX_LINE_BYTES
+FLEET_TOKEN_ENV = 'MUSIC_SCHEDULER_FLEET_TOKEN'
+FLEET_MUSIC_DIR = 'fleet_music'  # Agents keep the pushed library here, next to the config
+
+
+async def send(writer, message):
+    writer.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+    await writer.drain()
+
+
+async def receive(reader):
+    """Next message, None once the peer has closed the connection"""
+    line = await reader.readline()
+    return json.loads(line) if line else None
+
+
+async def send_list(writer, message, key, items):
+    """Send message once per LIST_CHUNK_ITEMS of items (under key), the
+    last one with last=True; an empty list is still one message"""
+    for start in range(0, max(len(items), 1), LIST_CHUNK_ITEMS):
+        await send(writer, dict(message, **{key: items[start:start + LIST_CHUNK_ITEMS],
+                                            'last': start + LIST_CHUNK_ITEMS >= len(items)}))
+
+
+def library_manifest(library, root):
+    """{relative path with '/': size} of the songs under root"""
+    manifest = {}
+    if not root:
+        return manifest
+    for path in library.tracks(root):
+        try:
+            manifest[Path(os.path.relpath(path, root)).as_posix()] = os.path.getsize(path)
+        except OSError:
+            pass  # Removed since the last scan
+    return manifest
+
+
+class ClockEstimate:
+    """Agent clock minus coordinator clock, from NTP-style pings.
+
+    A ping sent at t0 (coordinator clock) is received at t1 and answered at
+    t2 (agent clock) and the answer arrives at t3. The sample with the
+    shortest round trip waited least in queues, so the estimate is the
+    offset of the fastest recent sample.
+    """
+
+    def __init__(self, samples=OFFSET_SAMPLES):
+        self._samples = deque(maxlen=samples)  # (round trip, offset)
+
+    def add(self, t0, t1, t2, t3):
+        self._samples.append(((t3 - t0) - (t2 - t1), ((t1 - t0) + (t2 - t3)) / 2))
+
+    @property
+    def offset(self):
+        """Seconds to add to a coordinator time to get agent time, None before the first pong"""
+        return min(self._samples)[1] if self._samples else None
+
+    @property
+    def rtt(self):
+        return min(self._samples)[0] if self._samples else None
+
+
+class AgentLink:
+    """Coordinator side of one connected agent"""
+
+    def __init__(self, name, writer):
+        self.name = name
+        self.writer = writer
+        self.clock = ClockEstimate()
+        self.manifest = {}  # Library the agent has, as last synced
+        self.telemetry = {}
+        self.pings = {}  # ping id -> t0
+        self.push_lock = asyncio.Lock()  # One library push at a time, file chunks must not interleave
+
+
+class FleetCoordinator:
+    """Asyncio server that drives the agents.
+
+    Each slot of the main zone's schedules plays one song on every agent
+    (playlists are not spread over the fleet). starts[play_id] collects the
+    first-sample time each agent reported, in coordinator clock, so the
+    spread of a start can be checked; entries expire after STARTS_TTL_SECONDS.
+    Schedule edits are picked up at once and pushed to the agents.
+    """
+
+    def __init__(self, engine, host=FLEET_HOST, port=FLEET_PORT, lead=START_LEAD_SECONDS, token=None):
+        if token is None and host not in ('127.0.0.1', 'localhost', '::1'):
+            raise ValueError("máy điều phối mở ra mạng cần --fleet-token")
+        self.engine = engine
+        self.host = host
+        self.token = token
+        self.port = port
+        self.lead = lead
+        self.agents = {}  # name -> AgentLink
+        self.starts = {}  # play_id -> {agent name: first sample time}, oldest first
+        self._start_times = {}  # play_id -> monotonic() of the start command
+        self._schedules_changed = asyncio.Event()
+        self._server = None
+        self._loop = None
+        self._handlers = set()  # One task per connected agent
+        self._play_ids = itertools.count(1)
+        self._ping_ids = itertools.count(1)
+
+    async def start(self):
+        """Listen for agents; port 0 picks a free port"""
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port,
+                                                  limit=MAX_LINE_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+        # The coordinator plays nothing, a changed library only needs pushing
+        self.engine.library.on_refreshed = lambda root: self._loop.call_soon_threadsafe(
+            self._library_changed)
+        self.engine.on_schedules = lambda: self._loop.call_soon_threadsafe(self._on_schedules)
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for link in list(self.agents.values()):
+            link.writer.close()
+        # Let the handlers see the closed connections instead of being cancelled
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def run(self):
+        """Serve agents and play the schedules until cancelled"""
+        await self.start()
+        print(f"🛰️ Máy điều phối fleet: cổng {self.port}", flush=True)
+        try:
+            await self.run_schedules()
+        finally:
+            await self.close()
+
+    def music_path(self, song):
+        """Path of song relative to the music folder, None if outside it"""
+        relative = os.path.relpath(song, self.engine.music_folder)
+        return None if relative.startswith('..') else Path(relative).as_posix()
+
+    def _schedule_index(self):
+        """TriggerIndex over the main zone's song slots, with their entries"""
+        zone = self.engine.main_zone
+        index = TriggerIndex()
+        entries = {}
+        for key, schedule in zip(zone.schedule_keys(), zone.scheduled_times):
+            if schedule.get('overlay'):
+                continue  # Announcements are local to a machine, not fleet-wide
+            entries[key] = schedule
+            index.set(key, ScheduleRule.from_entry(schedule), lead=self.lead)
+        return index, entries
+
+    async def run_schedules(self):
+        """Fire start_all for every slot of the main zone, lead seconds early,
+        until cancelled; the slots are rebuilt whenever the schedules change"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._schedules_changed.clear()
+            index, entries = self._schedule_index()
+            await self._fire_schedules(loop, index, entries)
+
+    async def _fire_schedules(self, loop, index, entries):
+        """Play the slots of index until the schedules change"""
+        while True:
+            fire = index.peek()
+            timeout = None if fire is None else max((fire - datetime.now()).total_seconds(), 0)
+            try:
+                await asyncio.wait_for(self._schedules_changed.wait(), timeout)
+                return
+            except asyncio.TimeoutError:
+                pass
+            for key, fire in index.pop_due(datetime.now()):
+                schedule = entries[key]
+                # Picking may scan a folder the first time, keep the loop free
+                song = await loop.run_in_executor(None, self.engine.get_random_song,
+                                                  schedule.get('folder'))
+                relative = self.music_path(song) if song else None
+                if relative is None:
+                    print(f"Bỏ qua {schedule['time']}: không có bài trong folder nhạc")
+                    continue
+                await self.start_all(relative, schedule['volume'], fire.timestamp() + self.lead,
+                                     schedule['time'])
+
+    async def start_all(self, song, volume=70, at=None, scheduled_time=None):
+        """Tell every agent to play song (relative to the music folder) at
+        coordinator time at (default: lead seconds from now), return its play_id"""
+        at = at or time.time() + self.lead
+        play_id = next(self._play_ids)
+        self._expire_starts()
+        self.starts[play_id] = {}
+        self._start_times[play_id] = time.monotonic()
+        links = [link for link in self.agents.values() if link.clock.offset is not None]
+        await asyncio.gather(*(self._send(link, {
+            'type': 'play', 'play_id': play_id, 'song': song, 'volume': volume,
+            'time': scheduled_time, 'at': at + link.clock.offset}) for link in links))
+        print(f"▶️ Phát {song} trên {len(links)} agent lúc {datetime.fromtimestamp(at):%H:%M:%S.%f}",
+              flush=True)
+        return play_id
+
+    def _expire_starts(self):
+        expired = time.monotonic() - STARTS_TTL_SECONDS
+        for play_id, started in list(self._start_times.items()):
+            if started > expired:
+                break  # Insertion order is start order
+            del self._start_times[play_id]
+            self.starts.pop(play_id, None)
+
+    async def stop_all(self):
+        await asyncio.gather(*(self._send(link, {'type': 'stop'}) for link in list(self.agents.values())))
+
+    def status(self):
+        """{agent name: clock offset, round trip and latest telemetry}"""
+        return {name: {'offset': link.clock.offset, 'rtt': link.clock.rtt, **link.telemetry}
+                for name, link in self.agents.items()}
+
+    async def _send(self, link, message):
+        try:
+            await send(link.writer, message)
+        except (ConnectionError, OSError) as e:
+            print(f"Mất kết nối agent {link.name}: {e}")
+
+    async def _handle(self, reader, writer):
+        try:
+            hello = await receive(reader)
+        except (ConnectionError, ValueError):
+            hello = None
+        if not hello or hello.get('type') != 'hello' or not self._authorized(hello):
+            writer.close()
+            return
+
+        # The manifest follows the hello in chunks
+        manifest = {}
+        try:
+            while (message := await receive(reader)) is not None and message.get('type') == 'manifest':
+                manifest.update(message['entries'])
+                if message['last']:
+                    break
+            else:
+                message = None
+        except (ConnectionError, ValueError):
+            message = None
+        if message is None:
+            writer.close()
+            return
+
+        link = AgentLink(hello['name'], writer)
+        self.agents[link.name] = link
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        print(f"🔗 Agent {link.name} đã kết nối", flush=True)
+        tasks = [asyncio.create_task(self._setup(link, manifest))]
+        try:
+            while (message := await receive(reader)) is not None:
+                self._on_message(link, message)
+        except (ConnectionError, ValueError) as e:
+            print(f"Lỗi kết nối agent {link.name}: {e}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self.agents.get(link.name) is link:
+                del self.agents[link.name]
+            self._handlers.discard(handler)
+            writer.close()
+            print(f"🔌 Agent {link.name} đã ngắt kết nối", flush=True)
+
+    def _authorized(self, hello):
+        if self.token is None:
+            return True
+        if hmac.compare_digest(str(hello.get('token', '')).encode('utf-8'), self.token.encode('utf-8')):
+            return True
+        print(f"⛔ Từ chối agent {hello.get('name')}: sai token", flush=True)
+        return False
+
+    def _on_message(self, link, message):
+        kind = message.get('type')
+        if kind == 'pong':
+            t0 = link.pings.pop(message['id'], None)
+            if t0 is not None:
+                link.clock.add(t0, message['t1'], message['t2'], time.time())
+        elif kind == 'telemetry':
+            link.telemetry = {key: value for key, value in message.items() if key != 'type'}
+        elif kind == 'started':
+            starts = self.starts.get(message['play_id'])
+            if starts is not None and link.clock.offset is not None:
+                starts[link.name] = message['first_sample_at'] - link.clock.offset
+
+    async def _setup(self, link, manifest):
+        # Pings first: behind a library push they would queue and skew the estimate
+        for _ in range(PING_BURST):
+            await self._ping(link)
+            await asyncio.sleep(0.05)
+        link.manifest = manifest
+        if not await self._push_schedules(link):
+            return
+        await self.push_library(link)
+        while True:
+            await asyncio.sleep(PING_INTERVAL_SECONDS)
+            await self._ping(link)
+
+    async def _ping(self, link):
+        ping_id = next(self._ping_ids)
+        link.pings[ping_id] = time.time()
+        await self._send(link, {'type': 'ping', 'id': ping_id})
+
+    def _on_schedules(self):
+        self._schedules_changed.set()
+        for link in list(self.agents.values()):
+            asyncio.ensure_future(self._push_schedules(link))
+
+    async def _push_schedules(self, link):
+        try:
+            await send_list(link.writer, {'type': 'schedules'}, 'scheduled_times',
+                            self.engine.main_zone.scheduled_times)
+        except (ConnectionError, OSError) as e:
+            print(f"Mất kết nối agent {link.name}: {e}")
+            return False
+        return True
+
+    def _library_changed(self):
+        for link in list(self.agents.values()):
+            asyncio.ensure_future(self.push_library(link))
+
+    async def push_library(self, link):
+        """Send the agent the songs it lacks and the paths it should drop"""
+        async with link.push_lock:
+            # A push queued behind another one only sends what is still missing
+            await self._push_library(link)
+
+    async def _push_library(self, link):
+        # Disk reads go to the executor, the loop keeps serving pings and starts
+        loop = asyncio.get_running_loop()
+        root = self.engine.music_folder
+        ours = await loop.run_in_executor(None, library_manifest, self.engine.library, root)
+        add = [path for path, size in ours.items() if link.manifest.get(path) != size]
+        remove = [path for path in link.manifest if path not in ours]
+        if not add and not remove:
+            return
+        try:
+            await send_list(link.writer, {'type': 'library_diff'}, 'remove', remove)
+        except (ConnectionError, OSError) as e:
+            print(f"Mất kết nối agent {link.name}: {e}")
+            return
+        for relative in add:
+            try:
+                f = await loop.run_in_executor(None, open, os.path.join(root, *relative.split('/')), 'rb')
+                with f:
+                    offset = 0
+                    while True:
+                        chunk = await loop.run_in_executor(None, f.read, CHUNK_BYTES)
+                        last = len(chunk) < CHUNK_BYTES
+                        await send(link.writer, {'type': 'file', 'path': relative, 'offset': offset,
+                                                 'data': base64.b64encode(chunk).decode('ascii'),
+                                                 'last': last})
+                        offset += len(chunk)
+                        if last:
+                            break
+            except OSError as e:
+                print(f"Không gửi được {relative} cho {link.name}: {e}")
+        await self._send(link, {'type': 'library_done'})
+        link.manifest = ours
+
+
+class FleetAgent:
+    """Player node that follows a coordinator.
+
+    Pushed songs land in FLEET_MUSIC_DIR next to the config, which becomes
+    the agent's music folder, so a sync never touches other files. The
+    agent's own scheduler only runs while it is not connected.
+
+    clock_skew shifts the agent's protocol clock, to check the offset
+    estimation with several agents on one machine.
+    """
+
+    def __init__(self, engine, host, port=FLEET_PORT, name=None, clock_skew=0.0, token=None):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.token = token
+        self.name = name or socket.gethostname()
+        self.clock_skew = clock_skew
+        self.music_root = os.path.abspath(engine.data_path(FLEET_MUSIC_DIR))
+        self.connected = False
+        self._writer = None
+        self._loop = None
+        self._play_ids = {}  # history slot -> play_id of a pending start
+        self._schedules = []  # Schedule chunks received so far
+        os.makedirs(self.music_root, exist_ok=True)
+        if engine.music_folder != self.music_root:
+            engine.set_music_folder(self.music_root)
+        engine.on_play_started = self._play_started
+
+    def clock(self):
+        return time.time() + self.clock_skew
+
+    async def run(self):
+        """Stay connected to the coordinator until cancelled"""
+        self._loop = asyncio.get_running_loop()
+        self._standalone(True)
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port,
+                                                               limit=MAX_LINE_BYTES)
+            except OSError:
+                await asyncio.sleep(RECONNECT_SECONDS)
+                continue
+            try:
+                await self._session(reader, writer)
+            except (ConnectionError, ValueError) as e:
+                print(f"Lỗi kết nối máy điều phối: {e}")
+            finally:
+                self.connected = False
+                self._writer = None
+                writer.close()
+                self._standalone(True)
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    def _standalone(self, on):
+        """Own schedules run only while the coordinator is unreachable"""
+        engine = self.engine
+        if on and not engine.is_running:
+            try:
+                engine.start()
+            except ValueError as e:
+                print(f"Chưa có lịch để tự chạy: {e}")
+        elif not on and engine.is_running:
+            engine.stop(keep_playing=True)
+
+    async def _session(self, reader, writer):
+        self._schedules = []
+        # An up-to-date index, or songs pushed before a restart are sent again
+        await self._loop.run_in_executor(None, self.engine.library.refresh, self.music_root)
+        hello = {'type': 'hello', 'name': self.name}
+        if self.token is not None:
+            hello['token'] = self.token
+        await send(writer, hello)
+        manifest = library_manifest(self.engine.library, self.music_root)
+        await send_list(writer, {'type': 'manifest'}, 'entries', list(manifest.items()))
+        self.connected = True
+        self._writer = writer
+        self._standalone(False)
+        print(f"🔗 Đã kết nối máy điều phối {self.host}:{self.port}", flush=True)
+        telemetry = asyncio.create_task(self._telemetry_loop(writer))
+        try:
+            while (message := await receive(reader)) is not None:
+                await self._on_message(writer, message)
+        finally:
+            telemetry.cancel()
+
+    def _local_path(self, relative):
+        """Absolute path of a pushed song, refusing paths outside the music root"""
+        path = os.path.normpath(os.path.join(self.music_root, *relative.split('/')))
+        if os.path.commonpath([path, self.music_root]) != self.music_root:
+            raise ValueError(f"đường dẫn không hợp lệ: {relative}")
+        return path
+
+    async def _on_message(self, writer, message):
+        kind = message.get('type')
+        if kind == 'ping':
+            received = self.clock()
+            await send(writer, {'type': 'pong', 'id': message['id'], 't1': received, 't2': self.clock()})
+        elif kind == 'play':
+            self._play(message)
+        elif kind == 'stop':
+            self.engine.main_zone.stop_song()
+        elif kind == 'schedules':
+            self._schedules += message['scheduled_times']
+            if message['last']:
+                self.engine.main_zone.scheduled_times = valid_entries(self._schedules)
+                self._schedules = []
+                self.engine.schedules_changed()
+        elif kind == 'library_diff':
+            for relative in message['remove']:
+                try:
+                    os.remove(self._local_path(relative))
+                except OSError:
+                    pass
+        elif kind == 'file':
+            self._write_chunk(message)
+        elif kind == 'library_done':
+            self.engine.library.refresh_async(self.music_root)
+
+    def _write_chunk(self, message):
+        path = self._local_path(message['path'])
+        partial = path + '.part'
+        if message['offset'] == 0:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(partial, 'wb' if message['offset'] == 0 else 'ab') as f:
+            f.write(base64.b64decode(message['data']))
+        if message['last']:
+            os.replace(partial, path)
+
+    def _play(self, message):
+        zone = self.engine.main_zone
+        start_at = message['at'] - self.clock_skew  # Agent clock to time.time()
+        scheduled_time = message.get('time') or datetime.fromtimestamp(start_at).strftime('%H:%M:%S')
+        song = Path(self._local_path(message['song']))
+        if not song.exists():
+            print(f"Thiếu bài {message['song']}, chưa đồng bộ xong thư viện")
+            return
+        self._play_ids[zone.slot(scheduled_time)] = message['play_id']
+        # play_song_at waits for the start on its own thread
+        self._loop.run_in_executor(None, zone.play_song_at, song, start_at,
+                                   message.get('volume', 70), scheduled_time)
+
+    def _play_started(self, zone, slot, first_sample_at):
+        # Called from the playback worker thread
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._report_started, slot, first_sample_at)
+
+    def _report_started(self, slot, first_sample_at):
+        play_id = self._play_ids.pop(slot, None)
+        if play_id is not None and self._writer is not None:
+            asyncio.ensure_future(send(self._writer, {
+                'type': 'started', 'play_id': play_id,
+                'first_sample_at': first_sample_at + self.clock_skew}))
+
+    async def _telemetry_loop(self, writer):
+        zone = self.engine.main_zone
+        while True:
+            await send(writer, {'type': 'telemetry', 'playing': zone.player.active,
+                                'volume': zone.volume, 'accuracy': self.engine.start_accuracy(),
+                                'errors': zone.errors.value, 'rss_mb': peak_rss_mb()})
+            await asyncio.sleep(TELEMETRY_INTERVAL_SECONDS)
+
+
+def run_fleet(args):
+    """Chạy máy điều phối hoặc agent cho tới khi Ctrl+C"""
+    engine = MusicSchedulerEngine(args.config)
+    engine.on_status = lambda text, kind: print(text, flush=True)
+    engine.load_config()
+    engine.start_metrics()
+    token = args.fleet_token or os.environ.get(FLEET_TOKEN_ENV)
+    if args.fleet_agent:
+        host, _, port = args.fleet_agent.partition(':')
+        engine.watch_devices()
+        node = FleetAgent(engine, host or 'localhost', int(port or FLEET_PORT), args.fleet_name,
+                          token=token)
+    else:
+        engine.watch_library()
+        try:
+            node = FleetCoordinator(engine, args.fleet_host, args.fleet_port, token=token)
+        except ValueError as e:
+            print(f"Lỗi: {e}")
+            engine.shutdown()
+            return 2
+    try:
+        asyncio.run(node.run())
+    except KeyboardInterrupt:
+        pass
+    engine.shutdown()
+    return 0
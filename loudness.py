@@ -0,0 +1,183 @@
+"""
+Phân tích độ lớn (loudness) của bài hát để cân bằng âm lượng
+Integrated loudness follows ITU-R BS.1770 / EBU R128: K-weighting, 400 ms
+blocks with 75% overlap, absolute and relative gating. Files are analyzed
+in a process pool in the background; playback only looks the result up.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import soundfile as sf
+
+# Mức loudness đích (LUFS), giống ReplayGain 2.0
+TARGET_LUFS = -18.0
+MAX_BOOST_DB = 12.0
+
+SEGMENT_SECONDS = 0.1  # Gating blocks are 4 segments long, hop is 1 segment
+SEGMENTS_PER_READ = 100
+
+
+def k_weighting_power(samplerate, n):
+    """|H|^2 of the BS.1770 K-weighting filter at the rfft bins of length n"""
+    # Pre-filter (high shelf) and RLB (high pass) biquads designed for samplerate
+    gain_db, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    k = np.tan(np.pi * fc / samplerate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]
+    shelf_a = [1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    q, fc = 0.5003270373238773, 38.13547087602444
+    k = np.tan(np.pi * fc / samplerate)
+    a0 = 1 + k / q + k * k
+    pass_b = [1, -2, 1]
+    pass_a = [1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    z = np.exp(-1j * np.pi * np.arange(n // 2 + 1) / (n / 2))  # e^-jw per bin
+    response = np.ones(len(z), dtype=complex)
+    for b, a in ((shelf_b, shelf_a), (pass_b, pass_a)):
+        response *= (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    power = np.abs(response) ** 2
+
+    # Parseval weights: every bin but DC (and Nyquist for even n) counts twice
+    power[1:(n + 1) // 2] *= 2
+    return power / (n * n)
+
+
+def integrated_loudness(segment_power):
+    """Gated loudness in LUFS from (segments, channels) K-weighted mean squares"""
+    power = segment_power.sum(axis=1)
+    if len(power) >= 4:
+        # 400 ms blocks: mean of 4 consecutive 100 ms segments
+        cumulative = np.concatenate(([0.0], np.cumsum(power)))
+        blocks = (cumulative[4:] - cumulative[:-4]) / 4
+    else:
+        blocks = np.array([power.mean()]) if len(power) else np.zeros(0)
+
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[loudness > -70.0]
+    if not len(gated):
+        return None
+    relative = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+    with np.errstate(divide='ignore'):
+        gated = gated[-0.691 + 10 * np.log10(gated) > relative]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def analyze_file(path):
+    """Return (integrated LUFS or None, sample peak) of an audio file.
+
+    Runs in a worker process. The file is read in chunks of whole 100 ms
+    segments, each chunk is K-weighted in the frequency domain at once.
+    """
+    with sf.SoundFile(path) as f:
+        seg = max(int(f.samplerate * SEGMENT_SECONDS), 1)
+        weights = k_weighting_power(f.samplerate, seg)[:, None]
+        powers = []
+        peak = 0.0
+        for chunk in f.blocks(blocksize=seg * SEGMENTS_PER_READ, dtype='float32', always_2d=True):
+            if len(chunk):
+                peak = max(peak, float(np.abs(chunk).max()))
+            whole = len(chunk) // seg * seg
+            if not whole:
+                continue
+            segments = chunk[:whole].reshape(-1, seg, f.channels)
+            spectrum = np.fft.rfft(segments, axis=1)
+            powers.append(np.einsum('sfc,fo->sc', spectrum.real ** 2 + spectrum.imag ** 2, weights))
+    segment_power = np.concatenate(powers) if powers else np.zeros((0, 1))
+    return integrated_loudness(segment_power), peak
+
+
+def _analyze(path):
+    """Worker entry point, errors become a None result"""
+    try:
+        return analyze_file(path)
+    except Exception:
+        return None, None
+
+
+def track_gain(lufs, peak, target=TARGET_LUFS):
+    """Linear gain bringing a track to target, never clipping its peak"""
+    if lufs is None:
+        return 1.0
+    gain = 10 ** (min(target - lufs, MAX_BOOST_DB) / 20)
+    if peak and peak * gain > 1.0:
+        gain = 1.0 / peak
+    return gain
+
+
+class LoudnessAnalyzer:
+    """Background analysis of every library track missing a loudness value.
+
+    Folders are queued with analyze(root); one thread drains the queue and
+    fans the files out to a process pool that only exists while there is
+    work, so idle low-power boxes do not keep worker processes around.
+    """
+
+    def __init__(self, library, max_workers=None, batch_size=32):
+        self.library = library
+        self.max_workers = max_workers or max((os.cpu_count() or 2) - 1, 1)
+        self.batch_size = batch_size
+        self._roots = queue.Queue()
+        self._stop = threading.Event()
+        self._pool = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def analyze(self, root):
+        """Queue root for analysis of its new or changed tracks"""
+        if root:
+            self._roots.put(root)
+
+    def _run(self):
+        while not self._stop.is_set():
+            root = self._roots.get()
+            if root is None:
+                return
+            try:
+                self._analyze_root(root)
+            except Exception as e:
+                print(f"Lỗi phân tích loudness {root}: {e}")
+
+    def _analyze_root(self, root):
+        pending = self.library.loudness_pending(root)
+        if not pending:
+            return
+        print(f"🔉 Phân tích loudness {len(pending)} bài...")
+        rows = []
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            self._pool = pool
+            if self._stop.is_set():
+                pool.shutdown(wait=False, cancel_futures=True)  # close() ran before the pool existed
+            futures = {pool.submit(_analyze, path): (path, mtime) for path, mtime in pending}
+            for future in as_completed(futures):
+                if self._stop.is_set():
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    break
+                if future.cancelled():
+                    continue
+                path, mtime = futures[future]
+                rows.append((path, mtime) + future.result())
+                if len(rows) >= self.batch_size:
+                    self.library.store_loudness(rows)
+                    rows = []
+        self._pool = None
+        self.library.store_loudness(rows)
+
+    def close(self):
+        """Stop after the files being analyzed, unfinished work resumes next run
+
+        Queued files are cancelled, otherwise the interpreter would wait for
+        the whole pool at exit.
+        """
+        self._stop.set()
+        self._roots.put(None)
+        pool = self._pool
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,231 @@
+"""
+Số liệu vận hành - histogram thời gian callback, xrun, độ lệch giờ phát
+Exposed as Prometheus text on a local HTTP port and as a rolling JSON log.
+
+Hot-path metrics (the audio callback) have exactly one writer thread and
+are updated without locks; everything else takes a short lock.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = 9108
+METRICS_LOG = 'metrics.jsonl'
+
+# Bucket bounds in seconds
+CALLBACK_BUCKETS = (50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3)
+LATENCY_BUCKETS = (1e-3, 5e-3, 10e-3, 25e-3, 50e-3, 100e-3, 250e-3, 500e-3, 1.0, 2.5, 5.0)
+SKEW_BUCKETS = (-1.0, -0.1, -0.01, 0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+class Counter:
+    """Monotonic counter; pass locked=False when only one thread increments"""
+
+    def __init__(self, locked=True):
+        self.value = 0
+        self._lock = threading.Lock() if locked else None
+
+    def inc(self, amount=1):
+        if self._lock is None:
+            self.value += amount
+            return
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """Fixed-bucket histogram in the Prometheus style (cumulative on export)"""
+
+    def __init__(self, bounds, locked=True):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # Last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock() if locked else None
+
+    def observe(self, value):
+        if self._lock is None:
+            self.counts[bisect_left(self.bounds, value)] += 1
+            self.sum += value
+            self.count += 1
+            return
+        with self._lock:
+            self.counts[bisect_left(self.bounds, value)] += 1
+            self.sum += value
+            self.count += 1
+
+
+class MetricsRegistry:
+    """Named counters, histograms and gauges with optional labels.
+
+    Metrics are created once (get-or-create) and then updated directly
+    through the returned object, so the hot path never looks names up.
+    Gauges are functions evaluated at collection time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # (name, labels) -> Counter | Histogram | callable
+        self._help = {}  # name -> (type, help)
+
+    def _get(self, kind, name, help_text, labels, factory):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._help.setdefault(name, (kind, help_text))
+            if key not in self._metrics:
+                self._metrics[key] = factory()
+            return self._metrics[key]
+
+    def counter(self, name, help_text='', labels=None, locked=True):
+        return self._get('counter', name, help_text, labels, lambda: Counter(locked))
+
+    def histogram(self, name, help_text='', bounds=LATENCY_BUCKETS, labels=None, locked=True):
+        return self._get('histogram', name, help_text, labels, lambda: Histogram(bounds, locked))
+
+    def gauge(self, name, func, help_text='', labels=None):
+        """Register func() as the gauge's value, replacing an earlier one"""
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._help.setdefault(name, ('gauge', help_text))
+            self._metrics[key] = func
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._metrics.items(), key=lambda item: item[0])
+
+    def snapshot(self):
+        """All current values as a JSON-friendly dict"""
+        result = {}
+        for (name, labels), metric in self._items():
+            label_text = ','.join(f"{k}={v}" for k, v in labels)
+            key = f"{name}{{{label_text}}}" if labels else name
+            if isinstance(metric, Counter):
+                result[key] = metric.value
+            elif isinstance(metric, Histogram):
+                result[key] = {'count': metric.count, 'sum': metric.sum,
+                               'buckets': dict(zip([*map(str, metric.bounds), '+Inf'], metric.counts))}
+            else:
+                result[key] = _gauge_value(metric)
+        return result
+
+    def prometheus(self):
+        """Prometheus text exposition format"""
+        lines = []
+        described = set()
+        for (name, labels), metric in self._items():
+            if name not in described:
+                kind, help_text = self._help[name]
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+            if isinstance(metric, Counter):
+                lines.append(f"{name}{_labels(labels)} {metric.value}")
+            elif isinstance(metric, Histogram):
+                cumulative = 0
+                for bound, count in zip([*map(repr, metric.bounds), '+Inf'], metric.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {metric.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {metric.count}")
+            else:
+                value = _gauge_value(metric)
+                if value is not None:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _gauge_value(func):
+    try:
+        return func()
+    except Exception:
+        return None
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+# Registry shared by the whole process
+METRICS = MetricsRegistry()
+
+
+class MetricsServer:
+    """Serve /metrics (Prometheus text) and /metrics.json on localhost"""
+
+    def __init__(self, registry=METRICS, host='127.0.0.1', port=METRICS_PORT):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = registry_.prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(registry_.snapshot(), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes would flood stdout
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsLog:
+    """Append a JSON snapshot every interval seconds, rolling at max_bytes"""
+
+    def __init__(self, path, registry=METRICS, interval=60, max_bytes=1024 * 1024):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self):
+        """Append one snapshot line now"""
+        line = json.dumps({'ts': time.time(), 'metrics': self.registry.snapshot()},
+                          ensure_ascii=False)
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            print(f"Lỗi ghi metrics {self.path}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def close(self):
+        """Stop and write a final snapshot"""
+        self._stop.set()
+        self.write()
@@ -0,0 +1,245 @@
+"""
+Thư viện nhạc có index - lưu metadata bài hát trong SQLite
+Thay cho việc glob lại folder nhạc mỗi lần đến giờ phát
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import soundfile as sf
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.flac')
+LIBRARY_DB = 'music_library.db'
+
+# Ít file đổi hơn mức này thì đọc metadata ngay trong thread, không mở process pool
+POOL_MIN_FILES = 64
+SCAN_BATCH = 128  # Files per worker task, also the DB commit / progress granularity
+
+
+def scan_folder(root):
+    """Walk root recursively, return {path: (size, mtime)} for audio files"""
+    found = {}
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                            st = entry.stat()
+                            found[entry.path] = (st.st_size, st.st_mtime)
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Không đọc được folder {folder}: {e}")
+    return found
+
+
+def read_track_info(path):
+    """Return (duration, samplerate, channels) or Nones if unreadable"""
+    try:
+        info = sf.info(path)
+        return info.duration, info.samplerate, info.channels
+    except Exception:
+        return None, None, None
+
+
+def read_track_infos(paths):
+    """Worker task: (path, duration, samplerate, channels) for a batch of files"""
+    return [(path,) + read_track_info(path) for path in paths]
+
+
+class MusicLibrary:
+    """Persistent index of the audio files under one or more music folders.
+
+    The SQLite table is the durable copy; each indexed folder also keeps an
+    in-memory path list so picking a random song is O(1). Refreshing only
+    reads metadata for files whose size or mtime changed; large changes are
+    read in a process pool and committed batch by batch, so a cancelled or
+    interrupted scan resumes where it stopped.
+    """
+
+    def __init__(self, db_path=LIBRARY_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    root TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER,
+                    mtime REAL,
+                    duration REAL,
+                    samplerate INTEGER,
+                    channels INTEGER,
+                    PRIMARY KEY (root, path)
+                )""")
+            # Loudness results stay valid while the file's mtime is unchanged
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS loudness (
+                    path TEXT PRIMARY KEY,
+                    mtime REAL,
+                    lufs REAL,
+                    peak REAL
+                )""")
+        self._paths = {}  # root -> [path, ...]
+        self._generations = {}  # root -> count of path list changes, for caches built on it
+        self.on_refreshed = None  # Called with root after each refresh
+        self.on_progress = None  # Called with (root, done, total, files_per_sec) per batch
+        self._refresh_lock = threading.Lock()  # One scan at a time
+        self._cancel = threading.Event()
+        self._watch_stop = threading.Event()
+        self._watch_thread = None
+
+    def _load(self, root):
+        """Load the cached path list for root from the database"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM tracks WHERE root = ?", (root,)).fetchall()
+            self._paths[root] = [row[0] for row in rows]
+            self._generations[root] = self._generations.get(root, 0) + 1
+        return self._paths[root]
+
+    def generation(self, root):
+        """Grows whenever the path list of root changes"""
+        return self._generations.get(root, 0)
+
+    def tracks(self, root):
+        """Cached list of song paths under root"""
+        if root not in self._paths:
+            self._load(root)
+        return self._paths[root]
+
+    def refresh(self, root, workers=None):
+        """Sync the index with the files on disk, return (added, updated, removed)"""
+        if not root or not os.path.isdir(root):
+            return 0, 0, 0
+
+        with self._refresh_lock:
+            self._cancel.clear()
+            return self._refresh(root, workers)
+
+    def _refresh(self, root, workers):
+        started = time.perf_counter()
+        on_disk = scan_folder(root)
+        with self._lock:
+            indexed = {path: (size, mtime) for path, size, mtime in self._conn.execute(
+                "SELECT path, size, mtime FROM tracks WHERE root = ?", (root,))}
+
+        changed = [p for p, stat in on_disk.items() if indexed.get(p) != stat]
+        removed = [p for p in indexed if p not in on_disk]
+
+        done = 0
+        for infos in self._read_infos(changed, workers):
+            rows = [(root, info[0]) + on_disk[info[0]] + info[1:] for info in infos]
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            done += len(rows)
+            if self.on_progress:
+                rate = done / max(time.perf_counter() - started, 1e-6)
+                self.on_progress(root, done, len(changed), rate)
+
+        if self._cancel.is_set():
+            # Keep what was stored, the next refresh skips it by mtime
+            print(f"Đã hủy quét {root}: {done}/{len(changed)} file")
+            self._load(root)
+            return 0, 0, 0
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM tracks WHERE root = ? AND path = ?",
+                [(root, p) for p in removed])
+            self._paths[root] = list(on_disk)
+            if changed or removed:
+                self._generations[root] = self._generations.get(root, 0) + 1
+
+        if changed:
+            elapsed = time.perf_counter() - started
+            print(f"📚 Đã index {len(changed)} file trong {elapsed:.1f}s "
+                  f"({len(changed) / max(elapsed, 1e-6):.0f} file/s)")
+        if self.on_refreshed:
+            self.on_refreshed(root)
+        added = sum(1 for p in changed if p not in indexed)
+        return added, len(changed) - added, len(removed)
+
+    def _read_infos(self, paths, workers):
+        """Yield metadata batches for paths, stopping early on cancel"""
+        batches = [paths[i:i + SCAN_BATCH] for i in range(0, len(paths), SCAN_BATCH)]
+        if len(paths) < POOL_MIN_FILES:
+            for batch in batches:
+                if self._cancel.is_set():
+                    return
+                yield read_track_infos(batch)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(read_track_infos, batch) for batch in batches]
+            for future in as_completed(futures):
+                if self._cancel.is_set():
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    return
+                yield future.result()
+
+    def cancel_refresh(self):
+        """Stop a running scan after the batches already read"""
+        self._cancel.set()
+
+    def refresh_async(self, root):
+        """Refresh in a background thread so the caller never waits on disk"""
+        threading.Thread(target=self.refresh, args=(root,), daemon=True).start()
+
+    def loudness_pending(self, root):
+        """(path, mtime) of tracks under root without a current loudness value"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT t.path, t.mtime FROM tracks t LEFT JOIN loudness l "
+                "ON l.path = t.path AND l.mtime = t.mtime "
+                "WHERE t.root = ? AND l.path IS NULL", (root,)).fetchall()
+
+    def store_loudness(self, rows):
+        """Save (path, mtime, lufs, peak) analysis results"""
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?)", rows)
+
+    def loudness(self, path):
+        """(lufs, peak) of a song if analyzed since its last change, else None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT l.lufs, l.peak FROM loudness l JOIN tracks t "
+                "ON t.path = l.path AND t.mtime = l.mtime WHERE l.path = ? LIMIT 1",
+                (str(path),)).fetchone()
+        return row
+
+    def watch(self, get_roots, interval=300):
+        """Re-scan the folders returned by get_roots() every interval seconds"""
+        if self._watch_thread and self._watch_thread.is_alive():
+            return
+
+        def loop():
+            while not self._watch_stop.wait(interval):
+                for root in get_roots():
+                    try:
+                        self.refresh(root)
+                    except Exception as e:
+                        print(f"Lỗi cập nhật thư viện nhạc: {e}")
+
+        self._watch_stop.clear()
+        self._watch_thread = threading.Thread(target=loop, daemon=True)
+        self._watch_thread.start()
+
+    def close(self):
+        """Stop watching and scanning, close the database"""
+        self._watch_stop.set()
+        self._cancel.set()
+        with self._lock:
+            self._conn.close()
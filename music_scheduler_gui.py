@@ -3,49 +3,66 @@
 Music Scheduler - Phần mềm hẹn giờ phát nhạc
 Có thể build thành .exe cho Windows
 Version 2.0 - Improved with APScheduler and better UI
+Chạy không giao diện: music_scheduler_gui.py --headless
 """
 
 import os
-import random
-import threading
-from datetime import datetime
-from pathlib import Path
+import sys
+import time
+
+_STARTED_AT = time.perf_counter()
+
+if __name__ == "__main__":
+    # Process-pool workers of the frozen .exe exit here
+    import multiprocessing
+    multiprocessing.freeze_support()
+
+# Headless mode exits here, before any Tk or ttkthemes import
+if __name__ == "__main__" and "--headless" in sys.argv[1:]:
+    from scheduler_engine import main as headless_main
+    sys.exit(headless_main(sys.argv[1:], _STARTED_AT))
+
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-from pygame import mixer
-import json
-from apscheduler.schedulers.background import BackgroundScheduler
+from tkinter import ttk, filedialog, messagebox, simpledialog
 try:
     from ttkthemes import ThemedStyle
     HAS_TTKTHEMES = True
 except ImportError:
     HAS_TTKTHEMES = False
-import sounddevice as sd
-import soundfile as sf
-import numpy as np
+
+from schedule_rules import EVERY_DAY, WEEKDAY_NAMES
+from scheduler_engine import (CONFIG_FILE, MusicSchedulerEngine, build_arg_parser, report_startup,
+                              startup_report_path)
+
+# Tiến độ quét thư viện được vẽ lại tối đa mỗi bao nhiêu ms
+SCAN_UI_INTERVAL_MS = 100
+
+# Lựa chọn ngày khi thêm lịch, quy tắc chi tiết hơn sửa trong file cấu hình
+DAY_PRESETS = {
+    "Hằng ngày": EVERY_DAY,
+    "T2-T6": (0, 1, 2, 3, 4),
+    "T7-CN": (5, 6),
+}
 
 
 class MusicSchedulerGUI:
-    def __init__(self, root):
+    def __init__(self, root, config_path=CONFIG_FILE):
         self.root = root
         self.root.title("Music Scheduler - Hẹn Giờ Phát Nhạc")
         self.root.geometry("700x700")  # Increased size to fit all elements
         self.root.resizable(True, True)  # Allow resizing
         # Use system default background for better macOS compatibility
 
-        self.music_folder = ""
-        self.scheduled_times = []
-        self.is_running = False
-        self.last_played = {}
-        self.scheduler = BackgroundScheduler()
-        self.audio_devices = []
-        self.selected_device = None
-        self.current_volume = 0.7  # Default volume 70%
-        self.is_paused = False
-        self.playback_stream = None
-        self.audio_data = None
-        self.audio_position = 0
-        self.samplerate = None
+        # Scheduling and playback live in the engine, shared with headless mode
+        self.engine = MusicSchedulerEngine(config_path)
+        self.engine.on_status = lambda text, kind: self.root.after(0, self.set_status, text, kind)
+        self.engine.on_playback_state = lambda zone, playing: self.root.after(
+            0, self.on_zone_playback, zone, playing)
+        self.engine.on_volume = lambda zone, volume: self.root.after(0, self.on_zone_volume, zone, volume)
+        self.engine.on_scan_progress = self.queue_scan_progress
+        self.engine.on_devices = lambda names: self.root.after(0, self.on_devices_changed, names)
+        self.zone = self.engine.main_zone  # Zone shown and edited in the UI
+        self._scan_progress = None  # Latest (done, total, rate) not yet shown
 
         # Apply modern theme - use default for better macOS compatibility
         self.style = ttk.Style()
@@ -65,46 +82,11 @@ class MusicSchedulerGUI:
             'warning': '#f39c12'
         }
 
-        # Initialize mixer and detect audio devices
-        mixer.init()
-        self.detect_audio_devices()
-
         self.setup_ui()
         self.load_config()
-
-    def detect_audio_devices(self):
-        """Phát hiện các thiết bị âm thanh"""
-        try:
-            devices = sd.query_devices()
-            self.device_info = []
-            self.audio_devices = []
-            seen_names = set()  # Track unique device names
-
-            # Get output devices only
-            for idx, device in enumerate(devices):
-                if device['max_output_channels'] > 0:  # Output device
-                    device_name = device['name'].strip()
-
-                    # Skip duplicates (same name already added)
-                    if device_name in seen_names:
-                        continue
-
-                    seen_names.add(device_name)
-                    self.audio_devices.append(device_name)
-                    self.device_info.append({
-                        'index': idx,
-                        'name': device_name,
-                        'channels': device['max_output_channels']
-                    })
-
-            # If no devices found, add default
-            if not self.audio_devices:
-                self.audio_devices = ["Default Audio Output"]
-                self.device_info = [{'index': None, 'name': 'Default Audio Output', 'channels': 2}]
-        except Exception as e:
-            print(f"Error detecting audio devices: {e}")
-            self.audio_devices = ["Default Audio Output"]
-            self.device_info = [{'index': None, 'name': 'Default Audio Output', 'channels': 2}]
+        self.engine.watch_library()
+        self.engine.watch_devices()
+        self.engine.start_metrics()
 
     def setup_ui(self):
         """Thiết lập giao diện"""
@@ -133,13 +115,45 @@ class MusicSchedulerGUI:
                                command=self.browse_folder)
         browse_btn.pack(side=tk.RIGHT)
 
+        # Library scan progress, only shown while a scan is running
+        self.folder_frame = folder_frame
+        self.scan_frame = ttk.Frame(main)
+        self.scan_label = ttk.Label(self.scan_frame, text="", font=("Helvetica", 9))
+        self.scan_label.pack(side=tk.LEFT, padx=(0, 10))
+        cancel_scan_btn = ttk.Button(self.scan_frame, text="✖ Hủy",
+                                     command=self.cancel_scan)
+        cancel_scan_btn.pack(side=tk.RIGHT)
+        self.scan_bar = ttk.Progressbar(self.scan_frame, mode='determinate')
+        self.scan_bar.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 10))
+
         # Audio Output Selection
         audio_frame = ttk.LabelFrame(main, text="🔊 Thiết Bị Âm Thanh", padding=10)
         audio_frame.pack(fill=tk.X, pady=(0, 10))
 
+        # Zone selection - each zone has its own device, volume and schedules
+        zone_row = ttk.Frame(audio_frame)
+        zone_row.pack(fill=tk.X, pady=(0, 5))
+
+        ttk.Label(zone_row, text="Zone:", font=("Helvetica", 9)).pack(side=tk.LEFT, padx=(0, 18))
+        self.zone_var = tk.StringVar(value=self.zone_title(self.zone))
+        self.zone_dropdown = ttk.Combobox(zone_row,
+                                         textvariable=self.zone_var,
+                                         state="readonly",
+                                         font=("Helvetica", 9),
+                                         width=30)
+        self.zone_dropdown.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.zone_dropdown.bind('<<ComboboxSelected>>', self.on_zone_change)
+
+        remove_zone_btn = ttk.Button(zone_row, text="➖", width=3,
+                                     command=self.remove_zone)
+        remove_zone_btn.pack(side=tk.RIGHT, padx=(5, 0))
+        add_zone_btn = ttk.Button(zone_row, text="➕", width=3,
+                                  command=self.add_zone)
+        add_zone_btn.pack(side=tk.RIGHT, padx=(5, 0))
+
         ttk.Label(audio_frame, text="Output:", font=("Helvetica", 9)).pack(side=tk.LEFT, padx=(0, 10))
 
-        self.audio_var = tk.StringVar(value=self.audio_devices[0] if self.audio_devices else "Default Audio Output")
+        self.audio_var = tk.StringVar(value=self.zone.device_name)
         # Create custom combobox style with dark text
         combo_style = ttk.Style()
         combo_style.map('TCombobox', fieldbackground=[('readonly', 'white')])
@@ -147,10 +161,12 @@ class MusicSchedulerGUI:
 
         self.audio_dropdown = ttk.Combobox(audio_frame,
                                           textvariable=self.audio_var,
-                                          values=self.audio_devices,
+                                          values=self.engine.audio_devices,
                                           state="readonly",
                                           font=("Helvetica", 9),
-                                          width=30)
+                                          width=30,
+                                          # Newly plugged speakers show up once the list is rescanned
+                                          postcommand=self.engine.devices.request_rescan)
         self.audio_dropdown.pack(side=tk.LEFT, fill=tk.X, expand=True)
         self.audio_dropdown.bind('<<ComboboxSelected>>', self.on_device_change)
 
@@ -204,7 +220,19 @@ class MusicSchedulerGUI:
         minute_spin = ttk.Spinbox(add_frame, from_=0, to=59, width=7,
                                   textvariable=self.minute_var, format="%02.0f",
                                   font=("Helvetica", 10))
-        minute_spin.pack(side=tk.LEFT, padx=(0, 15))
+        minute_spin.pack(side=tk.LEFT, padx=(0, 10))
+
+        ttk.Label(add_frame, text="Giây:", font=("Helvetica", 9)).pack(side=tk.LEFT, padx=(0, 5))
+        self.second_var = tk.StringVar(value="00")
+        second_spin = ttk.Spinbox(add_frame, from_=0, to=59, width=5,
+                                  textvariable=self.second_var, format="%02.0f",
+                                  font=("Helvetica", 10))
+        second_spin.pack(side=tk.LEFT, padx=(0, 10))
+
+        self.days_var = tk.StringVar(value=next(iter(DAY_PRESETS)))
+        days_combo = ttk.Combobox(add_frame, textvariable=self.days_var, values=list(DAY_PRESETS),
+                                  state="readonly", width=10)
+        days_combo.pack(side=tk.LEFT, padx=(0, 15))
 
         ttk.Label(add_frame, text="Vol:", font=("Helvetica", 9)).pack(side=tk.LEFT, padx=(0, 5))
         self.schedule_volume_var = tk.IntVar(value=70)
@@ -273,30 +301,48 @@ class MusicSchedulerGUI:
         """Chọn folder nhạc"""
         folder = filedialog.askdirectory(title="Chọn folder chứa nhạc")
         if folder:
-            self.music_folder = folder
             self.folder_label.config(text=folder, foreground="black")
-            self.save_config()
+            self.engine.set_music_folder(folder)
+
+    def queue_scan_progress(self, done, total, rate):
+        """Called from the scan thread; Tk shows only the latest value"""
+        first = self._scan_progress is None
+        self._scan_progress = (done, total, rate)
+        if first:
+            self.root.after(SCAN_UI_INTERVAL_MS, self.show_scan_progress)
+
+    def show_scan_progress(self):
+        """Cập nhật tiến độ quét thư viện"""
+        progress, self._scan_progress = self._scan_progress, None
+        if progress is None:
+            return
+        done, total, rate = progress
+        if done >= total:
+            self.scan_frame.pack_forget()
+            return
+        if not self.scan_frame.winfo_ismapped():
+            self.scan_frame.pack(fill=tk.X, pady=(0, 10), after=self.folder_frame)
+        self.scan_bar.config(maximum=total, value=done)
+        self.scan_label.config(text=f"🔎 Đang quét {done}/{total} ({rate:.0f} file/s)")
+
+    def cancel_scan(self):
+        """Hủy quét thư viện"""
+        self.engine.cancel_scan()
+        self._scan_progress = None
+        self.scan_frame.pack_forget()
 
     def add_schedule(self):
         """Thêm lịch phát nhạc"""
         try:
             hour = int(self.hour_var.get())
             minute = int(self.minute_var.get())
+            second = int(self.second_var.get())
             volume = int(self.schedule_volume_var.get())
-            time_str = f"{hour:02d}:{minute:02d}"
 
-            # Check if time already exists
-            time_exists = any(s['time'] == time_str if isinstance(s, dict) else s == time_str for s in self.scheduled_times)
+            days = DAY_PRESETS[self.days_var.get()]
 
-            if not time_exists:
-                self.scheduled_times.append({"time": time_str, "volume": volume})
-                self.scheduled_times.sort(key=lambda x: x['time'] if isinstance(x, dict) else x)
+            if self.zone.add_schedule(hour, minute, volume, second, days):
                 self.update_schedule_list()
-                self.save_config()
-
-                # Update scheduler if running
-                if self.is_running:
-                    self.update_scheduler_jobs()
             else:
                 messagebox.showwarning("Cảnh báo", "Giờ này đã có trong lịch!")
         except ValueError:
@@ -306,321 +352,178 @@ class MusicSchedulerGUI:
         """Xóa lịch đã chọn"""
         selection = self.schedule_listbox.curselection()
         if selection:
-            idx = selection[0]
-            del self.scheduled_times[idx]
+            self.zone.remove_schedule(selection[0])
             self.update_schedule_list()
-            self.save_config()
-
-            # Update scheduler if running
-            if self.is_running:
-                self.update_scheduler_jobs()
 
     def update_schedule_list(self):
         """Cập nhật danh sách lịch"""
         self.schedule_listbox.delete(0, tk.END)
-        for schedule in self.scheduled_times:
-            if isinstance(schedule, dict):
-                time_str = schedule['time']
-                volume = schedule['volume']
-                self.schedule_listbox.insert(tk.END, f"  🕐 {time_str}  🔊 {volume}%")
-            else:
-                # Backward compatibility with old format
-                self.schedule_listbox.insert(tk.END, f"  🕐 {schedule}")
-
-    def get_random_song(self):
-        """Lấy bài hát ngẫu nhiên"""
-        if not self.music_folder or not os.path.exists(self.music_folder):
-            return None
-
-        extensions = ['.mp3', '.wav', '.ogg', '.flac']
-        songs = []
-
-        for ext in extensions:
-            songs.extend(Path(self.music_folder).glob(f'*{ext}'))
-
-        return random.choice(songs) if songs else None
-
-    def play_song_job(self, scheduled_time, volume=70):
-        """Job để phát nhạc - được gọi bởi APScheduler"""
-        now = datetime.now()
-        today = now.strftime('%Y-%m-%d')
-
-        # Kiểm tra xem đã phát trong ngày chưa
-        if scheduled_time in self.last_played and self.last_played[scheduled_time] == today:
+        schedules = zip(self.zone.iter_schedules(), self.zone.rules(), self.zone.upcoming(),
+                        self.zone.scheduled_times)
+        for (time_str, volume, playlist, folder), rule, upcoming, entry in schedules:
+            songs = f"  🎶 {playlist} bài" if playlist > 1 else ""
+            if entry.get('overlay'):
+                songs = f"  🔔 {os.path.basename(entry['overlay'])}"
+            days = rule.describe()
+            days = f"  📅 {days}" if days else ""
+            folder = f"  📁 {os.path.basename(folder)}" if folder else ""
+            if entry.get('start_offset') or entry.get('max_duration'):
+                start = int(entry.get('start_offset', 0))
+                folder += f"  ✂️ từ {start // 60}:{start % 60:02d}"
+                if entry.get('max_duration'):
+                    length = int(entry['max_duration'])
+                    folder += f", tối đa {length // 60}:{length % 60:02d}"
+            if upcoming:
+                upcoming = f"{WEEKDAY_NAMES[upcoming.weekday()]} {upcoming:%d/%m %H:%M:%S}"
+            self.schedule_listbox.insert(
+                tk.END, f"  🕐 {time_str}  🔊 {volume}%{songs}{days}{folder}  ⏭️ {upcoming or 'hết lịch'}")
+
+    def set_status(self, text, kind):
+        """Hiển thị trạng thái, kind là key trong self.colors"""
+        self.status_label.config(text=text, foreground=self.colors[kind])
+
+    def set_playback_controls(self, playing):
+        """Enable/disable pause and stop while a song is playing"""
+        state = tk.NORMAL if playing else tk.DISABLED
+        if playing:
+            self.pause_btn.config(state=state)
+        else:
+            self.pause_btn.config(state=state, text="⏸️ Pause")
+        self.stop_btn.config(state=state)
+
+    def zone_title(self, zone):
+        """Tên zone hiển thị trong dropdown"""
+        return "Zone chính" if zone is self.engine.main_zone else zone.name
+
+    def update_zone_list(self):
+        """Cập nhật dropdown zone"""
+        self.zone_dropdown.config(values=[self.zone_title(z) for z in self.engine.zones])
+        self.zone_var.set(self.zone_title(self.zone))
+
+    def show_zone(self, zone):
+        """Hiển thị thiết bị, volume và lịch của zone"""
+        self.zone = zone
+        self.update_zone_list()
+        self.audio_var.set(zone.device_name)
+        self.set_volume_display(zone.volume)
+        self.set_playback_controls(zone.player.active)
+        self.update_schedule_list()
+
+    def on_zone_change(self, event):
+        """Callback when another zone is selected"""
+        titles = [self.zone_title(z) for z in self.engine.zones]
+        self.show_zone(self.engine.zones[titles.index(self.zone_var.get())])
+
+    def add_zone(self):
+        """Thêm zone mới trên một thiết bị khác"""
+        name = simpledialog.askstring("Thêm zone", "Tên zone:", parent=self.root)
+        if not name:
             return
+        zone = self.engine.add_zone(name.strip(), self.audio_var.get())
+        if zone is None:
+            messagebox.showwarning("Cảnh báo", "Tên zone không hợp lệ hoặc đã có!")
+            return
+        self.show_zone(zone)
 
-        song = self.get_random_song()
-        if song:
-            # Set volume for this schedule
-            self.current_volume = volume / 100.0
-
-            # Update volume slider UI to reflect schedule volume
-            self.root.after(0, lambda: self.volume_var.set(volume))
-            self.root.after(0, lambda: self.volume_label.config(text=f"{volume}%"))
-
-            # Update UI
-            self.root.after(0, lambda: self.status_label.config(
-                text=f"🎵 Đang phát: {song.name} (Vol: {volume}%)",
-                foreground=self.colors['success']))
-
-            # Play song in a separate thread to not block scheduler
-            def play_thread():
-                try:
-                    # Load audio file
-                    self.audio_data, self.samplerate = sf.read(str(song))
-                    self.audio_position = 0
-
-                    # Enable playback controls
-                    self.root.after(0, lambda: self.pause_btn.config(state=tk.NORMAL))
-                    self.root.after(0, lambda: self.stop_btn.config(state=tk.NORMAL))
-
-                    # Start playback stream
-                    self.start_playback_stream(scheduled_time, today)
+    def remove_zone(self):
+        """Xóa zone đang chọn (không xóa được zone chính)"""
+        if self.zone is self.engine.main_zone:
+            messagebox.showwarning("Cảnh báo", "Không thể xóa zone chính!")
+            return
+        if messagebox.askyesno("Xóa zone", f"Xóa zone {self.zone.name} và các lịch của nó?"):
+            self.engine.remove_zone(self.zone)
+            self.show_zone(self.engine.main_zone)
 
-                except Exception as e:
-                    print(f"Lỗi phát nhạc: {e}")
-                    self.root.after(0, lambda: self.status_label.config(
-                        text=f"❌ Lỗi phát nhạc: {str(e)[:30]}...",
-                        foreground=self.colors['danger']))
+    def on_zone_playback(self, zone, playing):
+        """Playback state hook, only the shown zone drives the controls"""
+        if zone is self.zone:
+            self.set_playback_controls(playing)
+            self.update_schedule_list()  # Next occurrences moved on
 
-            threading.Thread(target=play_thread, daemon=True).start()
+    def on_zone_volume(self, zone, volume):
+        if zone is self.zone:
+            self.set_volume_display(volume)
 
-    def start_playback_stream(self, scheduled_time=None, today=None):
-        """Start or restart the playback stream with current device"""
-        try:
-            # Stop existing stream if any
-            if self.playback_stream and self.playback_stream.active:
-                self.playback_stream.stop()
-                self.playback_stream.close()
-
-            # Get selected device index
-            selected_device_name = self.audio_var.get()
-            device_index = None
-            for dev_info in self.device_info:
-                if dev_info['name'] == selected_device_name:
-                    device_index = dev_info['index']
-                    break
-
-            # Callback function for real-time audio
-            def audio_callback(outdata, frames, time_info, status):
-                if status:
-                    print(status)
-
-                if self.is_paused:
-                    outdata.fill(0)  # Output silence when paused
-                    return
-
-                # Get the next chunk of audio
-                start = self.audio_position
-                end = start + frames
-
-                if start >= len(self.audio_data):
-                    raise sd.CallbackStop()
-
-                chunk = self.audio_data[start:end]
-
-                # Apply real-time volume
-                chunk = chunk * self.current_volume
-
-                # Handle end of audio
-                if len(chunk) < frames:
-                    outdata[:len(chunk)] = chunk
-                    outdata[len(chunk):].fill(0)
-                    raise sd.CallbackStop()
-                else:
-                    outdata[:] = chunk
-
-                self.audio_position = end
-
-            # Create and start stream with selected device
-            self.playback_stream = sd.OutputStream(
-                samplerate=self.samplerate,
-                channels=self.audio_data.shape[1] if len(self.audio_data.shape) > 1 else 1,
-                callback=audio_callback,
-                device=device_index
-            )
-            self.playback_stream.start()
-
-            # Wait until playback is finished
-            while self.audio_position < len(self.audio_data):
-                if not self.is_running or not self.playback_stream.active:
-                    break
-                sd.sleep(100)
-
-            # Clean up
-            if self.playback_stream:
-                self.playback_stream.stop()
-                self.playback_stream.close()
-                self.playback_stream = None
-
-            # Disable playback controls
-            self.root.after(0, lambda: self.pause_btn.config(state=tk.DISABLED))
-            self.root.after(0, lambda: self.stop_btn.config(state=tk.DISABLED))
-
-            # Mark as played
-            if scheduled_time and today:
-                self.last_played[scheduled_time] = today
-
-            # Update UI
-            if self.is_running:
-                self.root.after(0, lambda: self.status_label.config(
-                    text="✅ Đã phát xong - Chờ lịch tiếp theo",
-                    foreground=self.colors['primary']))
-
-        except Exception as e:
-            print(f"Lỗi stream: {e}")
-            self.root.after(0, lambda: self.status_label.config(
-                text=f"❌ Lỗi stream: {str(e)[:30]}...",
-                foreground=self.colors['danger']))
+    def set_volume_display(self, volume):
+        """Reflect a schedule volume on the slider"""
+        self.volume_var.set(volume)
+        self.volume_label.config(text=f"{volume}%")
 
     def on_volume_change(self, value):
         """Callback when volume slider changes"""
         volume_percent = int(float(value))
-        self.current_volume = volume_percent / 100.0
+        self.zone.set_volume(volume_percent)
         self.volume_label.config(text=f"{volume_percent}%")
 
-    def on_device_change(self, event):
-        """Callback when audio device changes - restart stream with new device"""
-        if self.playback_stream and self.playback_stream.active and self.audio_data is not None:
-            # Save current position
-            saved_position = self.audio_position
-
-            # Restart stream in a thread to avoid blocking UI
-            def restart_stream():
-                try:
-                    # Stop current stream
-                    if self.playback_stream:
-                        self.playback_stream.stop()
-                        self.playback_stream.close()
-
-                    # Restore position (will restart from here)
-                    self.audio_position = saved_position
+    def on_devices_changed(self, names):
+        """A speaker was plugged in or removed"""
+        self.audio_dropdown.config(values=names)
+        self.set_status("🔌 Danh sách thiết bị âm thanh đã cập nhật", 'primary')
 
-                    # Restart stream with new device
-                    self.start_playback_stream()
-                except Exception as e:
-                    print(f"Lỗi khi đổi device: {e}")
-
-            threading.Thread(target=restart_stream, daemon=True).start()
+    def on_device_change(self, event):
+        """Callback when audio device changes - continue on the new device"""
+        self.zone.set_device(self.audio_var.get())
 
     def toggle_pause(self):
         """Pause/Resume playback"""
-        if self.playback_stream and self.playback_stream.active:
-            if self.is_paused:
-                # Resume
-                self.is_paused = False
-                self.pause_btn.config(text="⏸️ Pause")
-            else:
-                # Pause
-                self.is_paused = True
-                self.pause_btn.config(text="▶️ Resume")
+        paused = self.zone.toggle_pause()
+        if paused is not None:
+            self.pause_btn.config(text="▶️ Resume" if paused else "⏸️ Pause")
 
     def stop_song(self):
         """Stop current song"""
-        if self.playback_stream and self.playback_stream.active:
-            self.playback_stream.stop()
-            self.playback_stream.close()
-            self.playback_stream = None
-        self.pause_btn.config(state=tk.DISABLED, text="⏸️ Pause")
-        self.stop_btn.config(state=tk.DISABLED)
-        self.is_paused = False
-        self.status_label.config(
-            text="⏹️ Đã dừng phát nhạc",
-            foreground=self.colors['warning'])
-
-    def update_scheduler_jobs(self):
-        """Cập nhật các jobs trong scheduler"""
-        # Xóa tất cả jobs cũ
-        self.scheduler.remove_all_jobs()
-
-        # Thêm jobs mới
-        for schedule in self.scheduled_times:
-            if isinstance(schedule, dict):
-                time_str = schedule['time']
-                volume = schedule['volume']
-            else:
-                # Backward compatibility
-                time_str = schedule
-                volume = 70  # Default volume
-
-            hour, minute = map(int, time_str.split(':'))
-            self.scheduler.add_job(
-                func=lambda t=time_str, v=volume: self.play_song_job(t, v),
-                trigger='cron',
-                hour=hour,
-                minute=minute,
-                id=f'play_{time_str}',
-                replace_existing=True
-            )
+        self.zone.stop_song()
+        self.set_playback_controls(False)
+        self.set_status("⏹️ Đã dừng phát nhạc", 'warning')
 
     def start_scheduler(self):
         """Bắt đầu scheduler"""
-        if not self.music_folder:
-            messagebox.showerror("Lỗi", "Vui lòng chọn folder nhạc!")
-            return
-
-        if not self.scheduled_times:
-            messagebox.showerror("Lỗi", "Vui lòng thêm ít nhất một lịch phát nhạc!")
+        try:
+            self.engine.start()
+        except ValueError as e:
+            messagebox.showerror("Lỗi", str(e))
             return
 
-        self.is_running = True
         self.start_btn.config(state=tk.DISABLED)
         self.stop_btn.config(state=tk.NORMAL)
-        self.status_label.config(
-            text="▶️ Đang chạy - Chờ đến giờ phát nhạc...",
-            foreground=self.colors['success'])
-
-        # Start APScheduler
-        self.update_scheduler_jobs()
-        if not self.scheduler.running:
-            self.scheduler.start()
 
     def stop_scheduler(self):
         """Dừng scheduler"""
-        self.is_running = False
-        mixer.music.stop()
-
-        # Stop scheduler
-        if self.scheduler.running:
-            self.scheduler.shutdown(wait=False)
-            self.scheduler = BackgroundScheduler()  # Create new instance for next start
+        self.engine.stop()
 
         self.start_btn.config(state=tk.NORMAL)
         self.stop_btn.config(state=tk.DISABLED)
-        self.status_label.config(text="⏹️ Đã dừng", foreground=self.colors['danger'])
-
-    def save_config(self):
-        """Lưu cấu hình"""
-        config = {
-            'music_folder': self.music_folder,
-            'scheduled_times': self.scheduled_times
-        }
-        try:
-            with open('music_scheduler_config.json', 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2, ensure_ascii=False)
-        except:
-            pass
 
     def load_config(self):
         """Tải cấu hình"""
-        try:
-            if os.path.exists('music_scheduler_config.json'):
-                with open('music_scheduler_config.json', 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    self.music_folder = config.get('music_folder', '')
-                    self.scheduled_times = config.get('scheduled_times', [])
-
-                    if self.music_folder:
-                        self.folder_label.config(text=self.music_folder, foreground="black")
-                    self.update_schedule_list()
-        except:
-            pass
+        self.engine.load_config()
+        if self.engine.music_folder:
+            self.folder_label.config(text=self.engine.music_folder, foreground="black")
+        self.show_zone(self.engine.main_zone)
 
 
 def main():
+    parser = build_arg_parser()
+    args = parser.parse_args()
+    if args.fleet_coordinator or args.fleet_agent:
+        parser.error("chế độ fleet chỉ chạy không giao diện, thêm --headless")
     root = tk.Tk()
-    app = MusicSchedulerGUI(root)
+    app = MusicSchedulerGUI(root, args.config)
+    # Engine built, config and library index loaded
+    scheduler_ready = time.perf_counter()
+    if args.startup_report or args.exit_after_startup:
+        def on_ready():
+            if args.startup_report:
+                report_startup('gui', _STARTED_AT,
+                               {'scheduler': scheduler_ready, 'window': time.perf_counter()},
+                               startup_report_path(args))
+            if args.exit_after_startup:
+                root.destroy()
+        # Runs once the window has been drawn and the event loop is idle
+        root.after_idle(on_ready)
     root.mainloop()
+    # Also writes the edits from the last moments before closing, still debounced
+    app.engine.shutdown()
 
 
 if __name__ == "__main__":
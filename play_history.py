@@ -0,0 +1,111 @@
+"""
+Lịch sử phát nhạc lưu trong SQLite - không mất khi khởi động lại
+Each (slot, day) pair can be claimed exactly once, atomically
+"""
+
+import sqlite3
+import threading
+import time
+
+HISTORY_DB = 'music_scheduler_history.db'
+
+# Catch-up policies for slots missed while the app was not running
+CATCH_UP_SKIP = 'skip'          # Missed slots are recorded as skipped
+CATCH_UP_LATE = 'late'          # Every missed slot within the grace window plays, in order
+CATCH_UP_COALESCE = 'coalesce'  # Only the most recent missed slot plays
+CATCH_UP_POLICIES = (CATCH_UP_SKIP, CATCH_UP_LATE, CATCH_UP_COALESCE)
+
+
+class PlayHistory:
+    """Durable record of which schedule slots have played on which day"""
+
+    def __init__(self, db_path=HISTORY_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            # WAL keeps each commit durable without rewriting the whole file
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS plays (
+                    slot TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    song TEXT,
+                    scheduled_at REAL,
+                    claimed_at REAL,
+                    started_at REAL,
+                    PRIMARY KEY (slot, day)
+                )""")
+            # Shuffle memory: when each song was last picked
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS track_plays (
+                    path TEXT PRIMARY KEY,
+                    last_played REAL,
+                    plays INTEGER NOT NULL DEFAULT 0
+                )""")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS track_plays_recent ON track_plays (last_played)")
+
+    def claim(self, slot, day, scheduled_at=None, status='playing'):
+        """Atomically mark slot as taken for day. False if it already was"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO plays (slot, day, status, scheduled_at, claimed_at) "
+                "VALUES (?, ?, ?, ?, ?)", (slot, day, status, scheduled_at, time.time()))
+            return cursor.rowcount == 1
+
+    def release(self, slot, day):
+        """Undo a claim when nothing could be played (e.g. empty folder)"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM plays WHERE slot = ? AND day = ?", (slot, day))
+
+    def update(self, slot, day, **fields):
+        """Set status / song / started_at on an existing claim"""
+        if not fields:
+            return
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE plays SET {columns} WHERE slot = ? AND day = ?",
+                               (*fields.values(), slot, day))
+
+    def played(self, slot, day):
+        """True if slot has been claimed (played, playing or skipped) on day"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM plays WHERE slot = ? AND day = ?", (slot, day)).fetchone()
+        return row is not None
+
+    def recent(self, limit=50):
+        """Most recent plays as dicts, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT slot, day, status, song, scheduled_at, started_at FROM plays "
+                "ORDER BY claimed_at DESC LIMIT ?", (limit,)).fetchall()
+        keys = ('slot', 'day', 'status', 'song', 'scheduled_at', 'started_at')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def mark_track_played(self, path, when=None):
+        """Remember that path was picked, for the shuffle's no-repeat window"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO track_plays (path, last_played, plays) VALUES (?, ?, 1) "
+                "ON CONFLICT(path) DO UPDATE SET last_played = excluded.last_played, "
+                "plays = plays + 1", (str(path), when or time.time()))
+
+    def recent_tracks(self, limit):
+        """The limit most recently picked paths, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM track_plays ORDER BY last_played DESC LIMIT ?",
+                (limit,)).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def track_last_played(self):
+        """{path: last picked timestamp} for every song picked so far"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT path, last_played FROM track_plays"))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,514 @@
+"""
+Zone phát nhạc - mỗi thiết bị output có lịch, volume và stream riêng
+Several zones run side by side in one engine and share its library,
+play history and decoded-audio cache
+"""
+
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from audio_stream import FadeOutSource
+from metrics import METRICS, SKEW_BUCKETS
+from play_history import CATCH_UP_COALESCE, CATCH_UP_LATE, CATCH_UP_SKIP
+from player import PlaybackWorker
+from schedule_rules import EVERY_DAY, ScheduleRule, parse_time
+
+MAIN_ZONE = 'main'
+PRECISION_HANDOFF_SECONDS = 0.25  # Precise jobs hand the start time to the player this early
+SPIN_SECONDS = 0.002  # Busy-wait the last stretch, sleep() overshoots by up to a tick
+OVERLAY_GRACE_SECONDS = 1  # A late announcement is worse than none, whatever the catch-up policy
+
+
+def wait_until(wall_time):
+    """Block until wall_time (time.time() scale): sleep, then spin on monotonic_ns"""
+    deadline = time.monotonic_ns() + int((wall_time - time.time()) * 1e9)
+    spin = int(SPIN_SECONDS * 1e9)
+    while True:
+        remaining = deadline - time.monotonic_ns()
+        if remaining <= 0:
+            return
+        if remaining > spin:
+            time.sleep((remaining - spin) / 1e9)
+
+
+def slot_datetime(scheduled_time, now):
+    """datetime of today's scheduled_time, on the neighbouring day when a job
+    fires across midnight (early for just after, or catching up just before)"""
+    hour, minute, second = parse_time(scheduled_time)
+    scheduled_at = now.replace(hour=hour, minute=minute, second=second, microsecond=0)
+    if (scheduled_at - now).total_seconds() > 12 * 3600:
+        scheduled_at -= timedelta(days=1)  # Catch-up of a slot just before midnight
+    elif (now - scheduled_at).total_seconds() > 12 * 3600:
+        scheduled_at += timedelta(days=1)  # Fired early for a slot just after midnight
+    return scheduled_at
+
+
+def song_args(schedule):
+    """play_song_job / prefetch_song_job arguments of a schedule entry"""
+    return (schedule['time'], schedule['volume'], schedule.get('playlist', 1), schedule.get('folder'),
+            schedule.get('start_offset', 0), schedule.get('max_duration'), schedule.get('fade_out', 0))
+
+
+class PlaybackZone:
+    """One output device with its own schedule list, volume and player.
+
+    The main zone keeps the legacy job IDs and history slots ("play_12:00",
+    "12:00"); other zones prefix them with their name so that the same time
+    in two zones is two independent slots.
+    """
+
+    def __init__(self, engine, name=MAIN_ZONE, device_name=None, scheduled_times=None, volume=70):
+        self.engine = engine
+        self.name = name
+        self.device_name = device_name or engine.audio_devices[0]
+        self.scheduled_times = scheduled_times if scheduled_times is not None else []
+        self.volume = volume  # Live volume in percent, schedules override it
+        self.player = PlaybackWorker(on_started=self.on_playback_started,
+                                     on_finished=self.on_playback_finished,
+                                     on_error=self.on_playback_error,
+                                     crossfade=engine.crossfade,
+                                     duck_gain=engine.duck_gain,
+                                     native_format=engine.native_format,
+                                     devices=engine.devices,
+                                     on_device_lost=self.on_device_lost,
+                                     name=name)
+        self.player.volume = volume / 100.0
+        labels = {'zone': name}
+        self.plays = METRICS.counter('plays_total', "Scheduled plays started", labels)
+        self.errors = METRICS.counter('playback_errors_total', "Plays that failed to open or run", labels)
+        self.start_skew = METRICS.histogram(
+            'playback_start_skew_seconds', "First sample time minus scheduled time",
+            SKEW_BUCKETS, labels)
+        self.prefetched = {}  # scheduled_time -> {'song', 'source'}
+        self.pending_plays = deque()  # (time_str, volume, playlist, folder) waiting for the current song
+
+    @property
+    def is_main(self):
+        return self.name == MAIN_ZONE
+
+    def slot(self, time_str):
+        """Play history slot of time_str in this zone"""
+        return time_str if self.is_main else f"{self.name}/{time_str}"
+
+    def job_id(self, kind, time_str):
+        """APScheduler job ID, kind is 'play' or 'prefetch'"""
+        return f"{kind}_{self.slot(time_str)}"
+
+    def label(self, text):
+        """Status text, tagged with the zone name outside the main zone"""
+        return text if self.is_main else f"[{self.name}] {text}"
+
+    def to_config(self):
+        return {'name': self.name, 'audio_device': self.device_name,
+                'volume': self.volume, 'scheduled_times': self.scheduled_times}
+
+    def iter_schedules(self):
+        """Yield (time_str, volume, playlist, folder) for every schedule entry"""
+        for schedule in self.scheduled_times:
+            yield (schedule['time'], schedule['volume'], schedule.get('playlist', 1),
+                   schedule.get('folder'))
+
+    def schedule_keys(self):
+        """Job key of each entry: its time, suffixed when another rule shares it"""
+        seen = {}
+        keys = []
+        for schedule in self.scheduled_times:
+            time_str = schedule['time']
+            seen[time_str] = seen.get(time_str, 0) + 1
+            keys.append(time_str if seen[time_str] == 1 else f"{time_str}#{seen[time_str]}")
+        return keys
+
+    def rules(self):
+        """Compiled ScheduleRule of each entry"""
+        return [ScheduleRule.from_entry(schedule) for schedule in self.scheduled_times]
+
+    def upcoming(self):
+        """Next play time of each entry (None if it will not play again)"""
+        engine = self.engine
+        lead = timedelta(seconds=engine.precision_lead if engine.precision_mode else 0)
+        now = datetime.now()
+        result = []
+        for key, schedule in zip(self.schedule_keys(), self.scheduled_times):
+            fire = engine.trigger_index.next_time(self.job_id('play', key))
+            if fire is not None:
+                result.append(fire + lead)
+            else:
+                result.append(ScheduleRule.from_entry(schedule).next_occurrence(now))
+        return result
+
+    def add_schedule(self, hour, minute, volume, second=0, days=EVERY_DAY):
+        """Thêm lịch phát nhạc, trả về False nếu giờ đã có vào những ngày đó
+
+        Raises ValueError for a time that does not exist (e.g. 25:00).
+        """
+        time_str = f"{hour:02d}:{minute:02d}"
+        if second:
+            time_str += f":{second:02d}"
+        days = sorted(set(days))
+        entry = {"time": time_str, "volume": volume}
+        if days != list(EVERY_DAY):
+            entry['days'] = days
+        ScheduleRule.from_entry(entry)  # Checked before it can reach the config
+
+        # Check if time already exists on one of the days
+        time_exists = any(s['time'] == time_str and set(s.get('days', EVERY_DAY)) & set(days)
+                          for s in self.scheduled_times)
+        if time_exists or not days:
+            return False
+
+        self.scheduled_times.append(entry)
+        self.scheduled_times.sort(key=lambda x: x['time'])
+        self.engine.schedules_changed()
+        return True
+
+    def remove_schedule(self, idx):
+        """Xóa lịch thứ idx"""
+        del self.scheduled_times[idx]
+        self.engine.schedules_changed()
+
+    def prefetch_song_job(self, scheduled_time, volume=70, playlist=1, folder=None,
+                          start_offset=0, max_duration=None, fade_out=0):
+        """Chọn bài và decode trước vài giây đầu - chạy trước giờ phát"""
+        today = datetime.now().strftime('%Y-%m-%d')
+        if self.engine.history.played(self.slot(scheduled_time), today):
+            return
+
+        self.discard_prefetched(scheduled_time)
+        song = self.engine.get_random_song(folder)
+        if not song:
+            return
+        try:
+            # The reader thread fills the ring buffer while we wait for the trigger
+            source = self.open_track({'song': song, 'track': 0, 'tracks': max(int(playlist), 1),
+                                      'offset': start_offset, 'budget': max_duration,
+                                      'fade_out': fade_out})
+            self.prefetched[scheduled_time] = {'song': song, 'source': source}
+            if self.engine.preopen_stream:
+                # Opens the device now unless something is already playing
+                self.player.prepare(self.get_device_index(), source.samplerate, source.channels)
+        except Exception as e:
+            print(self.label(f"Lỗi prefetch {scheduled_time}: {e}"))
+
+    def discard_prefetched(self, scheduled_time):
+        """Drop a prefetched song that will not be played"""
+        entry = self.prefetched.pop(scheduled_time, None)
+        if entry:
+            self.discard_prefetched_entry(entry)
+
+    def discard_prefetched_entry(self, entry):
+        """Close the source held by a prefetch entry"""
+        entry['source'].close()
+
+    def play_song_job(self, scheduled_time, volume=70, playlist=1, folder=None,
+                      start_offset=0, max_duration=None, fade_out=0):
+        """Job để phát nhạc - được gọi bởi APScheduler
+
+        playlist > 1 plays that many random songs back to back, gapless or
+        crossfaded by the playback worker; folder overrides the music folder
+        for this slot. The slot may start start_offset seconds into its
+        first song, last at most max_duration seconds and fade out over its
+        last fade_out seconds, see open_track(). In precision mode the job fires
+        precision_lead seconds early and the first sample is placed on the
+        scheduled time by the audio callback.
+        """
+        engine = self.engine
+        scheduled_at = slot_datetime(scheduled_time, datetime.now())
+        today = scheduled_at.strftime('%Y-%m-%d')
+        slot = self.slot(scheduled_time)
+
+        # Kiểm tra xem đã phát trong ngày chưa - claim is atomic and survives restarts
+        if not engine.history.claim(slot, today, scheduled_at.timestamp()):
+            self.discard_prefetched(scheduled_time)
+            return
+
+        prefetched = self.prefetched.pop(scheduled_time, None)
+        if prefetched and prefetched['source'].error is None:
+            song = prefetched['song']
+        else:
+            if prefetched:
+                self.discard_prefetched_entry(prefetched)
+                prefetched = None
+            song = engine.get_random_song(folder)
+
+        if not song:
+            engine.history.release(slot, today)
+            return
+
+        engine.history.update(slot, today, song=str(song))
+        job = {'time': scheduled_time, 'slot': slot, 'today': today, 'scheduled_at': scheduled_at,
+               'song': song, 'track': 0, 'tracks': max(int(playlist), 1), 'folder': folder,
+               'offset': start_offset, 'budget': max_duration, 'fade_out': fade_out}
+
+        start_at = None
+        if engine.precision_mode and scheduled_at.timestamp() > time.time():
+            start_at = scheduled_at.timestamp()
+        # Already decoding since the prefetch job ran
+        self.start_job(job, volume, prefetched['source'] if prefetched else None, start_at)
+
+    def play_overlay_job(self, scheduled_time, volume, path, priority=1):
+        """Phát thông báo / chuông đè lên nhạc đang phát, nhạc được giảm nhỏ
+
+        The clip comes from the engine's jingle bank, already decoded and
+        converted to the device format; volume is relative to the zone's.
+        Its history slot is its own, a song at the same time still plays.
+        """
+        engine = self.engine
+        scheduled_at = slot_datetime(scheduled_time, datetime.now())
+        today = scheduled_at.strftime('%Y-%m-%d')
+        clip = Path(path)
+        slot = self.slot(f"overlay/{scheduled_time}/{clip.name}")
+        if not engine.history.claim(slot, today, scheduled_at.timestamp()):
+            return
+
+        engine.history.update(slot, today, song=str(clip))
+        job = {'time': scheduled_time, 'slot': slot, 'today': today, 'scheduled_at': scheduled_at,
+               'song': clip, 'track': 0, 'tracks': 1, 'folder': None, 'overlay': True}
+        try:
+            device = self.get_device_index()
+            fmt = self.player.output_format(device, *engine.jingles.format(clip))
+            source = engine.jingles.open(clip, *fmt)
+            source.gain = volume / 100.0
+            engine._notify('on_status', self.label(f"🔔 Thông báo: {clip.name}"), 'success')
+            engine._notify('on_playback_state', self, True)
+            self.player.overlay(source, device, job, priority)
+        except Exception as e:
+            self.on_playback_error(job, e)
+
+    def play_song_at(self, song, start_at, volume=70, scheduled_time=None):
+        """Phát song đúng lúc start_at (time.time()) - lệnh từ máy điều phối fleet
+
+        scheduled_time names the history slot (default: the start time), a
+        slot already played today is not played again. Returns False then.
+        """
+        scheduled_at = datetime.fromtimestamp(start_at)
+        scheduled_time = scheduled_time or scheduled_at.strftime('%H:%M:%S')
+        today = scheduled_at.strftime('%Y-%m-%d')
+        slot = self.slot(scheduled_time)
+        if not self.engine.history.claim(slot, today, start_at):
+            return False
+        self.engine.history.update(slot, today, song=str(song))
+        job = {'time': scheduled_time, 'slot': slot, 'today': today, 'scheduled_at': scheduled_at,
+               'song': song, 'track': 0, 'tracks': 1, 'folder': None}
+        self.start_job(job, volume, start_at=start_at)
+        return True
+
+    def start_job(self, job, volume, source=None, start_at=None):
+        """Set the slot volume and hand job's song to the player, on the
+        sample at start_at if given, else as soon as it is ready"""
+        engine = self.engine
+        song = job['song']
+
+        # Set volume for this schedule
+        self.set_volume(volume)
+        engine._notify('on_volume', self, volume)
+        engine._notify('on_status', self.label(f"🎵 Đang phát: {song.name} (Vol: {volume}%)"), 'success')
+
+        try:
+            if source is None:
+                # Open audio file for streaming decode, or from the shared cache
+                source = self.open_track(job)
+            job['length'] = source.frames / source.samplerate
+
+            if start_at is not None:
+                # Open the stream now, then give the worker the exact start shortly before
+                self.player.prepare(self.get_device_index(), source.samplerate, source.channels)
+                wait_until(start_at - PRECISION_HANDOFF_SECONDS)
+
+            engine._notify('on_playback_state', self, True)
+
+            # Hand off to the playback worker, it reports back when done
+            self.player.play(source, self.get_device_index(), job, start_at)
+
+        except Exception as e:
+            self.on_playback_error(job, e)
+
+    def open_track(self, job):
+        """Open job's song cut to its slot.
+
+        Only the needed frames are decoded: the first track starts
+        job['offset'] seconds in and each track stops when the slot's
+        job['budget'] (what is left of max_duration) runs out. The track
+        that ends the slot fades out over job['fade_out'] seconds.
+        """
+        budget = job.get('budget')
+        source = self.engine.open_source(job['song'], job.get('offset', 0), budget)
+        cut = budget is not None and (source.frames + 1) / source.samplerate >= budget
+        if job.get('fade_out') and (cut or job['track'] + 1 >= job['tracks']):
+            source = FadeOutSource(source, job['fade_out'])
+        return source
+
+    def get_device_index(self):
+        """Index of the selected output device (None = default)"""
+        return self.engine.devices.index(self.device_name)
+
+    def set_device(self, name):
+        """Chọn thiết bị output - bài đang phát chuyển sang thiết bị mới"""
+        self.device_name = name
+        self.player.switch_device(self.get_device_index())
+        self.engine.save_config()
+
+    def set_volume(self, percent):
+        """Set the live playback volume (0-100)"""
+        self.volume = percent
+        self.player.volume = percent / 100.0
+
+    def toggle_pause(self):
+        """Pause/Resume playback, return the new paused state (None if idle)"""
+        if not self.player.active:
+            return None
+        self.player.paused = not self.player.paused
+        return self.player.paused
+
+    def stop_song(self):
+        """Stop current song"""
+        self.player.stop()
+
+    def on_playback_started(self, job, first_sample_at):
+        """Called by the playback worker when a track's first sample is out"""
+        if not job:
+            return
+        if not job.get('overlay'):
+            self.engine.shuffle.mark_played(job['song'])
+        if job['track'] == 0:
+            self.engine.history.update(job['slot'], job['today'], started_at=first_sample_at)
+            self.plays.inc()
+            self.start_skew.observe(
+                self.engine.record_start_skew(job['slot'], job['scheduled_at'], first_sample_at))
+            self.engine._notify('on_play_started', self, job['slot'], first_sample_at)
+        else:
+            self.engine._notify('on_status', self.label(
+                f"🎵 Đang phát: {job['song'].name} ({job['track'] + 1}/{job['tracks']})"), 'success')
+
+        # Queue the next playlist song while this one plays; picking and
+        # opening it must not hold up the playback worker calling us
+        if job['track'] + 1 < job['tracks']:
+            threading.Thread(target=self.enqueue_next_track, args=(job, self.player.generation),
+                             daemon=True).start()
+
+    def enqueue_next_track(self, job, generation=None):
+        """Pick and queue the song after job's track in its playlist"""
+        budget = job.get('budget')
+        if budget is not None:
+            budget -= job['length']
+            if budget <= 0:
+                return  # max_duration reached, the slot ends with this track
+        song = self.engine.get_random_song(job['folder'])
+        if not song:
+            return
+        try:
+            next_job = dict(job, song=song, track=job['track'] + 1, offset=0, budget=budget)
+            source = self.open_track(next_job)
+            next_job['length'] = source.frames / source.samplerate
+            self.player.enqueue(source, next_job, generation)
+        except Exception as e:
+            print(self.label(f"Lỗi mở bài tiếp theo {song}: {e}"))
+
+    def on_playback_finished(self, job):
+        """Called by the playback worker when a song ends or is stopped"""
+        # Mark as played
+        if job:
+            self.engine.history.update(job['slot'], job['today'], status='played')
+
+        # The next playlist song is already queued, nothing to report yet
+        if self.player.active:
+            return
+
+        self.engine._notify('on_playback_state', self, False)
+        if self.engine.is_running:
+            self.engine._notify('on_status', self.label("✅ Đã phát xong - Chờ lịch tiếp theo"), 'primary')
+            # Catch-up plays queued by the 'late' policy follow each other, on a
+            # scheduler worker so the playback thread never picks or opens songs
+            if self.pending_plays:
+                self.engine.scheduler.add_job(self.play_song_job, args=self.pending_plays.popleft(),
+                                              misfire_grace_time=None)
+
+    def on_playback_error(self, job, e):
+        """Called when opening or running the stream fails"""
+        print(self.label(f"Lỗi phát nhạc: {e}"))
+        self.errors.inc()
+        if job:
+            self.engine.history.update(job['slot'], job['today'], status='failed')
+        self.engine._notify('on_playback_state', self, False)
+        self.engine._notify('on_status', self.label(f"❌ Lỗi phát nhạc: {str(e)[:30]}..."), 'danger')
+
+    def on_device_lost(self, device, fallback):
+        """The player moved to fallback because device failed"""
+        devices = self.engine.devices
+        self.engine._notify('on_status', self.label(
+            f"⚠️ Mất {devices.name(device)}, phát tiếp trên {devices.name(fallback)}"), 'warning')
+        devices.request_rescan()
+
+    def desired_jobs(self, grace):
+        """Job specs for this zone's schedules: {job_id: (func, args, rule, lead, grace)}
+
+        The job fires lead seconds before each occurrence of rule and is
+        dropped if it runs more than grace seconds late.
+        """
+        jobs = {}
+        engine = self.engine
+        lead = engine.precision_lead if engine.precision_mode else 0
+        for key, schedule in zip(self.schedule_keys(), self.scheduled_times):
+            rule = ScheduleRule.from_entry(schedule)
+            if schedule.get('overlay'):
+                # Preloaded clip, nothing to prefetch
+                args = (schedule['time'], schedule['volume'], schedule['overlay'],
+                        schedule.get('priority', 1))
+                jobs[self.job_id('play', key)] = (self.play_overlay_job, args, rule, 0,
+                                                  OVERLAY_GRACE_SECONDS)
+                continue
+            args = song_args(schedule)
+            jobs[self.job_id('play', key)] = (self.play_song_job, args, rule, lead, grace)
+
+            # Prefetch job fires prefetch_lead seconds before the play job
+            jobs[self.job_id('prefetch', key)] = (
+                self.prefetch_song_job, args, rule, engine.prefetch_lead + lead, engine.prefetch_lead)
+        return jobs
+
+    def discard_stale_prefetches(self, desired):
+        """Drop songs prefetched for slots that no longer exist"""
+        for time_str in list(self.prefetched):
+            if self.job_id('play', time_str) not in desired:
+                self.discard_prefetched(time_str)
+
+    def catch_up_missed(self, policy, grace):
+        """Apply the catch-up policy to today's slots missed while stopped"""
+        history = self.engine.history
+        now = datetime.now()
+        today = now.strftime('%Y-%m-%d')
+        missed = []
+        for schedule in self.scheduled_times:
+            time_str, *args = song_args(schedule)
+            hour, minute, second = parse_time(time_str)
+            at = now.replace(hour=hour, minute=minute, second=second, microsecond=0)
+            late = (now - at).total_seconds()
+            # A late announcement is worse than none
+            if (0 < late <= grace and not schedule.get('overlay')
+                    and ScheduleRule.from_entry(schedule).occurs_on(now.date())
+                    and not history.played(self.slot(time_str), today)):
+                missed.append((time_str, *args))
+        if not missed:
+            return
+
+        print(self.label(f"Lỡ {len(missed)} lịch khi tắt máy, chính sách: {policy}"))
+        if policy == CATCH_UP_LATE:
+            self.pending_plays.extend(missed[1:])
+            self.play_song_job(*missed[0])
+            return
+
+        # skip records every missed slot, coalesce keeps only the latest one
+        to_skip = missed if policy == CATCH_UP_SKIP else missed[:-1]
+        for time_str, *_ in to_skip:
+            history.claim(self.slot(time_str), today, status='skipped')
+        if policy == CATCH_UP_COALESCE:
+            self.play_song_job(*missed[-1])
+
+    def stop(self):
+        """Stop playback and forget queued catch-up plays"""
+        self.pending_plays.clear()
+        self.player.stop()
+
+    def shutdown(self):
+        self.player.shutdown()
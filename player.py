@@ -0,0 +1,499 @@
+"""
+Playback worker - một thread duy nhất quản lý output stream
+The stream stays open between songs at the device's native format; tracks
+in other formats are converted on their own thread, and a TrackMixer plays
+them gapless or with a crossfade and reports track start/end events;
+an OverlayMixer on top plays announcements over them, ducking the music.
+Switching device opens the new stream before the old one closes, and a
+stream whose device disappears is replaced by one on a fallback device.
+"""
+
+import contextlib
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+
+import sounddevice as sd
+
+from audio_stream import AudioRenderer, DeviceHandoff, OverlayMixer, TrackMixer
+from metrics import CALLBACK_BUCKETS, METRICS
+from resample import ConvertingSource
+
+MAX_OUTPUT_CHANNELS = 2  # Songs are stereo at most, more device channels stay silent
+HANDOFF_FADE_SECONDS = 0.05  # Crossfade between the old and the new device
+HANDOFF_TIMEOUT_SECONDS = 1.0  # The old stream is closed this long after a switch
+DEVICE_STALL_SECONDS = 2.0  # No callback for this long means the device is gone
+RELEASE_IDLE_SECONDS = 60  # release() keeps a stream that played more recently
+
+
+def device_format(device):
+    """(samplerate, channels) the output device runs at natively"""
+    info = sd.query_devices(device, 'output')
+    channels = min(max(int(info['max_output_channels']), 1), MAX_OUTPUT_CHANNELS)
+    return int(info['default_samplerate']), channels
+
+
+class PlaybackWorker:
+    """Long-lived thread that owns the persistent output stream.
+
+    Callers post commands (play, enqueue, overlay, stop, switch device);
+    the mixers post 'started' and 'ended' events for each track back into
+    the same queue, so every state change is handled in order on one thread.
+
+    With native_format (the default) every track is converted to the
+    device's own rate and channel layout, so the stream is opened once per
+    device; otherwise it is reopened when the sample format changes.
+
+    ``job`` is an opaque value handed back to the callbacks:
+    on_started(job, first_sample_at), on_finished(job) and on_error(job, exc).
+
+    With a DeviceRegistry as ``devices``, a stream that cannot be opened or
+    that dies under playing tracks moves to devices.fallback() and
+    on_device_lost(device, fallback) is called.
+    """
+
+    def __init__(self, on_started=None, on_finished=None, on_error=None, crossfade=0.0, name='main',
+                 native_format=True, latency='low', devices=None, on_device_lost=None, duck_gain=0.25):
+        self.on_started = on_started
+        self.on_finished = on_finished
+        self.on_error = on_error
+        self.on_device_lost = on_device_lost
+        self.devices = devices
+        self.volume = 0.7
+        self.paused = False
+        self.crossfade = crossfade  # Seconds, applied when the stream is (re)opened
+        self.native_format = native_format
+        self.latency = latency  # Passed to PortAudio, 'low' or 'high' or seconds
+        self._device_formats = {}  # device -> native (samplerate, channels)
+        self._formats_generation = devices.generation if devices else 0
+        self.stream = None
+        self.mixer = None
+        self.overlays = None  # OverlayMixer over self.mixer
+        self.duck_gain = duck_gain
+        self.device = None
+        self.format = None  # (samplerate, channels) of the open stream
+        self._jobs = {}  # source -> job, for every track handed to the mixer
+        self._deferred = deque()  # Queued tracks that need a different format
+        self._block_time = 0.0  # Wall-clock DAC time of the block being rendered
+        self._last_callback = 0.0  # perf_counter() of the current stream's last callback
+        self._active_at = 0.0  # monotonic() of the last stream open or track end
+        self._retiring = {}  # token -> old stream fading out after a device switch
+        self._tokens = itertools.count(1)  # Tags streams, events of closed ones are ignored
+        self._commands = queue.Queue()
+        self.generation = 0  # Bumped by every play and stop, only touched by the worker
+
+        # Written only by the audio callback, so no locks on the hot path
+        labels = {'zone': name}
+        self._callback_time = METRICS.histogram(
+            'audio_callback_seconds', "Time spent rendering one audio block",
+            CALLBACK_BUCKETS, labels, locked=False)
+        self._underflows = METRICS.counter(
+            'audio_output_underflows_total', "Blocks the device played before they were ready",
+            labels, locked=False)
+        self._overflows = METRICS.counter(
+            'audio_output_overflows_total', "Output overflows reported by PortAudio",
+            labels, locked=False)
+        self._mix_times = tuple(METRICS.histogram(
+            'audio_mix_source_seconds', "Time spent on one source in one audio block",
+            CALLBACK_BUCKETS, dict(labels, source=kind), locked=False) for kind in ('bed', 'overlay'))
+        self._stream_open_time = METRICS.histogram(
+            'audio_stream_open_seconds', "Time to open and start an output stream", labels=labels)
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def duck_gain(self):
+        """Music gain under an overlay, the open stream follows changes"""
+        return self._duck_gain
+
+    @duck_gain.setter
+    def duck_gain(self, value):
+        self._duck_gain = value
+        if self.overlays is not None:
+            self.overlays.duck_gain = value
+
+    @property
+    def active(self):
+        """True while any track is playing or queued, including when paused"""
+        return bool(self._jobs)
+
+    @property
+    def source(self):
+        """Track currently playing (None when idle)"""
+        return self.mixer.current if self.mixer else None
+
+    @property
+    def position(self):
+        """Frames of the current track already rendered"""
+        source = self.source
+        return source.position if source else 0
+
+    def play(self, source, device=None, job=None, start_at=None):
+        """Play source now, or at wall-clock start_at, ending whatever is playing or queued"""
+        self._commands.put(('play', (self._convert(source, device), device, job, start_at)))
+
+    def overlay(self, source, device=None, job=None, priority=1):
+        """Play source over the current track, ducking everything of lower priority"""
+        self._commands.put(('overlay', (self._convert(source, device), device, job, priority)))
+
+    def enqueue(self, source, job=None, generation=None):
+        """Play source after the current track, gapless or crossfaded.
+
+        With generation (read from the worker thread, e.g. in on_started)
+        the track is dropped if play() or stop() ran since, so a song
+        prepared on another thread cannot restart a stopped playlist.
+        """
+        self._commands.put(('queue', (self._convert(source, self.device), job, generation)))
+
+    def prepare(self, device, samplerate, channels):
+        """Open the stream ahead of time if nothing is playing"""
+        self._commands.put(('prepare', (device, self.output_format(device, samplerate, channels))))
+
+    def output_format(self, device, samplerate, channels):
+        """Stream format used for a track in (samplerate, channels) on device"""
+        if not self.native_format:
+            return samplerate, channels
+        # Not while a device rescan restarts PortAudio
+        with self.devices.lock if self.devices else contextlib.nullcontext():
+            if self.devices and self.devices.generation != self._formats_generation:
+                # PortAudio restarted, indices may now mean other devices
+                self._device_formats.clear()
+                self._formats_generation = self.devices.generation
+            if device not in self._device_formats:
+                try:
+                    self._device_formats[device] = device_format(device)
+                except Exception as e:
+                    print(f"Không đọc được định dạng thiết bị {device}: {e}")
+                    return samplerate, channels
+            return self._device_formats[device]
+
+    def _convert(self, source, device):
+        """source itself if it already matches the stream format, else a converter"""
+        fmt = self.output_format(device, source.samplerate, source.channels)
+        if fmt == (source.samplerate, source.channels):
+            return source
+        return ConvertingSource(source, *fmt)
+
+    def stop(self):
+        """Stop playback now"""
+        self._commands.put(('stop', ()))
+
+    def switch_device(self, device):
+        """Continue the current tracks on another output device"""
+        self._commands.put(('device', (device,)))
+
+    def release(self, idle_for=RELEASE_IDLE_SECONDS):
+        """Close the stream if nothing played for idle_for seconds, so that
+        PortAudio can restart; True if no stream is left open"""
+        done = queue.Queue()
+        self._commands.put(('release', (idle_for, done)))
+        try:
+            return done.get(timeout=2)
+        except queue.Empty:
+            return False
+
+    def shutdown(self):
+        """Stop playback, close the stream and end the worker thread"""
+        self._commands.put(('shutdown', ()))
+        self._thread.join(timeout=2)
+
+    def _open_stream(self, device, fmt, mixer=None, handoff=None):
+        """Open and start a stream for fmt, keeping mixer if given.
+
+        With a handoff the stream waits for the old one to let go of the
+        mixer and fades in; the old stream stays current until this one runs.
+        """
+        samplerate, channels = fmt
+        token = next(self._tokens)
+        if mixer is None:
+            def notify(event, source, offset):
+                self._commands.put((event, (source, self._block_time + offset / samplerate)))
+
+            mixer = TrackMixer(channels, int(self.crossfade * samplerate), notify=notify,
+                               samplerate=samplerate)
+            overlays = OverlayMixer(mixer, channels, samplerate, self.duck_gain, notify=notify,
+                                    timers=self._mix_times)
+        else:
+            overlays = self.overlays  # Moves to the new stream with its bed
+        renderer = AudioRenderer(overlays, gain=self.volume)
+
+        callback_time, underflows, overflows = self._callback_time, self._underflows, self._overflows
+        perf_counter = time.perf_counter
+
+        # Callback function for real-time audio, must not allocate
+        def audio_callback(outdata, frames, time_info, status):
+            started = perf_counter()
+            if status:
+                if status.output_underflow:
+                    underflows.inc()
+                if status.output_overflow:
+                    overflows.inc()
+
+            retiring = stream.handoff
+            if retiring is not None:
+                # Replaced by a stream on another device, fade out what it plays
+                retiring.released = True
+                retiring.fade_out(outdata)
+                return
+            self._last_callback = started
+
+            if self.paused:
+                outdata.fill(0)  # Output silence when paused
+                return
+            if handoff is not None and not handoff.released:
+                outdata.fill(0)  # The old stream still reads the mixer
+                return
+
+            # Wall-clock time this block reaches the DAC, used by track events
+            ahead = time_info.outputBufferDacTime - time_info.currentTime
+            if ahead <= 0:  # Host API without DAC timestamps
+                ahead = stream.latency
+            self._block_time = mixer.block_time = time.time() + ahead
+
+            # Mix the tracks and apply volume in place
+            renderer.render(outdata, self.volume)
+            if handoff is not None:
+                handoff.fade_in(outdata)
+            callback_time.observe(perf_counter() - started)
+
+        def finished_callback():
+            self._commands.put(('stream_finished', (token,)))
+
+        opened = time.perf_counter()
+        # A device rescan must not restart PortAudio under this stream
+        with self.devices.lock if self.devices else contextlib.nullcontext():
+            stream = sd.OutputStream(
+                samplerate=samplerate,
+                channels=channels,
+                dtype='float32',
+                callback=audio_callback,
+                finished_callback=finished_callback,
+                device=device,
+                latency=self.latency
+            )
+            stream.token = token
+            stream.handoff = None  # Set when another stream takes over the mixer
+            try:
+                stream.start()
+            except Exception:
+                stream.close()
+                raise
+        self._stream_open_time.observe(time.perf_counter() - opened)
+        self._last_callback = time.perf_counter()
+        self._active_at = time.monotonic()
+        self.stream, self.mixer, self.overlays = stream, mixer, overlays
+        self.device, self.format = device, fmt
+
+    def _open_or_fallback(self, device, fmt, mixer=None, handoff=None):
+        """_open_stream on device, or on the fallback device if that fails"""
+        try:
+            self._open_stream(device, fmt, mixer, handoff)
+        except Exception as e:
+            fallback = self.devices.fallback(exclude=device) if self.devices else None
+            if fallback is None or fallback == device:
+                raise
+            print(f"⚠️ Không mở được thiết bị {device}: {e}, chuyển sang {fallback}")
+            self._open_stream(fallback, fmt, mixer, handoff)
+            if self.on_device_lost:
+                self.on_device_lost(device, fallback)
+
+    def _close_stream(self):
+        """Close the stream; its finished event becomes stale"""
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            self._discard(stream)
+
+    @staticmethod
+    def _discard(stream):
+        """Abort and close a stream whose device may already be gone"""
+        try:
+            stream.abort()
+            stream.close()
+        except Exception as e:
+            print(f"Lỗi đóng stream: {e}")
+
+    def _finish(self, source):
+        """Close a track and report its job finished, or failed if decoding
+        or converting it stopped on an error"""
+        self._active_at = time.monotonic()
+        source.close()
+        if source in self._jobs:
+            job = self._jobs.pop(source)
+            if source.error is not None and self.on_error:
+                self.on_error(job, source.error)
+            elif self.on_finished:
+                self.on_finished(job)
+
+    def _finish_deferred(self):
+        while self._deferred:
+            self._finish(self._deferred.popleft())
+
+    def _finish_all(self):
+        """Finish every track, e.g. when the mixer is thrown away"""
+        self._deferred.clear()
+        for source in list(self._jobs):
+            self._finish(source)
+
+    def _run(self):
+        while True:
+            try:
+                command, args = self._commands.get(timeout=DEVICE_STALL_SECONDS / 2)
+            except queue.Empty:
+                self._check_stall()
+                continue
+            try:
+                if command == 'shutdown':
+                    self._close_stream()
+                    for token in list(self._retiring):
+                        self._on_handoff_done(token)
+                    self._finish_all()
+                    return
+                getattr(self, f'_on_{command}')(*args)
+            except Exception as e:
+                print(f"Lỗi playback worker ({command}): {e}")
+                job = None
+                if command in ('play', 'queue', 'overlay'):
+                    source = args[0]
+                    job = self._jobs.pop(source, None)
+                    source.close()
+                if self.on_error:
+                    self.on_error(job, e)
+
+    def _on_play(self, source, device, job, start_at=None):
+        self.paused = False
+        self.generation += 1
+        fmt = (source.samplerate, source.channels)
+        source.wait_ready()
+        if self.stream is None or device != self.device or fmt != self.format:
+            self._close_stream()
+            self._finish_all()
+            self._jobs[source] = job
+            self._open_or_fallback(device, fmt)
+        else:
+            # The mixer reports the replaced tracks as ended itself
+            self._finish_deferred()
+            self._jobs[source] = job
+        self.mixer.play(source, start_at)
+
+    def _on_queue(self, source, job, generation=None):
+        if generation is not None and generation != self.generation:
+            source.close()  # Its playlist was stopped or replaced meanwhile
+            return
+        if self.stream is None or not self._jobs:
+            self._on_play(source, self.device, job)
+            return
+        self._jobs[source] = job
+        if (source.samplerate, source.channels) == self.format and not self._deferred:
+            self.mixer.enqueue(source)
+        else:
+            # Different format: played after the current tracks on a reopened stream
+            self._deferred.append(source)
+
+    def _on_overlay(self, source, device, job, priority):
+        self.paused = False
+        source.wait_ready()
+        if self.stream is None:
+            self._open_or_fallback(device, (source.samplerate, source.channels))
+        elif (source.samplerate, source.channels) != self.format:
+            source = ConvertingSource(source, *self.format)
+            source.wait_ready()
+        self._jobs[source] = job
+        self.overlays.add(source, priority)
+
+    def _on_prepare(self, device, fmt):
+        if not self._jobs and (self.stream is None or device != self.device or fmt != self.format):
+            self._close_stream()
+            self._open_or_fallback(device, fmt)
+
+    def _on_release(self, idle_for, done):
+        if (self.stream is not None and not self._jobs and not self._retiring
+                and time.monotonic() - self._active_at >= idle_for):
+            self._close_stream()
+        done.put(self.stream is None and not self._retiring)
+
+    def _on_stop(self):
+        self.paused = False
+        self.generation += 1
+        self._finish_deferred()
+        if self.stream is not None:
+            self.mixer.clear()
+            self.overlays.clear()
+        else:
+            self._finish_all()
+
+    def _on_device(self, device):
+        if device == self.device:
+            return
+        if self.stream is None:
+            self.device = device
+            return
+        # Same mixer on a new stream, every track keeps its position; the
+        # old stream plays until the new one runs, then fades out
+        old, fmt = self.stream, self.format
+        handoff = DeviceHandoff(fmt[1], int(HANDOFF_FADE_SECONDS * fmt[0]))
+        self._open_stream(device, fmt, self.mixer, handoff)
+        old.handoff = handoff
+        self._retiring[old.token] = old
+        threading.Timer(HANDOFF_TIMEOUT_SECONDS, self._commands.put,
+                        args=(('handoff_done', (old.token, handoff)),)).start()
+
+    def _on_handoff_done(self, token, handoff=None):
+        if handoff is not None:
+            handoff.released = True  # In case the old device stopped calling back
+        stream = self._retiring.pop(token, None)
+        if stream is not None:
+            self._discard(stream)
+
+    def _check_stall(self):
+        """Treat a stream without callbacks as a lost device"""
+        if (self.stream is not None
+                and time.perf_counter() - self._last_callback > DEVICE_STALL_SECONDS):
+            try:
+                self._on_device_failed()
+            except Exception as e:
+                print(f"Lỗi playback worker (failover): {e}")
+
+    def _on_device_failed(self):
+        """The stream died: continue its tracks on the fallback device"""
+        dead, device, fmt = self.stream, self.device, self.format
+        self.stream = None
+        self._discard(dead)
+        fallback = self.devices.fallback(exclude=device) if self.devices else None
+        if not self._jobs or fallback is None or fallback == device:
+            self._finish_all()
+            return
+        print(f"⚠️ Mất thiết bị {device}, chuyển sang {fallback}")
+        # The dead stream no longer reads the mixer, the new one fades in at once
+        try:
+            self._open_stream(fallback, fmt, self.mixer, DeviceHandoff(
+                fmt[1], int(HANDOFF_FADE_SECONDS * fmt[0]), released=True))
+        except Exception:
+            self._finish_all()
+            raise
+        if self.on_device_lost:
+            self.on_device_lost(device, fallback)
+
+    def _on_started(self, source, first_sample_at):
+        if source in self._jobs and self.on_started:
+            self.on_started(self._jobs[source], first_sample_at)
+
+    def _on_ended(self, source, ended_at):
+        self._finish(source)
+        if self._deferred and self.mixer.idle and self.overlays.idle:
+            # Reopen for the next format, then queue what else fits it
+            deferred = self._deferred.popleft()
+            deferred.wait_ready()
+            self._close_stream()
+            self._open_or_fallback(self.device, (deferred.samplerate, deferred.channels))
+            self.mixer.play(deferred)
+            while self._deferred and (self._deferred[0].samplerate,
+                                      self._deferred[0].channels) == self.format:
+                self.mixer.enqueue(self._deferred.popleft())
+
+    def _on_stream_finished(self, token):
+        # A persistent stream only stops on its own when the device fails
+        if self.stream is not None and self.stream.token == token:
+            self._on_device_failed()
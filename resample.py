@@ -0,0 +1,210 @@
+"""
+Chuyển đổi sample rate và số kênh sang định dạng gốc của thiết bị
+The stream stays at the device's native format for its whole life; each
+track is converted on its own thread, block by block, with a polyphase
+windowed-sinc resampler in numpy, so nothing extra runs in the callback.
+"""
+
+import math
+import threading
+import time
+
+import numpy as np
+
+from audio_stream import RingBuffer
+
+RESAMPLE_TAPS = 32  # Filter length in input samples, even
+MAX_PHASES = 1024  # Odd rate ratios are rounded to this many filter phases
+KAISER_BETA = 8.0
+
+
+def channel_matrix(src, dst):
+    """(src, dst) mixing matrix: mono feeds both front channels, a mono
+    device gets the average, other layouts map channel to channel"""
+    matrix = np.zeros((src, dst), dtype='float32')
+    if src == 1:
+        matrix[0, :min(dst, 2)] = 1.0
+    elif dst == 1:
+        matrix[:, 0] = 1.0 / src
+    else:
+        for i in range(min(src, dst)):
+            matrix[i, i] = 1.0
+    return matrix
+
+
+class StreamResampler:
+    """Resample a stream of (frames, channels) chunks from src_rate to dst_rate.
+
+    The ratio is kept as exact integers (44100 -> 48000 is 160/147), so
+    chunk boundaries never drift. Each output sample is a dot product of
+    RESAMPLE_TAPS input samples with one phase of a Kaiser-windowed sinc,
+    gathered for the whole chunk at once.
+    """
+
+    def __init__(self, src_rate, dst_rate, channels, taps=RESAMPLE_TAPS):
+        g = math.gcd(src_rate, dst_rate)
+        self.up, self.down = dst_rate // g, src_rate // g
+        self.channels = channels
+        self.taps = taps
+        self.phases = min(self.up, MAX_PHASES)
+        half = taps // 2
+        self._offsets = np.arange(taps) - (half - 1)  # Input taps around the output time
+
+        # Low-pass at the lower Nyquist, widened by the rate ratio when downsampling
+        cutoff = min(1.0, self.up / self.down) * 0.97
+        x = self._offsets[None, :] - (np.arange(self.phases) / self.phases)[:, None]
+        window = np.i0(KAISER_BETA * np.sqrt(np.clip(1 - (x / half) ** 2, 0, None))) / np.i0(KAISER_BETA)
+        bank = cutoff * np.sinc(cutoff * x) * window
+        self._bank = (bank / bank.sum(axis=1, keepdims=True)).astype('float32')
+
+        # History so the first output sample lines up with the first input sample
+        self._hist = np.zeros((half - 1, channels), dtype='float32')
+        self._pos = (half - 1) * self.up  # Next output time in 1/up input samples
+
+    def process(self, chunk):
+        """Resample one chunk, return the output frames it completes"""
+        buf = np.concatenate((self._hist, chunk)) if len(self._hist) else chunk
+        end = (len(buf) - self.taps // 2) * self.up  # Output times before this have a full window
+        if end <= self._pos:
+            self._hist = buf
+            return np.zeros((0, self.channels), dtype='float32')
+
+        times = np.arange(self._pos, end, self.down, dtype=np.int64)
+        index = times // self.up
+        phase = (times % self.up) * self.phases // self.up
+        frames = buf[index[:, None] + self._offsets[None, :]]  # (out, taps, channels)
+        out = np.einsum('kt,ktc->kc', self._bank[phase], frames, dtype='float32')
+
+        # Keep the input the next output still needs
+        next_pos = int(times[-1]) + self.down
+        start = next_pos // self.up + self._offsets[0]
+        self._hist = buf[start:].copy()
+        self._pos = next_pos - start * self.up
+        return out
+
+    def flush(self):
+        """Output what is left once the input has ended"""
+        return self.process(np.zeros((self.taps // 2, self.channels), dtype='float32'))
+
+
+def convert_pcm(pcm, src_rate, samplerate, channels):
+    """Whole (frames, channels) array converted at once, for short clips"""
+    if pcm.shape[1] != channels:
+        pcm = pcm @ channel_matrix(pcm.shape[1], channels)
+    if src_rate != samplerate:
+        resampler = StreamResampler(src_rate, samplerate, channels)
+        pcm = np.concatenate((resampler.process(pcm), resampler.flush()))
+    return np.ascontiguousarray(pcm, dtype='float32')
+
+
+class ConvertingSource:
+    """Source adapter that converts another source to (samplerate, channels).
+
+    A reader thread pulls blocks from the inner source, maps the channels
+    and resamples them into a ring buffer; read_into() never blocks, like
+    the other sources.
+    """
+
+    def __init__(self, inner, samplerate, channels, buffer_seconds=2.0, block_frames=4096):
+        self.inner = inner
+        self.path = getattr(inner, 'path', None)
+        self.samplerate = samplerate
+        self.channels = channels
+        self.frames = round(inner.frames * samplerate / inner.samplerate)
+        self.block_frames = block_frames
+        self.position = 0
+        self._error = None
+
+        # Map channels on the side with fewer of them, less to resample
+        self._matrix = channel_matrix(inner.channels, channels) if inner.channels != channels else None
+        work_channels = min(inner.channels, channels)
+        self._resampler = (StreamResampler(inner.samplerate, samplerate, work_channels)
+                           if inner.samplerate != samplerate else None)
+
+        self._max_out = block_frames * samplerate // inner.samplerate + RESAMPLE_TAPS + 1
+        capacity = max(int(samplerate * buffer_seconds), self._max_out * 2)
+        self._ring = RingBuffer(capacity, channels)
+        self._eof = False
+        self._stop = threading.Event()
+        self._reader = threading.Thread(target=self._fill, daemon=True)
+        self._reader.start()
+
+    @property
+    def gain(self):
+        return self.inner.gain
+
+    @gain.setter
+    def gain(self, value):
+        self.inner.gain = value
+
+    @property
+    def error(self):
+        """A failed conversion, else the inner source's error"""
+        return self._error or self.inner.error
+
+    def _convert(self, block):
+        """Map and resample one block; None flushes the resampler"""
+        matrix = self._matrix
+        downmix = matrix is not None and matrix.shape[0] > matrix.shape[1]
+        if block is not None and downmix:
+            block = block @ matrix
+        if self._resampler is not None:
+            block = self._resampler.process(block) if block is not None else self._resampler.flush()
+        if matrix is not None and not downmix:
+            block = block @ matrix
+        return block
+
+    def _fill(self):
+        inner = self.inner
+        block = np.empty((self.block_frames, inner.channels), dtype='float32')
+        idle = self.block_frames / inner.samplerate / 4
+        try:
+            while True:
+                if self._stop.is_set():
+                    return
+                if self._ring.space() < self._max_out:
+                    time.sleep(idle)
+                    continue
+                n = inner.read_into(block)
+                if n == 0:
+                    if inner.finished:
+                        break
+                    inner.wait_ready(timeout=idle)
+                    continue
+                self._ring.write(self._convert(block[:n]))
+            if self._resampler is not None:
+                # The ring had room for _max_out frames, the tail is shorter
+                self._ring.write(self._convert(None))
+        except Exception as e:
+            self._error = e
+            print(f"Lỗi chuyển đổi {self.path}: {e}")
+        finally:
+            self._eof = True
+
+    def wait_ready(self, frames=None, timeout=2.0):
+        """Block until ``frames`` are converted (default one block) or EOF"""
+        frames = frames or self.block_frames
+        deadline = time.monotonic() + timeout
+        while self._ring.available() < frames and not self._eof:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def read_into(self, out):
+        frames = self._ring.read_into(out)
+        self.position += frames
+        return frames
+
+    @property
+    def finished(self):
+        return self._eof and self._ring.available() == 0
+
+    @property
+    def remaining(self):
+        return max(self.frames - self.position, 0)
+
+    def close(self):
+        """Stop converting and close the inner source"""
+        self._stop.set()
+        self.inner.close()
@@ -0,0 +1,192 @@
+"""
+Quy tắc lịch phát - thứ trong tuần, khoảng ngày, ngày nghỉ
+Every schedule entry compiles to a ScheduleRule; a TriggerIndex keeps the
+next fire time of every rule in one heap, so a wakeup costs O(log n) however
+many rules there are and APScheduler only ever holds one date job.
+"""
+
+import heapq
+import itertools
+from datetime import date, datetime, time, timedelta
+
+WEEKDAY_NAMES = ('T2', 'T3', 'T4', 'T5', 'T6', 'T7', 'CN')
+EVERY_DAY = tuple(range(7))  # Weekday numbers, 0 = Monday
+
+
+def parse_time(time_str):
+    """(hour, minute, second) of an "HH:MM" or "HH:MM:SS" slot"""
+    hour, minute, second = (list(map(int, time_str.split(':'))) + [0])[:3]
+    return hour, minute, second
+
+
+def parse_date(text):
+    """date of a "YYYY-MM-DD" string, None for an empty value"""
+    return date.fromisoformat(text) if text else None
+
+
+def describe_days(days):
+    """Short label like "T2-T6" or "T2,T4", '' for every day"""
+    days = sorted(set(days))
+    if days == list(EVERY_DAY):
+        return ''
+    if len(days) > 2 and days[-1] - days[0] == len(days) - 1:
+        return f"{WEEKDAY_NAMES[days[0]]}-{WEEKDAY_NAMES[days[-1]]}"
+    return ','.join(WEEKDAY_NAMES[d] for d in days)
+
+
+def valid_entries(entries):
+    """Schedule entries that compile to a rule; bad ones are logged and left out"""
+    valid = []
+    for entry in entries:
+        try:
+            ScheduleRule.from_entry(entry)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            print(f"Bỏ qua lịch không hợp lệ {entry!r}: {e}")
+            continue
+        valid.append(entry)
+    return valid
+
+
+class ScheduleRule:
+    """Time of day plus the days it applies to.
+
+    Schedule entries may carry ``days`` (weekday numbers), ``start_date`` and
+    ``end_date`` (inclusive, YYYY-MM-DD) and ``exclude`` (dates without a
+    play); an entry with none of them fires every day.
+    """
+
+    def __init__(self, at, days=EVERY_DAY, start=None, end=None, exclude=()):
+        self.at = at
+        self.days = frozenset(days)
+        self.start = start
+        self.end = end
+        self.exclude = frozenset(exclude)
+
+    @classmethod
+    def from_entry(cls, entry):
+        return cls(time(*parse_time(entry['time'])),
+                   entry.get('days', EVERY_DAY),
+                   parse_date(entry.get('start_date')),
+                   parse_date(entry.get('end_date')),
+                   map(parse_date, entry.get('exclude', ())))
+
+    def _key(self):
+        return self.at, self.days, self.start, self.end, self.exclude
+
+    def __eq__(self, other):
+        return isinstance(other, ScheduleRule) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def occurs_on(self, day):
+        """True if the rule plays on date day"""
+        return (day.weekday() in self.days and day not in self.exclude
+                and (self.start is None or day >= self.start)
+                and (self.end is None or day <= self.end))
+
+    def next_occurrence(self, after):
+        """First datetime strictly after `after` when the rule plays, None if never again"""
+        if not self.days:
+            return None
+        day = after.date()
+        if datetime.combine(day, self.at) <= after:
+            day += timedelta(days=1)
+        if self.start and day < self.start:
+            day = self.start
+        # A matching weekday comes within a week, unless it is excluded
+        for _ in range(7 * (len(self.exclude) + 1)):
+            if self.end and day > self.end:
+                return None
+            if self.occurs_on(day):
+                return datetime.combine(day, self.at)
+            day += timedelta(days=1)
+        return None
+
+    def describe(self):
+        """Vietnamese summary of the days, '' for a plain daily slot"""
+        parts = []
+        days = describe_days(self.days)
+        if days:
+            parts.append(days)
+        if self.start or self.end:
+            parts.append(f"{self.start or '…'} → {self.end or '…'}")
+        if self.exclude:
+            parts.append(f"nghỉ {len(self.exclude)} ngày")
+        return ' · '.join(parts)
+
+
+class TriggerIndex:
+    """Next fire time of every job in a heap, with lazy deletion.
+
+    A job fires ``lead`` seconds before each occurrence of its rule. set()
+    and remove() are O(log n); pop_due() hands back the jobs whose time has
+    come and re-arms each for its next occurrence after now, so occurrences
+    missed while asleep coalesce into one.
+    """
+
+    def __init__(self):
+        self._heap = []  # (fire_time, seq, job_id)
+        self._jobs = {}  # job_id -> (rule, lead, fire_time, seq)
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def set(self, job_id, rule, lead=0.0, now=None):
+        """Add or replace job_id"""
+        self._jobs[job_id] = (rule, lead, None, None)
+        self._arm(job_id, now or datetime.now())
+
+    def remove(self, job_id):
+        self._jobs.pop(job_id, None)
+        self._compact()
+
+    def clear(self):
+        self._heap.clear()
+        self._jobs.clear()
+
+    def _arm(self, job_id, after):
+        rule, lead, _, _ = self._jobs[job_id]
+        lead = timedelta(seconds=lead)
+        occurrence = rule.next_occurrence(after + lead)
+        fire = occurrence - lead if occurrence else None
+        seq = next(self._seq)
+        self._jobs[job_id] = (rule, lead.total_seconds(), fire, seq)
+        if fire is not None:
+            heapq.heappush(self._heap, (fire, seq, job_id))
+        self._compact()
+
+    def _compact(self):
+        # Replaced and removed jobs leave stale entries, rebuild once they dominate
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            self._heap = [(fire, seq, job_id) for job_id, (_, _, fire, seq) in self._jobs.items()
+                          if fire is not None]
+            heapq.heapify(self._heap)
+
+    def peek(self):
+        """Earliest fire time, None if nothing will fire"""
+        heap = self._heap
+        while heap:
+            fire, seq, job_id = heap[0]
+            job = self._jobs.get(job_id)
+            if job is not None and job[3] == seq:
+                return fire
+            heapq.heappop(heap)
+        return None
+
+    def pop_due(self, now):
+        """[(job_id, fire_time)] due at now, each re-armed for its next occurrence"""
+        due = []
+        while True:
+            fire = self.peek()
+            if fire is None or fire > now:
+                return due
+            _, _, job_id = heapq.heappop(self._heap)
+            due.append((job_id, fire))
+            self._arm(job_id, now)
+
+    def next_time(self, job_id):
+        """Next fire time of job_id, None if unknown or finished"""
+        job = self._jobs.get(job_id)
+        return job[2] if job else None
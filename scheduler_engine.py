@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+"""
+Music Scheduler Engine - lõi hẹn giờ và phát nhạc, không phụ thuộc giao diện
+Dùng chung cho GUI (music_scheduler_gui.py) và chế độ headless:
+
+    python music_scheduler_gui.py --headless [--config music_scheduler_config.json]
+    python music_scheduler_gui.py --headless --fleet-coordinator | --fleet-agent HOST:PORT
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.base import STATE_PAUSED, STATE_RUNNING
+from audio_cache import CACHE_DIR, DecodedAudioCache, JingleBank
+from config_store import ConfigStore
+from devices import DeviceRegistry
+from loudness import TARGET_LUFS, LoudnessAnalyzer, track_gain
+from metrics import METRICS, METRICS_LOG, METRICS_PORT, MetricsLog, MetricsServer
+from music_library import LIBRARY_DB, MusicLibrary
+from play_history import CATCH_UP_COALESCE, CATCH_UP_POLICIES, CATCH_UP_SKIP, HISTORY_DB, PlayHistory
+from playback_zone import PlaybackZone
+from schedule_rules import TriggerIndex, valid_entries
+from shuffle import ShuffleEngine
+
+CONFIG_FILE = 'music_scheduler_config.json'
+
+# Chọn bài và decode trước giờ phát bao nhiêu giây
+PREFETCH_LEAD_SECONDS = 15
+
+# Chế độ chính xác: job chạy sớm bao nhiêu giây để mở stream và chờ đúng giờ
+PRECISION_LEAD_SECONDS = 2.0
+
+# Slot bị lỡ (app tắt đúng giờ) vẫn được phát nếu trễ không quá bao nhiêu giây
+CATCH_UP_GRACE_SECONDS = 300
+
+# Nhạc nền giảm bao nhiêu dB khi có thông báo / chuông phát đè lên
+DUCK_DB = -12.0
+
+# Cổng TCP máy điều phối fleet lắng nghe các agent, chỉ localhost nếu không chỉ định
+FLEET_PORT = 8765
+FLEET_HOST = '127.0.0.1'
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None if unknown)"""
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS reports bytes
+        return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / 1024 / 1024
+    except Exception:
+        return None
+
+
+def report_startup(mode, started_at, phases=None, path=None):
+    """Print cold-start time since started_at (perf_counter) and peak RSS.
+
+    phases maps names like 'window' or 'scheduler' to the perf_counter()
+    at which they were reached. With path (a frozen windowed build has no
+    stdout) the report is also written there as JSON, with wall-clock times
+    so a launcher can add the time before Python started.
+    """
+    now = time.perf_counter()
+    phases = dict(phases or {}, ready=now)
+    rss = peak_rss_mb()
+    rss_text = f"{rss:.1f} MB" if rss is not None else "n/a"
+    extra = ''.join(f" {name}={at - started_at:.3f}s" for name, at in phases.items() if name != 'ready')
+    print(f"startup mode={mode} ready={now - started_at:.3f}s rss={rss_text}{extra}", flush=True)
+    if path:
+        wall_offset = time.time() - now
+        report = {'mode': mode, 'rss_mb': rss,
+                  'seconds': {name: at - started_at for name, at in phases.items()},
+                  'wall': {name: at + wall_offset for name, at in phases.items()}}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+class MusicSchedulerEngine:
+    """Scheduling and playback core shared by the GUI and headless modes.
+
+    Each output zone (PlaybackZone) has its own schedules, volume and
+    stream; the engine owns what they share: one APScheduler, the music
+    library, the play history and the decoded-audio cache.
+
+    The engine never touches a UI. Front ends assign the hooks below; they
+    may be called from scheduler or playback threads:
+
+    - on_status(text, kind): kind is 'success', 'primary', 'warning' or 'danger'
+    - on_playback_state(zone, playing): zone's playback controls should be enabled/disabled
+    - on_volume(zone, percent): a schedule changed zone's playback volume
+    - on_scan_progress(done, total, files_per_sec): library scan progress, per batch
+    - on_devices(names): the output device list changed (hot-plug)
+    - on_play_started(zone, slot, first_sample_at): a slot's first song reached the DAC
+    - on_schedules(): a zone's schedules were edited
+    """
+
+    def __init__(self, config_path=CONFIG_FILE, library_db=None, history_db=None):
+        self.config_path = config_path
+        self.config_store = ConfigStore(config_path)
+        self.music_folder = ""
+        self.is_running = False
+        self.catch_up_policy = CATCH_UP_COALESCE
+        self.catch_up_grace = CATCH_UP_GRACE_SECONDS
+        self.crossfade = 0.0  # Seconds between playlist songs, 0 = gapless
+        self.duck_db = DUCK_DB  # Music level under an announcement
+        self.jingle_paths = []  # Clips kept decoded in RAM besides the scheduled overlays
+        self.native_format = True  # Convert songs to the device's rate instead of reopening
+        self.scheduler = BackgroundScheduler()
+        self.job_specs = {}  # job_id -> spec currently in the trigger index
+        # Every schedule lives in one index, APScheduler holds a single wakeup job
+        self.trigger_index = TriggerIndex()
+        self._index_lock = threading.Lock()
+        self._tick_job = None
+        self._tick_at = None
+        self.devices = DeviceRegistry()
+        self.devices.on_changed = lambda names: self._notify('on_devices', names)
+        # Databases live next to the config file
+        self.library = MusicLibrary(library_db or self.data_path(LIBRARY_DB))
+        self.history = PlayHistory(history_db or self.data_path(HISTORY_DB))
+        self.shuffle = ShuffleEngine(self.library, self.history)
+        self.audio_cache = DecodedAudioCache(self.data_path(CACHE_DIR))
+        self.jingles = JingleBank()
+        # Loudness is analyzed after every library refresh, looked up at play time
+        self.normalize_loudness = True
+        self.target_lufs = TARGET_LUFS
+        self.loudness = LoudnessAnalyzer(self.library)
+        self.library.on_refreshed = self.loudness.analyze
+        self.library.on_progress = lambda root, done, total, rate: self._notify(
+            'on_scan_progress', done, total, rate)
+        self.prefetch_lead = PREFETCH_LEAD_SECONDS
+        self.preopen_stream = True
+        self.precision_mode = False  # Start on the exact sample instead of the next block
+        self.precision_lead = PRECISION_LEAD_SECONDS
+        self.start_skews = deque(maxlen=100)  # (slot, skew seconds)
+        self.zones = [PlaybackZone(self)]  # The main zone always comes first
+        self.metrics_port = METRICS_PORT  # 0 = no HTTP endpoint
+        self.metrics_server = None
+        self.metrics_log = None
+        self.register_metrics()
+
+        self.on_status = None
+        self.on_playback_state = None
+        self.on_volume = None
+        self.on_scan_progress = None
+        self.on_devices = None
+        self.on_play_started = None
+        self.on_schedules = None
+
+    @property
+    def main_zone(self):
+        return self.zones[0]
+
+    @property
+    def audio_devices(self):
+        """Names of the output devices found at the last scan"""
+        return self.devices.names
+
+    def data_path(self, name):
+        """Path of a data file stored next to the config file"""
+        return os.path.join(os.path.dirname(os.path.abspath(self.config_path)), name)
+
+    def _notify(self, hook, *args):
+        callback = getattr(self, hook)
+        if callback:
+            callback(*args)
+
+    def get_zone(self, name):
+        """Zone called name, or None"""
+        for zone in self.zones:
+            if zone.name == name:
+                return zone
+        return None
+
+    def add_zone(self, name, device_name=None):
+        """Thêm zone mới, trả về None nếu tên đã có"""
+        if not name or '/' in name or self.get_zone(name):
+            return None
+        zone = PlaybackZone(self, name, device_name)
+        self.zones.append(zone)
+        self.schedules_changed()
+        return zone
+
+    def remove_zone(self, zone):
+        """Xóa zone (trừ zone chính) cùng các lịch của nó"""
+        if zone is self.main_zone:
+            return
+        self.zones.remove(zone)
+        zone.stop()
+        self.schedules_changed()
+        zone.shutdown()
+
+    def schedules_changed(self):
+        """Save and update the scheduler after a zone's schedules changed"""
+        self.save_config()
+        self._notify('on_schedules')
+
+        # Update scheduler if running
+        if self.is_running:
+            self.update_scheduler_jobs()
+
+    def set_music_folder(self, folder):
+        """Đổi folder nhạc và index lại ở background"""
+        self.music_folder = folder
+        self.save_config()
+        self.library.refresh_async(folder)
+
+    def register_metrics(self):
+        """Gauges read from the shared components at collection time"""
+        cache = self.audio_cache
+        METRICS.gauge('audio_cache_hits', lambda: cache.hits, "Opens served from the RAM tier")
+        METRICS.gauge('audio_cache_disk_hits', lambda: cache.disk_hits, "Opens served from spilled .pcm files")
+        METRICS.gauge('audio_cache_misses', lambda: cache.misses, "Opens that had to decode")
+        METRICS.gauge('audio_cache_hit_ratio', lambda: cache.hit_rate, "Share of opens without decoding")
+        METRICS.gauge('audio_cache_memory_bytes', lambda: cache._memory_bytes, "Decoded PCM held in RAM")
+        METRICS.gauge('playback_start_skew_abs_p95_seconds', lambda: self.start_accuracy()['p95'],
+                      "95th percentile of |start skew| over the last plays")
+        METRICS.gauge('playback_start_skew_abs_max_seconds', lambda: self.start_accuracy()['max'],
+                      "Largest |start skew| over the last plays")
+        METRICS.gauge('scheduler_running', lambda: int(self.is_running), "1 while schedules are active")
+
+    def start_metrics(self):
+        """Start the local Prometheus endpoint and the rolling JSON log"""
+        if self.metrics_log is None:
+            self.metrics_log = MetricsLog(self.data_path(METRICS_LOG))
+        if self.metrics_port and self.metrics_server is None:
+            try:
+                self.metrics_server = MetricsServer(port=self.metrics_port)
+                print(f"📈 Metrics: http://127.0.0.1:{self.metrics_server.port}/metrics")
+            except OSError as e:
+                print(f"Không mở được cổng metrics {self.metrics_port}: {e}")
+
+    def cancel_scan(self):
+        """Hủy quét thư viện, phần đã quét được giữ lại"""
+        self.library.cancel_refresh()
+
+    def library_roots(self):
+        """The music folder plus the folders set on individual schedules"""
+        roots = [self.music_folder] if self.music_folder else []
+        for zone in self.zones:
+            for *_, folder in zone.iter_schedules():
+                if folder and folder not in roots:
+                    roots.append(folder)
+        return roots
+
+    def watch_library(self):
+        """Keep the library index fresh in the background (mtime diff)"""
+        self.library.watch(self.library_roots)
+
+    def watch_devices(self):
+        """Pick up hot-plugged output devices while no zone is playing"""
+        self.devices.watch(lambda: all([zone.player.release() for zone in self.zones]),
+                           lambda: all(zone.player.stream is None for zone in self.zones))
+
+    def get_random_song(self, folder=None):
+        """Lấy bài hát ngẫu nhiên, từ folder riêng của lịch nếu có"""
+        folder = folder or self.music_folder
+        if not folder or not os.path.exists(folder):
+            return None
+
+        return self.shuffle.pick(folder)
+
+    @property
+    def duck_gain(self):
+        return 10 ** (self.duck_db / 20)
+
+    def preload_jingles(self):
+        """Decode the jingles and every scheduled overlay in the background"""
+        paths = list(self.jingle_paths)
+        for zone in self.zones:
+            paths += [entry['overlay'] for entry in zone.scheduled_times if entry.get('overlay')]
+        threading.Thread(target=self.jingles.preload, args=(dict.fromkeys(paths),), daemon=True).start()
+
+    def open_source(self, song, offset=0.0, duration=None):
+        """Open song (or offset/duration seconds of it) through the shared
+        cache with its normalization gain"""
+        source = self.audio_cache.open(song, offset, duration)
+        if self.normalize_loudness:
+            analyzed = self.library.loudness(song)
+            if analyzed:
+                source.gain = track_gain(*analyzed, target=self.target_lufs)
+        return source
+
+    def record_start_skew(self, slot, scheduled_at, started_at):
+        """Log how far the first sample landed from the scheduled time"""
+        skew = started_at - scheduled_at.timestamp()
+        self.start_skews.append((slot, skew))
+        accuracy = self.start_accuracy()
+        print(f"⏱️ {slot}: bắt đầu lệch {skew * 1000:+.2f} ms "
+              f"(p95 {accuracy['p95'] * 1000:.2f} ms, max {accuracy['max'] * 1000:.2f} ms, "
+              f"{accuracy['count']} lần)")
+        return skew
+
+    def start_accuracy(self):
+        """Achieved start accuracy over the recent plays, |skew| in seconds"""
+        skews = sorted(abs(skew) for _, skew in self.start_skews)
+        if not skews:
+            return {'count': 0, 'mean': None, 'p95': None, 'max': None}
+        return {'count': len(skews), 'mean': sum(skews) / len(skews),
+                'p95': skews[min(int(0.95 * len(skews)), len(skews) - 1)], 'max': skews[-1]}
+
+    def desired_jobs(self):
+        """Job specs for every zone's schedules: {job_id: (func, args, rule, lead, grace)}"""
+        # Misfires while running (e.g. the PC slept) follow the catch-up policy
+        grace = 1 if self.catch_up_policy == CATCH_UP_SKIP else self.catch_up_grace
+
+        jobs = {}
+        for zone in self.zones:
+            jobs.update(zone.desired_jobs(grace))
+        return jobs
+
+    def update_scheduler_jobs(self):
+        """Cập nhật các jobs trong scheduler - chỉ thêm/sửa/xóa job thay đổi"""
+        desired = self.desired_jobs()
+        now = datetime.now()
+
+        with self._index_lock:
+            # Xóa jobs không còn trong lịch
+            for job_id in list(self.job_specs):
+                if job_id not in desired:
+                    self.trigger_index.remove(job_id)
+                    del self.job_specs[job_id]
+
+            # Thêm jobs mới, sửa jobs đã đổi; jobs không đổi giữ nguyên lần chạy kế tiếp
+            for job_id, spec in desired.items():
+                current = self.job_specs.get(job_id)
+                if current == spec:
+                    continue
+                func, args, rule, lead, grace = spec
+                if current is None or current[2:4] != (rule, lead):
+                    self.trigger_index.set(job_id, rule, lead, now)
+                self.job_specs[job_id] = spec
+            self._arm_tick()
+
+        for zone in self.zones:
+            zone.discard_stale_prefetches(desired)
+
+    def _arm_tick(self):
+        """Point the single APScheduler date job at the index's earliest time"""
+        fire = self.trigger_index.peek()
+        if fire == self._tick_at:
+            return
+        if self._tick_job is not None:
+            try:
+                self._tick_job.remove()
+            except JobLookupError:
+                pass  # Already fired
+        self._tick_at = fire
+        self._tick_job = None
+        if fire is not None:
+            self._tick_job = self.scheduler.add_job(self._on_tick, 'date', run_date=fire,
+                                                    misfire_grace_time=None)
+
+    def _on_tick(self):
+        """Run every job that is due and re-arm the wakeup for the next one"""
+        now = datetime.now()
+        with self._index_lock:
+            # A date job removes itself once it fired
+            self._tick_job = self._tick_at = None
+            due = [(self.job_specs[job_id], fire) for job_id, fire in self.trigger_index.pop_due(now)]
+            self._arm_tick()
+
+        for (func, args, rule, lead, grace), fire in due:
+            # Late wakeups (paused, PC asleep) only run within the grace time
+            if (now - fire).total_seconds() > grace:
+                continue
+            # Each job gets its own worker, a precise play waits for its sample
+            self.scheduler.add_job(func, args=args, misfire_grace_time=None)
+
+    def start(self):
+        """Bắt đầu scheduler, raise ValueError nếu cấu hình chưa đủ"""
+        if not self.music_folder:
+            raise ValueError("Vui lòng chọn folder nhạc!")
+
+        if not any(zone.scheduled_times for zone in self.zones):
+            raise ValueError("Vui lòng thêm ít nhất một lịch phát nhạc!")
+
+        self.is_running = True
+        self._notify('on_status', "▶️ Đang chạy - Chờ đến giờ phát nhạc...", 'success')
+
+        # Start APScheduler, or resume it with its jobs untouched
+        self.update_scheduler_jobs()
+        if self.scheduler.state == STATE_PAUSED:
+            self.scheduler.resume()
+        elif not self.scheduler.running:
+            self.scheduler.start()
+        # On a worker like any play: picking a song may have to index the folder first
+        for zone in self.zones:
+            self.scheduler.add_job(zone.catch_up_missed, args=(self.catch_up_policy, self.catch_up_grace),
+                                   misfire_grace_time=None)
+
+    def stop(self, keep_playing=False):
+        """Dừng scheduler, keep_playing lets the current songs finish"""
+        self.is_running = False
+        if not keep_playing:
+            for zone in self.zones:
+                zone.stop()
+
+        # Pause scheduler, jobs stay registered for the next start
+        if self.scheduler.state == STATE_RUNNING:
+            self.scheduler.pause()
+
+        self._notify('on_status', "⏹️ Đã dừng", 'danger')
+
+    def shutdown(self):
+        """Stop everything before the process exits"""
+        self.stop()
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        for zone in self.zones:
+            zone.shutdown()
+        self.devices.close()
+        self.loudness.close()
+        self.library.close()
+        self.history.close()
+        self.config_store.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        if self.metrics_log:
+            self.metrics_log.close()
+
+    def save_config(self):
+        """Lưu cấu hình - ghi gộp ở background, không chặn thread gọi"""
+        # The main zone keeps the original top-level keys
+        main = self.main_zone
+        self.config_store.save({
+            'music_folder': self.music_folder,
+            'scheduled_times': main.scheduled_times,
+            'audio_device': main.device_name,
+            'catch_up_policy': self.catch_up_policy,
+            'catch_up_grace_seconds': self.catch_up_grace,
+            'crossfade_seconds': self.crossfade,
+            'duck_db': self.duck_db,
+            'jingles': self.jingle_paths,
+            'device_native_format': self.native_format,
+            'normalize_loudness': self.normalize_loudness,
+            'target_lufs': self.target_lufs,
+            'metrics_port': self.metrics_port,
+            'precision_mode': self.precision_mode,
+            'precision_lead_seconds': self.precision_lead,
+            'shuffle_no_repeat': self.shuffle.no_repeat,
+            'shuffle_weights': self.shuffle.weights,
+            'shuffle_recency_bias': self.shuffle.recency_bias,
+            'zones': [zone.to_config() for zone in self.zones[1:]]
+        })
+
+    def load_config(self):
+        """Tải cấu hình"""
+        config = self.config_store.load()
+        try:
+            self.music_folder = config.get('music_folder', '')
+            policy = config.get('catch_up_policy', self.catch_up_policy)
+            if policy in CATCH_UP_POLICIES:
+                self.catch_up_policy = policy
+            self.catch_up_grace = config.get('catch_up_grace_seconds', self.catch_up_grace)
+            self.crossfade = float(config.get('crossfade_seconds', self.crossfade))
+            self.duck_db = float(config.get('duck_db', self.duck_db))
+            self.jingle_paths = list(config.get('jingles', self.jingle_paths))
+            self.native_format = bool(config.get('device_native_format', self.native_format))
+            self.normalize_loudness = config.get('normalize_loudness', self.normalize_loudness)
+            self.target_lufs = float(config.get('target_lufs', self.target_lufs))
+            self.metrics_port = int(config.get('metrics_port', self.metrics_port))
+            self.precision_mode = bool(config.get('precision_mode', self.precision_mode))
+            self.precision_lead = float(config.get('precision_lead_seconds', self.precision_lead))
+            self.shuffle.configure(int(config.get('shuffle_no_repeat', self.shuffle.no_repeat)),
+                                   dict(config.get('shuffle_weights', self.shuffle.weights)),
+                                   float(config.get('shuffle_recency_bias', self.shuffle.recency_bias)))
+
+            main = self.main_zone
+            main.scheduled_times = valid_entries(config.get('scheduled_times', []))
+            # An unplugged device is kept, zones use the default until it is back
+            if config.get('audio_device'):
+                main.device_name = config['audio_device']
+
+            for entry in config.get('zones', []):
+                if self.get_zone(entry['name']):
+                    continue
+                zone = PlaybackZone(self, entry['name'], entry.get('audio_device'),
+                                    valid_entries(entry.get('scheduled_times', [])),
+                                    entry.get('volume', 70))
+                self.zones.append(zone)
+
+            for zone in self.zones:
+                zone.player.crossfade = self.crossfade
+                zone.player.duck_gain = self.duck_gain
+                zone.player.native_format = self.native_format
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Cấu hình không hợp lệ {self.config_path}: {e}")
+
+        if self.music_folder:
+            self.library.refresh_async(self.music_folder)
+        self.preload_jingles()
+
+
+def build_arg_parser():
+    """Command line options shared by the GUI and headless entry points"""
+    parser = argparse.ArgumentParser(description="Music Scheduler - hẹn giờ phát nhạc")
+    parser.add_argument('--headless', action='store_true',
+                        help="chạy không giao diện, chỉ scheduler và phát nhạc")
+    parser.add_argument('--config', default=CONFIG_FILE,
+                        help="đường dẫn file cấu hình JSON")
+    parser.add_argument('--startup-report', nargs='?', const=True, metavar='FILE',
+                        help="in thời gian khởi động và RSS khi sẵn sàng, ghi thêm JSON vào FILE nếu có")
+    parser.add_argument('--exit-after-startup', action='store_true',
+                        help="thoát ngay sau khi khởi động xong (dùng để đo)")
+    fleet = parser.add_mutually_exclusive_group()
+    fleet.add_argument('--fleet-coordinator', action='store_true',
+                       help="điều phối các máy agent: đẩy lịch, thư viện nhạc và lệnh phát đồng bộ")
+    fleet.add_argument('--fleet-agent', metavar='HOST:PORT',
+                       help="chạy như agent, nhận lệnh từ máy điều phối")
+    parser.add_argument('--fleet-port', type=int, default=FLEET_PORT,
+                        help="cổng TCP của máy điều phối")
+    parser.add_argument('--fleet-host', default=FLEET_HOST,
+                        help="địa chỉ máy điều phối lắng nghe, vd 0.0.0.0 cho cả mạng LAN (cần --fleet-token)")
+    parser.add_argument('--fleet-token',
+                        help="mã bí mật chung giữa máy điều phối và các agent")
+    parser.add_argument('--fleet-name', help="tên agent (mặc định: tên máy)")
+    return parser
+
+
+def startup_report_path(args):
+    """JSON file given to --startup-report, None when it was given alone"""
+    return args.startup_report if isinstance(args.startup_report, str) else None
+
+
+def run_headless(args, started_at):
+    """Chạy scheduler không giao diện cho tới khi Ctrl+C"""
+    engine = MusicSchedulerEngine(args.config)
+    engine.on_status = lambda text, kind: print(text, flush=True)
+    engine.load_config()
+    engine.watch_library()
+    engine.watch_devices()
+    engine.start_metrics()
+
+    try:
+        engine.start()
+    except ValueError as e:
+        print(f"Lỗi: {e} ({args.config})")
+        engine.shutdown()
+        return 1
+
+    if args.startup_report:
+        report_startup('headless', started_at, {'scheduler': time.perf_counter()},
+                       startup_report_path(args))
+    if args.exit_after_startup:
+        engine.shutdown()
+        return 0
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    engine.shutdown()
+    return 0
+
+
+def main(argv=None, started_at=None):
+    started_at = started_at or time.perf_counter()
+    args = build_arg_parser().parse_args(argv)
+    if args.fleet_coordinator or args.fleet_agent:
+        from fleet import run_fleet
+        return run_fleet(args)
+    return run_headless(args, started_at)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Chọn bài ngẫu nhiên có trọng số, không lặp lại bài vừa phát
+Each folder gets an alias table (Vose) so a weighted draw is O(1); draws
+that hit one of the last N picks are rejected and drawn again. Weights come
+from per-folder multipliers and a bias towards songs not played for a long
+time. Picks are remembered in memory at once and in the play history
+database when the song actually starts, so a pick never waits on disk.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+NO_REPEAT_TRACKS = 50  # A song is not picked again within this many picks
+RECENCY_BIAS = 1.0  # Extra weight of a song not played for RECENCY_HORIZON, 0 = off
+RECENCY_HORIZON_SECONDS = 30 * 86400
+REBUILD_AFTER_SECONDS = 6 * 3600  # Refresh the recency weights this often
+MAX_DRAWS = 64  # Rejected draws before falling back to the oldest candidate
+
+
+class AliasTable:
+    """Weighted sampling over a fixed list in O(1) per draw (Vose's alias method)"""
+
+    def __init__(self, items, weights):
+        n = len(items)
+        total = sum(weights)
+        if total <= 0:
+            weights, total = [1.0] * n, float(n)
+        scaled = [w * n / total for w in weights]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large[-1]
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            if scaled[l] < 1.0:
+                small.append(large.pop())
+        self.items = items
+        self.prob = prob
+        self.alias = alias
+
+    def draw(self, rng):
+        i = rng.randrange(len(self.items))
+        return self.items[i if rng.random() < self.prob[i] else self.alias[i]]
+
+
+class ShuffleEngine:
+    """Weighted, no-repeat song picks over the library's folders.
+
+    weights maps a folder name to a multiplier; a song's weight is the
+    product over the folders on its path below the music folder, so
+    {"Nhạc Xuân": 0} keeps that folder out and {"Acoustic": 2} plays it twice
+    as often. The library has no tags, folder names serve as tags.
+    """
+
+    def __init__(self, library, history, no_repeat=NO_REPEAT_TRACKS, weights=None,
+                 recency_bias=RECENCY_BIAS):
+        self.library = library
+        self.history = history
+        self.no_repeat = no_repeat
+        self.weights = weights or {}
+        self.recency_bias = recency_bias
+        self._lock = threading.Lock()
+        self._tables = {}  # root -> [library generation it was built from, AliasTable, built at]
+        self._recent = None  # path -> pick serial, oldest first; loaded on first pick
+        self._serial = 0
+        self._rng = random.Random()
+
+    def configure(self, no_repeat=None, weights=None, recency_bias=None):
+        """Change the settings; tables are rebuilt on the next pick"""
+        with self._lock:
+            if no_repeat is not None:
+                self.no_repeat = no_repeat
+            if weights is not None:
+                self.weights = weights
+            if recency_bias is not None:
+                self.recency_bias = recency_bias
+            self._tables.clear()
+            self._recent = None
+
+    def _folder_weight(self, root, folder):
+        weight = 1.0
+        for part in Path(os.path.relpath(folder, root)).parts:
+            weight *= self.weights.get(part, 1.0)
+        return weight
+
+    def _table(self, root, paths, generation):
+        built = self._tables.get(root)
+        if built and built[0] == generation and time.monotonic() - built[2] < REBUILD_AFTER_SECONDS:
+            return built
+        weights = [1.0] * len(paths)
+        if self.weights:
+            folders = {}  # Songs share folders, weigh each folder once
+            for i, path in enumerate(paths):
+                folder = os.path.dirname(path)
+                if folder not in folders:
+                    folders[folder] = self._folder_weight(root, folder)
+                weights[i] = folders[folder]
+        if self.recency_bias:
+            last_played = self.history.track_last_played()
+            now = time.time()
+            bias, horizon = self.recency_bias, RECENCY_HORIZON_SECONDS
+            for i, path in enumerate(paths):
+                played = last_played.get(path)
+                staleness = 1.0 if played is None else min((now - played) / horizon, 1.0)
+                weights[i] *= 1.0 + bias * staleness
+        built = self._tables[root] = [generation, AliasTable(paths, weights), time.monotonic()]
+        return built
+
+    def _load_recent(self):
+        self._recent = OrderedDict()
+        for path in self.history.recent_tracks(self.no_repeat):
+            self._serial += 1
+            self._recent[path] = self._serial
+
+    def pick(self, root):
+        """Pick a song under root as a Path, or None if the folder is empty"""
+        # Read before the list: a refresh in between only costs a rebuild next pick
+        generation = self.library.generation(root)
+        paths = self.library.tracks(root)
+        if not paths:
+            # First use of this folder: index it synchronously once
+            self.library.refresh(root)
+            generation = self.library.generation(root)
+            paths = self.library.tracks(root)
+            if not paths:
+                return None
+
+        with self._lock:
+            if self._recent is None:
+                self._load_recent()
+            built = self._table(root, paths, generation)
+            table, recent = built[1], self._recent
+            # Small folders get a shorter window, or every draw would be rejected
+            window = min(self.no_repeat, len(paths) // 2)
+            oldest_serial = self._serial - window
+
+            candidate = None
+            for _ in range(MAX_DRAWS):
+                path = table.draw(self._rng)
+                serial = recent.get(path, 0)
+                if serial <= oldest_serial:
+                    candidate = path
+                    break
+                if candidate is None or serial < recent.get(candidate, 0):
+                    candidate = path
+
+            self._serial += 1
+            recent[candidate] = self._serial
+            recent.move_to_end(candidate)
+            while len(recent) > self.no_repeat:
+                recent.popitem(last=False)
+
+        return Path(candidate)
+
+    def mark_played(self, path):
+        """Persist that path started playing, it survives restarts in the window"""
+        self.history.mark_track_played(path)